@@ -0,0 +1,140 @@
+"""
+Reproducible local cold-start benchmark for the inference container.
+
+Every run starts a fresh interpreter (python -X importtime) that does what a cold Lambda
+execution environment does before the first file is scored: import the handler module, import
+the hot-path libraries of the configured engine, load the model from disk and score one small
+row group. Phases are timed inside the child, the whole process is timed by the parent, and the
+import-time log is aggregated per top-level package so a heavy new dependency is easy to spot.
+
+Run it inside the Lambda image to check lambda/Dockerfile dependencies, e.g.
+    docker run --rm -v "$PWD:/src" --entrypoint python <image> /src/benchmarks/bench_cold_start.py
+
+Usage:
+    python benchmarks/bench_cold_start.py --runs 5 [--budget-ms 3000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+
+CHILD = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.warm_imports()
+t2 = time.perf_counter()
+if app.INFERENCE_ENGINE == 'compiled':
+    model = app.lazy_import('forest').CompiledForest.load(sys.argv[1], mmap_mode='r')
+else:
+    model = app.lazy_import('joblib').load(sys.argv[2], mmap_mode='r')
+t3 = time.perf_counter()
+np = app.lazy_import('numpy')
+pa = app.lazy_import('pyarrow')
+rng = np.random.default_rng(0)
+names = app.model_features(model)
+table = pa.table({name: rng.normal(size=1000) for name in app.lazy_import('rolling').base_features(names)})
+app.score_table(model, table, app.lazy_import('rolling').RollingFeatures(names))
+t4 = time.perf_counter()
+print(json.dumps({
+    'import_handler_ms': (t1 - t0) * 1000,
+    'hot_path_imports_ms': (t2 - t1) * 1000,
+    'model_load_ms': (t3 - t2) * 1000,
+    'first_score_ms': (t4 - t3) * 1000,
+    'modules_loaded': len(sys.modules),
+    'pandas_loaded': 'pandas' in sys.modules,
+    'sklearn_loaded': 'sklearn' in sys.modules,
+}))
+'''
+
+
+def build_models(work_dir):
+    import joblib
+    import numpy as np
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+
+    sys.path.insert(0, LAMBDA_DIR)
+    from features import FEATURES
+    from forest import CompiledForest
+
+    rng = np.random.default_rng(42)
+    X = pd.DataFrame(rng.normal(size=(50_000, len(FEATURES))), columns=FEATURES)
+    y = (X.iloc[:, 0] - X.iloc[:, 2] + rng.normal(size=len(X)) > 1.2).astype(int)
+    model = RandomForestClassifier(n_estimators=50, max_depth=10, random_state=42, n_jobs=-1).fit(X, y)
+    joblib_path = os.path.join(work_dir, 'model.joblib')
+    joblib.dump(model, joblib_path)
+    compiled_dir = os.path.join(work_dir, 'forest')
+    CompiledForest.from_sklearn(model).save_dir(compiled_dir)
+    return compiled_dir, joblib_path
+
+
+def import_breakdown(stderr):
+    """Cumulative import time per top-level package, from the -X importtime log."""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name_field = line[len('import time:'):].split('|')
+        # Nested imports are indented by two spaces per level; only top-level entries are
+        # summed because their cumulative time already includes everything they pulled in.
+        if name_field.startswith('   '):
+            continue
+        package = name_field.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(cumulative_us) / 1000
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--engines', default='compiled-no-pandas,compiled,sklearn',
+                        help='comma separated: sklearn, compiled, compiled-no-pandas (compiled with NO_PANDAS=1)')
+    parser.add_argument('--budget-ms', type=float, help='fail if the median process time of any engine exceeds this')
+    args = parser.parse_args()
+
+    over_budget = False
+    with tempfile.TemporaryDirectory() as work_dir:
+        compiled_dir, joblib_path = build_models(work_dir)
+        for engine in args.engines.split(','):
+            env = dict(os.environ, INFERENCE_ENGINE=engine.split('-')[0], PYTHONPATH=LAMBDA_DIR, PYTHONDONTWRITEBYTECODE='1')
+            if engine.endswith('-no-pandas'):
+                env['NO_PANDAS'] = '1'
+            runs = []
+            imports = {}
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                child = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', CHILD, compiled_dir, joblib_path],
+                    env=env, check=True, capture_output=True, text=True
+                )
+                result = json.loads(child.stdout.strip().splitlines()[-1])
+                result['process_ms'] = (time.perf_counter() - start) * 1000
+                runs.append(result)
+                imports = import_breakdown(child.stderr)
+
+            print(f"\n=== engine: {engine} ({args.runs} cold runs, median) ===")
+            for phase in ('import_handler_ms', 'hot_path_imports_ms', 'model_load_ms', 'first_score_ms', 'process_ms'):
+                print(f"  {phase:<22} {statistics.median(run[phase] for run in runs):>9.1f}")
+            print(f"  modules loaded: {runs[-1]['modules_loaded']} | pandas: {runs[-1]['pandas_loaded']} | sklearn: {runs[-1]['sklearn_loaded']}")
+            print("  heaviest top-level imports (ms):")
+            for name, ms in sorted(imports.items(), key=lambda item: -item[1])[:10]:
+                print(f"    {name:<28} {ms:>8.1f}")
+
+            median_process = statistics.median(run['process_ms'] for run in runs)
+            if args.budget_ms is not None and median_process > args.budget_ms:
+                print(f"  OVER BUDGET: {median_process:.0f} ms > {args.budget_ms:.0f} ms")
+                over_budget = True
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark: throughput and end-to-end latency of the streaming consumer (lambda/consumer.py).
+
+A producer thread replays synthetic 1 Hz readings of several wells as JSON records, at a fixed
+rate or as fast as possible, into an in-process queue or a JSON-lines file followed by
+FileTailStream. The consumer scores them into a local curated bucket (LocalS3Client in a temp
+dir). For every max-latency setting it reports:
+
+  throughput      records scored per second of wall time
+  detection p50/p99  time from a record being sent to its score being known (batching + scoring)
+  durable         time from the first record to the first completed curated file (file-seconds)
+
+Usage:
+    python benchmarks/bench_consumer.py --wells 4 --seconds 20 --rate 5000 --latency-ms 50 250 1000
+    python benchmarks/bench_consumer.py --stream file --rate 0   # as fast as possible
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+
+def train_model():
+    import numpy as np
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    from features import FEATURES
+
+    rng = np.random.default_rng(42)
+    X = pd.DataFrame(rng.normal(size=(20_000, len(FEATURES))), columns=FEATURES)
+    y = (X.iloc[:, 0] - X.iloc[:, 1] + rng.normal(size=len(X)) > 1.2).astype(int)
+    return RandomForestClassifier(n_estimators=50, max_depth=10, random_state=42, n_jobs=1).fit(X, y)
+
+
+def readings(wells, count, sensors):
+    """JSON records of `wells` wells at 1 Hz, interleaved as they would arrive, `count` in total."""
+    import numpy as np
+
+    rng = np.random.default_rng(7)
+    start = np.datetime64('2020-01-01T00:00:00')
+    values = rng.normal(size=(count, len(sensors)))
+    for i in range(count):
+        reading = dict(zip(sensors, values[i].tolist()))
+        reading['well'] = f"WELL-{i % wells + 1:05d}"
+        reading['timestamp'] = str(start + np.timedelta64(i // wells, 's'))
+        yield reading
+
+
+def produce(put, wells, count, rate, sensors):
+    started = time.time()
+    for i, reading in enumerate(readings(wells, count, sensors)):
+        if rate:
+            delay = started + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        reading['sent_at'] = time.time()
+        put(reading)
+
+
+def run(stream_kind, model, args, latency_ms, work_dir):
+    import numpy as np
+    import app
+    import consumer
+    from s3io import LocalS3Client
+
+    sensors = app.lazy_import('rolling').base_features(app.model_features(model))
+    count = args.rate * args.seconds if args.rate else args.records
+    root = tempfile.mkdtemp(dir=work_dir)
+    if stream_kind == 'memory':
+        stream = consumer.InProcessStream()
+        put = stream.put
+        close = lambda: None
+    else:
+        path = os.path.join(root, 'readings.jsonl')
+        stream = consumer.FileTailStream(path, os.path.join(root, 'readings.offset'), poll_seconds=0.01)
+        handle = open(path, 'a', buffering=1)
+        put = lambda reading: handle.write(json.dumps(reading) + '\n')
+        close = handle.close
+
+    latencies = []
+    first_file = []
+
+    def on_scored(table, sent_at, scored_at):
+        latencies.append(scored_at - sent_at)
+
+    client = LocalS3Client(root)
+    worker = consumer.StreamConsumer(stream, model=model, s3_client=client, bucket='curated',
+                                     max_batch_records=args.batch_records, max_latency_ms=latency_ms,
+                                     file_seconds=args.file_seconds, on_scored=on_scored)
+    complete_files = worker.complete_files
+
+    def timed_complete():
+        if worker.files and not first_file:
+            first_file.append(time.time())
+        complete_files()
+    worker.complete_files = timed_complete
+
+    producer = threading.Thread(target=lambda: (produce(put, args.wells, count, args.rate, sensors), close()))
+    started = time.time()
+    producer.start()
+    worker.run(stop=lambda: not producer.is_alive() and worker.stats['records'] >= count)
+    elapsed = time.time() - started
+    producer.join()
+
+    latencies = np.concatenate(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'stream': stream_kind,
+        'max_latency_ms': latency_ms,
+        'records': worker.stats['records'],
+        'batches': worker.stats['batches'],
+        'files': worker.stats['files'],
+        'records_per_s': worker.stats['records'] / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'durable_s': first_file[0] - started if first_file else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stream', choices=['memory', 'file', 'both'], default='both')
+    parser.add_argument('--wells', type=int, default=4)
+    parser.add_argument('--rate', type=int, default=2000, help="Records per second in total, 0 = as fast as possible")
+    parser.add_argument('--seconds', type=int, default=10, help="Duration of a paced run")
+    parser.add_argument('--records', type=int, default=200_000, help="Records of an unpaced run (--rate 0)")
+    parser.add_argument('--latency-ms', type=float, nargs='+', default=[50, 250, 1000])
+    parser.add_argument('--batch-records', type=int, default=5000)
+    parser.add_argument('--file-seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print("Training a small model...")
+    model = train_model()
+    kinds = ['memory', 'file'] if args.stream == 'both' else [args.stream]
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for kind in kinds:
+            for latency_ms in args.latency_ms:
+                results.append(run(kind, model, args, latency_ms, work_dir))
+                print(f"  {kind} stream, max latency {latency_ms:g} ms: done")
+
+    print(f"\n{'stream':<8} {'max lat (ms)':>12} {'records':>10} {'batches':>8} {'files':>6} {'rec/s':>10} "
+          f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'durable (s)':>12}")
+    for r in results:
+        print(f"{r['stream']:<8} {r['max_latency_ms']:>12g} {r['records']:>10,} {r['batches']:>8,} {r['files']:>6} "
+              f"{r['records_per_s']:>10,.0f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['durable_s']:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
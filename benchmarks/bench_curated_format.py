@@ -0,0 +1,170 @@
+"""
+Benchmark: size and scan speed of the curated parquet encodings (lambda/curated_format.py).
+
+Generates one synthetic 3W-like file (synthetic_3w.py), scores it row group by row group with
+a small forest through app.score_table, and writes the scored rows in every variant:
+
+  original   the first Lambda's output: every raw column plus an int64 anomaly_flag, written with
+             the pyarrow defaults (snappy, dictionary), like inference_df.to_parquet()
+  projected  the model's sensors only, pyarrow defaults (score_parquet without an encoding)
+  default    CuratedEncoding() as configured by default: int64 flags, zstd 3, delta timestamps,
+             byte-stream-split floats, timestamp-sorted row groups with statistics and page index
+  compact    float32 sensors, bool flags, zstd 9
+  minimal    compact, keeping only P-PDG besides timestamp, flag and score
+  bloom      default plus a bloom filter on timestamp (where pyarrow can write one)
+
+Then it times, best of --repeat, reads of every file:
+
+  full    pq.read_table of the whole file
+  flags   the anomaly_flag column only, summed
+  range   timestamp, P-PDG and anomaly_flag of a 1% time window (row group statistics pruning)
+  point   DuckDB count of one exact timestamp (statistics and, if present, bloom filter)
+
+Usage:
+    python benchmarks/bench_curated_format.py --rows 2000000 --row-group-size 65536
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+
+def scored_row_groups(raw_path, model):
+    """[(raw row group with every column, scored row group)] like score_parquet produces them."""
+    import pyarrow.parquet as pq
+    import app
+    from rolling import RollingFeatures
+
+    state = RollingFeatures(app.model_features(model))
+    parquet_file = pq.ParquetFile(raw_path)
+    groups = []
+    for row_group in range(parquet_file.num_row_groups):
+        raw = parquet_file.read_row_group(row_group, use_pandas_metadata=True)
+        projected = parquet_file.read_row_group(row_group, columns=state.bases, use_pandas_metadata=True)
+        scored = app.score_table(model, projected, state)
+        if scored is not None:
+            groups.append((raw, scored))
+    return groups
+
+
+def train_model(raw_path):
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    from features import FEATURES
+
+    frame = pd.read_parquet(raw_path, columns=FEATURES + ['class']).dropna().iloc[::10]
+    return RandomForestClassifier(n_estimators=20, max_depth=8, random_state=42, n_jobs=1).fit(
+        frame[FEATURES], (frame['class'] > 0).astype(int))
+
+
+def variants():
+    from curated_format import BLOOM_FILTERS_SUPPORTED, CuratedEncoding
+
+    compact = dict(flag_type='bool', sensor_type='float32', compression_level=9)
+    found = {
+        'original': ('raw', None),
+        'projected': ('scored', None),
+        'default': ('scored', CuratedEncoding()),
+        'compact': ('scored', CuratedEncoding(**compact)),
+        'minimal': ('scored', CuratedEncoding(columns=['P-PDG', 'anomaly_score'], **compact)),
+    }
+    if BLOOM_FILTERS_SUPPORTED:
+        found['bloom'] = ('scored', CuratedEncoding(bloom_filter_columns=['timestamp']))
+    return found
+
+
+def write_variant(path, groups, source, encoding):
+    import pyarrow as pa
+    from layout import ParquetFileSink
+
+    with open(path, 'wb') as f:
+        sink = ParquetFileSink(f, encoding=encoding)
+        for raw, scored in groups:
+            if source == 'raw':
+                # The rows that were scored, with all of their raw columns
+                if scored.num_rows < raw.num_rows:
+                    raw = raw.filter(pa.array(valid_rows(raw, scored)))
+                sink.write_table(raw.append_column('anomaly_flag', scored.column('anomaly_flag')))
+            else:
+                sink.write_table(scored)
+        sink.writer.close()
+    return os.path.getsize(path)
+
+
+def valid_rows(raw, scored):
+    """The mask of raw rows that survived the NaN filter of score_table (matched by timestamp)."""
+    import numpy as np
+    return np.isin(raw.column('timestamp').to_numpy(), scored.column('timestamp').to_numpy())
+
+
+def best_ms(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def scans(path, window, point, repeat):
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    results = {
+        'full': best_ms(lambda: pq.read_table(path), repeat),
+        'flags': best_ms(lambda: pc.sum(pq.read_table(path, columns=['anomaly_flag']).column(0)), repeat),
+        'range': best_ms(lambda: pq.read_table(path, columns=['timestamp', 'P-PDG', 'anomaly_flag'],
+                                               filters=[('timestamp', '>=', window[0]), ('timestamp', '<', window[1])]),
+                         repeat),
+    }
+    try:
+        import duckdb
+    except ImportError:
+        results['point'] = None
+        return results
+    connection = duckdb.connect()
+    query = f"SELECT count(*) FROM read_parquet('{path}') WHERE timestamp = TIMESTAMP '{point}'"
+    results['point'] = best_ms(lambda: connection.execute(query).fetchall(), repeat)
+    return results
+
+
+def main():
+    import pandas as pd
+    import synthetic_3w
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--row-group-size', type=int, default=65_536)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        (raw_path, rows, _), = synthetic_3w.generate(os.path.join(tmp, 'raw'), wells=1, files_per_well=1, rows=args.rows,
+                                                     row_group_size=args.row_group_size)
+        print(f"Scoring {rows:,} rows...")
+        groups = scored_row_groups(raw_path, train_model(raw_path))
+        timestamps = pd.concat([scored.column('timestamp').to_pandas() for _, scored in groups])
+        start = timestamps.iloc[len(timestamps) // 2]
+        window = (start, start + (timestamps.iloc[-1] - timestamps.iloc[0]) / 100)
+        point = timestamps.iloc[len(timestamps) // 3]
+
+        results = []
+        for name, (source, encoding) in variants().items():
+            path = os.path.join(tmp, f"{name}.parquet")
+            size = write_variant(path, groups, source, encoding)
+            results.append(dict(name=name, bytes=size, **scans(path, window, point, args.repeat)))
+            print(f"  {name}: {size / 2**20:,.1f} MB")
+
+    original = results[0]['bytes']
+    print(f"\n{'variant':<10} {'MB':>8} {'vs orig':>8} {'full ms':>9} {'flags ms':>9} {'range ms':>9} {'point ms':>9}")
+    for r in results:
+        point_ms = f"{r['point']:>9.1f}" if r['point'] is not None else f"{'-':>9}"
+        print(f"{r['name']:<10} {r['bytes'] / 2**20:>8.1f} {r['bytes'] / original:>7.0%} {r['full']:>9.1f} "
+              f"{r['flags']:>9.1f} {r['range']:>9.1f} {point_ms}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: sklearn RandomForestClassifier.predict vs. the compiled flat-array forest.
+
+Trains the production model shape (50 trees, depth 10, class_weight="balanced") on synthetic
+sensor data, then scores the same rows with both engines. Each engine is timed end to end
+from a DataFrame of FEATURES to the 0/1 anomaly_flag column, the way the Lambda uses it:
+
+  sklearn   - model.predict(df[FEATURES]) + the original per-row list comprehension
+  compiled  - CompiledForest.predict(df[FEATURES]) + a vectorized flag mapping
+
+The predictions are checked for exact equality before any timing is reported.
+
+Usage:
+    python benchmarks/bench_forest.py --rows 1000000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+from forest import CompiledForest
+
+FEATURES = ['P-PDG', 'P-TPT', 'T-TPT', 'P-MON-CKP', 'T-JUS-CKP']
+
+
+def synthetic_frame(rows, seed):
+    """Sensor-like columns with roughly 20% overlapping anomaly labels, so trees grow deep like on 3W."""
+    rng = np.random.default_rng(seed)
+    z = rng.normal(size=(rows, len(FEATURES)))
+    signal = z[:, 0] - z[:, 2] + 0.5 * z[:, 1] * z[:, 3] + rng.normal(size=rows)
+    labels = (signal > 1.2).astype(int)
+    df = pd.DataFrame(z * [2e6, 1e6, 20.0, 5e5, 30.0] + [2e7, 1e7, 90.0, 4e6, 60.0], columns=FEATURES)
+    return df, labels
+
+
+def best_of(repeat, fn):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--train-rows', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    train_df, train_labels = synthetic_frame(args.train_rows, seed=0)
+    model = RandomForestClassifier(n_estimators=50, max_depth=10, random_state=42, n_jobs=-1, class_weight='balanced')
+    model.fit(train_df, train_labels)
+
+    start = time.perf_counter()
+    compiled = CompiledForest.from_sklearn(model)
+    compile_s = time.perf_counter() - start
+
+    df, _ = synthetic_frame(args.rows, seed=1)
+
+    sklearn_s, sklearn_flags = best_of(args.repeat, lambda: [0 if p == 1 else 1 for p in model.predict(df[FEATURES])])
+    compiled_s, compiled_flags = best_of(args.repeat, lambda: np.where(compiled.predict(df[FEATURES]) == 1, 0, 1))
+
+    if not np.array_equal(np.asarray(sklearn_flags), compiled_flags):
+        raise SystemExit("Compiled forest predictions differ from sklearn!")
+
+    # The compiled engine always walks the padded depth, sklearn stops at the leaf: shallow
+    # forests narrow the gap, so report how deep rows actually go.
+    sample = df[FEATURES].to_numpy(np.float32)[:50_000]
+    mean_depth = np.mean([estimator.decision_path(sample).sum(axis=1).mean() - 1 for estimator in model.estimators_])
+
+    per_million = 1e6 / args.rows
+    print(f"Rows scored: {args.rows:,} | trees: {compiled.n_trees} | padded depth: {compiled.depth} | compile: {compile_s * 1e3:.1f} ms")
+    print(f"Mean leaf depth reached: {mean_depth:.2f}")
+    print("Predictions identical: yes")
+    print(f"{'engine':<10} {'s / 1M rows':>12} {'rows / s':>14}")
+    print(f"{'sklearn':<10} {sklearn_s * per_million:>12.3f} {args.rows / sklearn_s:>14,.0f}")
+    print(f"{'compiled':<10} {compiled_s * per_million:>12.3f} {args.rows / compiled_s:>14,.0f}")
+    print(f"Speedup: {sklearn_s / compiled_s:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark: whole-file parquet read vs. column-projected, row-group streaming read.
+
+Generates a synthetic 3W-like parquet file (all 27 sensor columns plus class/state), trains a
+small forest on it and scores the file twice, each time in a fresh subprocess so peak RSS is
+measured independently:
+
+  whole      - the original Lambda path: pd.read_parquet of every column, dropna, predict,
+               to_parquet of the full result.
+  streaming  - lambda/app.py::score_parquet: FEATURES-only, one row group at a time, output
+               written incrementally.
+
+Usage:
+    python benchmarks/bench_parquet_reader.py --rows 2000000 --row-group-size 100000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+SENSOR_COLUMNS = [
+    'ABER-CKGL', 'ABER-CKP', 'ESTADO-DHSV', 'ESTADO-M1', 'ESTADO-M2', 'ESTADO-PXO', 'ESTADO-SDV-GL',
+    'ESTADO-SDV-P', 'ESTADO-W1', 'ESTADO-W2', 'ESTADO-XO', 'P-ANULAR', 'P-JUS-BS', 'P-JUS-CKGL',
+    'P-JUS-CKP', 'P-MON-CKGL', 'P-MON-CKP', 'P-MON-SDV-P', 'P-PDG', 'PT-P', 'P-TPT', 'QBS', 'QGL',
+    'T-JUS-CKP', 'T-MON-CKP', 'T-PDG', 'T-TPT'
+]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def generate(path, rows, row_group_size):
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rng = np.random.default_rng(42)
+    written = 0
+    writer = None
+    while written < rows:
+        n = min(row_group_size, rows - written)
+        df = pd.DataFrame(rng.normal(size=(n, len(SENSOR_COLUMNS))) * 1e5, columns=SENSOR_COLUMNS)
+        df.loc[rng.random(n) < 0.05, 'P-PDG'] = np.nan
+        df['class'] = (rng.random(n) < 0.2).astype('int64') * 3
+        df['state'] = 0
+        df.index = pd.date_range('2020-01-01', periods=n, freq='s', name='timestamp') + pd.Timedelta(seconds=written)
+        table = pa.Table.from_pandas(df)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table, row_group_size=row_group_size)
+        written += n
+    writer.close()
+
+
+def train(data_path, model_path):
+    import joblib
+    import pyarrow.parquet as pq
+    from sklearn.ensemble import RandomForestClassifier
+    from features import FEATURES
+
+    df = pq.ParquetFile(data_path).read_row_group(0, columns=FEATURES + ['class']).to_pandas().dropna()
+    model = RandomForestClassifier(n_estimators=50, max_depth=10, random_state=42, n_jobs=-1)
+    model.fit(df[FEATURES], (df['class'] > 0).astype(int))
+    joblib.dump(model, model_path)
+
+
+def run_mode(mode, data_path, model_path, output_path):
+    import joblib
+    import pandas as pd
+    from app import score_parquet
+    from features import FEATURES
+
+    model = joblib.load(model_path)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'whole':
+        df = pd.read_parquet(data_path)
+        inference_df = df.dropna(subset=FEATURES).copy()
+        predictions = model.predict(inference_df[FEATURES])
+        inference_df['anomaly_flag'] = [0 if p == 1 else 1 for p in predictions]
+        inference_df.to_parquet(output_path, engine='pyarrow')
+        rows = len(inference_df)
+    else:
+        with open(data_path, 'rb') as source, open(output_path, 'wb') as sink:
+            rows = score_parquet(model, source, sink)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'mode': mode,
+        'rows_written': rows,
+        'wall_s': round(elapsed, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'baseline_rss_mb': round(baseline, 1)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--row-group-size', type=int, default=100_000)
+    parser.add_argument('--run-mode', choices=['whole', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    parser.add_argument('--model', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args.run_mode, args.data, args.model, args.output)
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_path = os.path.join(work_dir, 'SIMULATED_00001.parquet')
+        model_path = os.path.join(work_dir, 'model.joblib')
+        print(f"Generating {args.rows:,} rows ({args.row_group_size:,} rows per row group)...")
+        generate(data_path, args.rows, args.row_group_size)
+        print(f"Input size: {os.path.getsize(data_path) / 1e6:.1f} MB")
+        train(data_path, model_path)
+
+        results = []
+        for mode in ('whole', 'streaming'):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run-mode', mode, '--data', data_path,
+                 '--model', model_path, '--output', os.path.join(work_dir, f'out_{mode}.parquet')],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"\n{'mode':<10} {'rows':>12} {'wall (s)':>10} {'peak RSS (MB)':>14} {'after load (MB)':>16}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['rows_written']:>12,} {r['wall_s']:>10.3f} {r['peak_rss_mb']:>14.1f} {r['baseline_rss_mb']:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
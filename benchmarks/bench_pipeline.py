@@ -0,0 +1,249 @@
+"""
+End-to-end pipeline benchmark: synthetic 3W data -> training -> Lambda inference, on one machine.
+
+  generate   synthetic_3w.py writes --wells x --files-per-well files of --rows rows into the raw
+             bucket of a local S3 stand-in (a temp directory read through LocalS3Client)
+  train      ml/train_model.py load_data + train_model on those files, saving model.joblib and
+             model.forest.npz into the raw bucket where the Lambda looks for them
+  inference  lambda/app.py lambda_handler on SQS batches of --batch-size S3 notifications
+             covering every raw file, once per --engine, with METRICS_MODE=jsonl so every object
+             reports its per-stage breakdown (see lambda/metrics.py)
+
+Training and each inference engine run in a fresh subprocess, so the first invocation is a real
+cold start and peak RSS is measured per stage. Wall time, rows/s, peak RSS and the per-stage
+totals are appended, with the git commit and the parameters, as one JSON line to the results
+file (--results, by default $BENCH_RESULTS or petrostream-bench-results.jsonl in the temp
+directory); --compare prints two results side by side to check a change before it goes to production.
+
+Usage:
+    python benchmarks/bench_pipeline.py --wells 8 --files-per-well 2 --rows 200000 --engine sklearn compiled
+    python benchmarks/bench_pipeline.py --compare                 # the last two results
+    python benchmarks/bench_pipeline.py --compare 1a2b3c4 HEAD    # the latest result of two commits
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, '..')
+# Outside the work tree, so results survive checkouts of the commits being compared and are never committed
+RESULTS_FILE = os.environ.get('BENCH_RESULTS', os.path.join(tempfile.gettempdir(), 'petrostream-bench-results.jsonl'))
+RAW_BUCKET = 'raw'
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', '--short', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def run_train(root, workers):
+    sys.path.insert(0, os.path.join(REPO_DIR, 'ml'))
+    import train_model as tm
+
+    start = time.perf_counter()
+    df = tm.load_data(data_dir=os.path.join(root, RAW_BUCKET, 'data'), workers=workers, cache_dir='')
+    loaded = time.perf_counter()
+    tm.train_model(df, os.path.join(root, RAW_BUCKET, 'model.joblib'))
+    trained = time.perf_counter()
+    return {
+        'rows': len(df),
+        'load_s': loaded - start,
+        'load_rows_per_s': len(df) / (loaded - start),
+        'fit_s': trained - loaded,
+        'fit_rows_per_s': len(df) * 0.7 / (trained - loaded),  # train_model fits on a 70% split
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_inference(root, batch_size):
+    """Runs in a child whose environment points the Lambda at the local buckets."""
+    sys.path.insert(0, os.path.join(REPO_DIR, 'lambda'))
+    import app
+    import metrics
+    from s3io import LocalS3Client
+
+    client = LocalS3Client(root)
+    keys = []
+    kwargs = {'Bucket': RAW_BUCKET, 'Prefix': 'data/'}
+    while True:
+        response = client.list_objects_v2(**kwargs)
+        keys.extend(obj['Key'] for obj in response.get('Contents', []) if obj['Key'].endswith('.parquet'))
+        if not response.get('IsTruncated'):
+            break
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    invocations = []
+    start = time.perf_counter()
+    for i in range(0, len(keys), batch_size):
+        records = [{'messageId': f"m{j}", 'body': json.dumps({'Records': [
+            {'s3': {'bucket': {'name': RAW_BUCKET}, 'object': {'key': key}}}]})}
+            for j, key in enumerate(keys[i:i + batch_size])]
+        invocation_start = time.perf_counter()
+        response = app.lambda_handler({'Records': records}, None)
+        invocations.append(time.perf_counter() - invocation_start)
+        if response['batchItemFailures']:
+            raise RuntimeError(f"Objects failed: {response['batchItemFailures']}")
+    wall = time.perf_counter() - start
+
+    with open(metrics.METRICS_FILE) as f:
+        summary = metrics.summarize(f)
+    objects = {}
+    for (kind, _), values in summary.items():
+        if kind == 'object':
+            for name, stats in values.items():
+                objects.setdefault(name, []).append(stats)
+    rows_out = sum(stats['sum'] for stats in objects.get('rows_out', []))
+    return {
+        'files': len(keys),
+        'rows_out': int(rows_out),
+        'wall_s': wall,
+        'rows_per_s': rows_out / wall,
+        'files_per_s': len(keys) / wall,
+        'cold_invocation_s': invocations[0],
+        'warm_invocation_s': sorted(invocations[1:])[len(invocations[1:]) // 2] if len(invocations) > 1 else None,
+        # Summed over all objects; stages of concurrently processed objects overlap in wall time
+        'stages_ms': {name[:-len('_ms')]: sum(stats['sum'] for stats in series)
+                      for name, series in sorted(objects.items()) if name.endswith('_ms') and name != 'total_ms'},
+        'bytes_in': int(sum(stats['sum'] for stats in objects.get('bytes_in', []))),
+        'bytes_out': int(sum(stats['sum'] for stats in objects.get('bytes_out', []))),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def child(args, stage, extra_env=None):
+    command = [sys.executable, os.path.abspath(__file__), '--stage', stage, '--root', args.root,
+               '--workers', str(args.workers or 0), '--batch-size', str(args.batch_size)]
+    env = dict(os.environ, **(extra_env or {}))
+    output = subprocess.run(command, check=True, capture_output=True, text=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        items = {}
+        for key, inner in value.items():
+            items.update(flatten(inner, f"{prefix}{key}."))
+        return items
+    return {prefix[:-1]: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+
+def compare(results_file, revisions):
+    with open(results_file) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    if revisions:
+        head = git_revision()['commit']
+        picked = []
+        for revision in revisions:
+            revision = head if revision == 'HEAD' else revision
+            matches = [r for r in results if (r.get('commit') or '').startswith(revision)]
+            if not matches:
+                raise SystemExit(f"No result for commit {revision} in {results_file}")
+            picked.append(matches[-1])
+        old, new = picked
+    else:
+        if len(results) < 2:
+            raise SystemExit(f"Need two results in {results_file} to compare")
+        old, new = results[-2:]
+    if old['params'] != new['params']:
+        print(f"Warning: different parameters\n  {old['params']}\n  {new['params']}")
+    a, b = flatten({k: old[k] for k in ('train', 'inference')}), flatten({k: new[k] for k in ('train', 'inference')})
+    label = lambda r: f"{r.get('commit')}{'+' if r.get('dirty') else ''}"
+    print(f"\n{'metric':<44} {label(old):>14} {label(new):>14} {'change':>8}")
+    for name in sorted(set(a) | set(b)):
+        x, y = a.get(name), b.get(name)
+        change = f"{(y - x) / x:+.1%}" if x and y is not None else ''
+        fmt = lambda v: '' if v is None else f"{v:,.1f}"
+        print(f"{name:<44} {fmt(x):>14} {fmt(y):>14} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wells', type=int, default=8)
+    parser.add_argument('--files-per-well', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=100_000, help="Rows per file")
+    parser.add_argument('--nan-rate', type=float, default=0.01)
+    parser.add_argument('--anomaly-rate', type=float, default=0.1)
+    parser.add_argument('--row-group-size', type=int, default=100_000)
+    parser.add_argument('--engine', nargs='+', default=['sklearn'], choices=['sklearn', 'compiled'])
+    parser.add_argument('--layout', default='partitioned', choices=['mirror', 'partitioned'])
+    parser.add_argument('--batch-size', type=int, default=10, help="S3 notifications per SQS batch (Lambda invocation)")
+    parser.add_argument('--workers', type=int, default=0, help="Training file readers (0 = one per CPU)")
+    parser.add_argument('--results', default=RESULTS_FILE, help="JSON lines file the results are appended to")
+    parser.add_argument('--compare', nargs='*', metavar='COMMIT', help="Compare two results instead of running")
+    parser.add_argument('--stage', choices=['train', 'inference'], help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(args.results, args.compare)
+        return
+    if args.stage:
+        # The pipeline code prints progress; only the result line goes to stdout
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        result = run_train(args.root, args.workers or None) if args.stage == 'train' else run_inference(args.root, args.batch_size)
+        sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    sys.path.insert(0, BENCH_DIR)
+    import synthetic_3w
+
+    params = {key: getattr(args, key) for key in ('wells', 'files_per_well', 'rows', 'nan_rate', 'anomaly_rate',
+                                                  'row_group_size', 'layout', 'batch_size')}
+    record = dict(git_revision(), time=time.strftime('%Y-%m-%dT%H:%M:%S'), params=params, host={
+        'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()})
+    with tempfile.TemporaryDirectory() as work_dir:
+        args.root = os.path.join(work_dir, 's3')
+        start = time.perf_counter()
+        written = synthetic_3w.generate(os.path.join(args.root, RAW_BUCKET, 'data'), args.wells, args.files_per_well,
+                                        args.rows, args.nan_rate, args.anomaly_rate, args.row_group_size)
+        record['generate'] = {'files': len(written), 'rows': sum(n for _, n, _ in written),
+                              'anomalous_rows': sum(a for _, _, a in written), 'seconds': time.perf_counter() - start}
+        print(f"Generated {record['generate']['files']} files, {record['generate']['rows']:,} rows")
+
+        record['train'] = child(args, 'train')
+        print(f"Trained on {record['train']['rows']:,} rows in {record['train']['load_s'] + record['train']['fit_s']:.1f} s")
+
+        record['inference'] = {}
+        for engine in args.engine:
+            record['inference'][engine] = child(args, 'inference', {
+                'LOCAL_S3_ROOT': args.root, 'RAW_BUCKET_NAME': RAW_BUCKET, 'CURATED_BUCKET_NAME': f"curated-{engine}",
+                'INFERENCE_ENGINE': engine, 'CURATED_LAYOUT': args.layout,
+                'MODEL_CACHE_DIR': os.path.join(work_dir, f"model-cache-{engine}"),
+                'METRICS_MODE': 'jsonl', 'METRICS_FILE': os.path.join(work_dir, f"metrics-{engine}.jsonl"),
+            })
+            print(f"Scored with the {engine} engine")
+
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    train = record['train']
+    print(f"\n{'stage':<20} {'wall s':>8} {'rows/s':>12} {'files/s':>8} {'peak RSS MB':>12}")
+    print(f"{'train: load':<20} {train['load_s']:>8.2f} {train['load_rows_per_s']:>12,.0f} {'':>8} {'':>12}")
+    print(f"{'train: fit':<20} {train['fit_s']:>8.2f} {train['fit_rows_per_s']:>12,.0f} {'':>8} {train['peak_rss_mb']:>12.0f}")
+    for engine, r in record['inference'].items():
+        print(f"{'inference: ' + engine:<20} {r['wall_s']:>8.2f} {r['rows_per_s']:>12,.0f} {r['files_per_s']:>8.2f} "
+              f"{r['peak_rss_mb']:>12.0f}")
+    for engine, r in record['inference'].items():
+        total = sum(r['stages_ms'].values()) or 1
+        print(f"\nPer-stage time, {engine} engine (summed over objects; cold invocation {r['cold_invocation_s']:.2f} s):")
+        for stage, ms in sorted(r['stages_ms'].items(), key=lambda item: -item[1]):
+            print(f"  {stage:<12} {ms:>10,.0f} ms {ms / total:>6.1%}")
+    print(f"\nResults appended to {args.results}")
+
+
+if __name__ == '__main__':
+    main()
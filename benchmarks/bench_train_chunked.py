@@ -0,0 +1,115 @@
+"""
+Benchmark: in-memory training (train_model) vs. out-of-core chunked training (train_model_chunked).
+
+Generates a synthetic, well-ordered dataset the way the dataset cache stores it (X.npy float32 +
+y.npy int16, one contiguous segment per "well" with its own operating point and class mix) and
+a separate held-out test set. Each mode runs in a fresh subprocess so peak RSS is independent:
+
+  in-memory  - X/y loaded into RAM, DataFrame + train_model (train_test_split + one 50-tree fit)
+  chunked    - X/y memory-mapped, train_model_chunked (per-chunk forests merged into one)
+
+Both models are scored on the same held-out rows; fit throughput is training rows per second of
+wall time (including the chunked mode's reads and its evaluation pass).
+
+Usage:
+    python benchmarks/bench_train_chunked.py --rows 4000000 --chunk-rows 1000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ml'))
+
+ROWS_PER_WELL = 200_000
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def synthetic_wells(rows, seed):
+    """Sensor-like rows in well order; each well has its own offset and anomaly class."""
+    rng = np.random.default_rng(seed)
+    X = np.empty((rows, 5), dtype=np.float32)
+    y = np.empty(rows, dtype=np.int16)
+    for start in range(0, rows, ROWS_PER_WELL):
+        n = min(ROWS_PER_WELL, rows - start)
+        z = rng.normal(size=(n, 5)) + rng.normal(scale=0.3, size=5)
+        signal = z[:, 0] - z[:, 2] + 0.5 * z[:, 1] * z[:, 3] + rng.normal(size=n)
+        X[start:start + n] = z * [2e6, 1e6, 20.0, 5e5, 30.0] + [2e7, 1e7, 90.0, 4e6, 60.0]
+        y[start:start + n] = np.where(signal > 1.2, rng.integers(1, 10), 0)
+    return X, y
+
+
+def run_mode(mode, directory, chunk_rows):
+    import pandas as pd
+    import train_model as tm
+
+    start = time.perf_counter()
+    if mode == 'in-memory':
+        X = np.load(os.path.join(directory, 'X.npy'))
+        y = np.load(os.path.join(directory, 'y.npy'))
+        df = pd.DataFrame(X, columns=tm.FEATURES, copy=False)
+        df['class'] = y
+        model = tm.train_model(df, os.path.join(directory, 'in-memory.joblib'))
+    else:
+        X = np.load(os.path.join(directory, 'X.npy'), mmap_mode='r')
+        y = np.load(os.path.join(directory, 'y.npy'), mmap_mode='r')
+        model = tm.train_model_chunked(X, y, os.path.join(directory, 'chunked.joblib'), chunk_rows=chunk_rows)
+    seconds = time.perf_counter() - start
+
+    X_test = np.load(os.path.join(directory, 'X_test.npy'))
+    y_test = np.load(os.path.join(directory, 'y_test.npy')) > 0
+    accuracy = float((model.predict(pd.DataFrame(X_test, columns=tm.FEATURES)) == y_test).mean())
+    return {'seconds': seconds, 'train_rows': int(len(y) * 0.7), 'accuracy': accuracy,
+            'trees': len(model.estimators_), 'peak_rss_mb': peak_rss_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=4_000_000)
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000)
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            result = run_mode(args.mode, args.dir, args.chunk_rows)
+            sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        X, y = synthetic_wells(args.rows, seed=1)
+        np.save(os.path.join(directory, 'X.npy'), X)
+        np.save(os.path.join(directory, 'y.npy'), y)
+        X_test, y_test = synthetic_wells(max(args.rows // 10, ROWS_PER_WELL), seed=2)
+        np.save(os.path.join(directory, 'X_test.npy'), X_test)
+        np.save(os.path.join(directory, 'y_test.npy'), y_test)
+        del X, y, X_test, y_test
+        print(f"{args.rows:,} training rows, chunk size {args.chunk_rows:,}\n")
+
+        print(f"{'mode':<10} {'wall s':>8} {'rows/s':>10} {'trees':>6} {'accuracy':>9} {'peak RSS MB':>12}")
+        for mode in ('in-memory', 'chunked'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--dir', directory, '--chunk-rows', str(args.chunk_rows)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:<10} {r['seconds']:>8.1f} {r['train_rows'] / r['seconds']:>10,.0f} {r['trees']:>6} "
+                  f"{r['accuracy']:>9.4f} {r['peak_rss_mb']:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
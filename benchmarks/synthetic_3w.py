@@ -0,0 +1,104 @@
+"""
+Synthetic 3W-like dataset for the benchmarks.
+
+Writes one parquet file per well and period, laid out and named like the 3W dataset:
+
+    <out>/<class>/WELL-<nnnnn>_<YYYYmmddHHMMSS>.parquet
+
+with the 27 sensor columns, `class` and `state`, indexed by a 1 Hz `timestamp` (stored as the
+pandas index, like the real files). Every well has its own operating point. A file of a faulty
+well carries one contiguous fault event covering --anomaly-rate of its rows: a transient part
+(class 100 + c) followed by the steady fault (class c), during which the pressure and
+temperature sensors drift away from the operating point so a model can learn it. --nan-rate
+blanks that fraction of the sensor values at random, like the 3W gaps.
+
+Usage:
+    python benchmarks/synthetic_3w.py OUT_DIR --wells 8 --files-per-well 2 --rows 100000
+"""
+import argparse
+import os
+
+import numpy as np
+
+SENSOR_COLUMNS = [
+    'ABER-CKGL', 'ABER-CKP', 'ESTADO-DHSV', 'ESTADO-M1', 'ESTADO-M2', 'ESTADO-PXO', 'ESTADO-SDV-GL',
+    'ESTADO-SDV-P', 'ESTADO-W1', 'ESTADO-W2', 'ESTADO-XO', 'P-ANULAR', 'P-JUS-BS', 'P-JUS-CKGL',
+    'P-JUS-CKP', 'P-MON-CKGL', 'P-MON-CKP', 'P-MON-SDV-P', 'P-PDG', 'PT-P', 'P-TPT', 'QBS', 'QGL',
+    'T-JUS-CKP', 'T-MON-CKP', 'T-PDG', 'T-TPT'
+]
+# Operating point and noise of the sensors the model uses; the others are plain noise
+OPERATING_POINT = {'P-PDG': (2e7, 2e5), 'P-TPT': (1e7, 1e5), 'T-TPT': (90.0, 0.5),
+                   'P-MON-CKP': (4e6, 5e4), 'T-JUS-CKP': (60.0, 0.5)}
+# Fault drift per sensor, in noise standard deviations, reached at the end of the fault
+FAULT_DRIFT = {'P-PDG': -6.0, 'P-TPT': 5.0, 'T-TPT': 4.0, 'P-MON-CKP': -5.0, 'T-JUS-CKP': 3.0}
+START = np.datetime64('2020-01-01T00:00:00', 's')
+
+
+def well_file(rng, rows, start, fault_class, anomaly_rate, nan_rate):
+    """One file's DataFrame: rows at 1 Hz from start, with a fault event if fault_class > 0."""
+    import pandas as pd
+
+    data = {}
+    for name in SENSOR_COLUMNS:
+        mean, std = OPERATING_POINT.get(name, (0.0, 1.0))
+        mean *= 1 + rng.normal(scale=0.05)  # every well runs at its own operating point
+        data[name] = mean + std * rng.standard_normal(rows)
+    labels = np.zeros(rows, dtype=np.float64)
+    fault_rows = int(rows * anomaly_rate) if fault_class else 0
+    if fault_rows:
+        begin = int(rng.integers(0, rows - fault_rows + 1))
+        transient = fault_rows // 3
+        labels[begin:begin + transient] = 100 + fault_class
+        labels[begin + transient:begin + fault_rows] = fault_class
+        ramp = np.linspace(0, 1, fault_rows)
+        for name, drift in FAULT_DRIFT.items():
+            data[name][begin:begin + fault_rows] += drift * OPERATING_POINT[name][1] * ramp
+    if nan_rate:
+        for name in SENSOR_COLUMNS:
+            data[name][rng.random(rows) < nan_rate] = np.nan
+    frame = pd.DataFrame(data)
+    frame['class'] = labels
+    frame['state'] = np.where(labels > 0, 1.0, 0.0)
+    frame.index = pd.DatetimeIndex(START + start + np.arange(rows), name='timestamp')
+    return frame
+
+
+def generate(out_dir, wells=8, files_per_well=2, rows=100_000, nan_rate=0.01, anomaly_rate=0.1,
+             row_group_size=None, seed=42):
+    """Writes the dataset; returns [(path, rows, anomalous rows)] in file order."""
+    rng = np.random.default_rng(seed)
+    written = []
+    for well in range(1, wells + 1):
+        # Most wells have one fault type; with anomaly_rate 0 every well is normal
+        fault_class = 0 if anomaly_rate == 0 or well % 4 == 0 else 1 + (well - 1) % 9
+        for period in range(files_per_well):
+            start = np.timedelta64(period * rows, 's')  # consecutive files of a well follow each other
+            frame = well_file(rng, rows, start, fault_class, anomaly_rate, nan_rate)
+            stamp = str((START + start).astype('datetime64[s]')).replace('-', '').replace(':', '').replace('T', '')
+            directory = os.path.join(out_dir, str(fault_class))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"WELL-{well:05d}_{stamp}.parquet")
+            frame.to_parquet(path, row_group_size=row_group_size)
+            written.append((path, rows, int((frame['class'] > 0).sum())))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir')
+    parser.add_argument('--wells', type=int, default=8)
+    parser.add_argument('--files-per-well', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=100_000, help="Rows per file")
+    parser.add_argument('--nan-rate', type=float, default=0.01)
+    parser.add_argument('--anomaly-rate', type=float, default=0.1, help="Fraction of a faulty file's rows in the fault")
+    parser.add_argument('--row-group-size', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    written = generate(args.out_dir, args.wells, args.files_per_well, args.rows, args.nan_rate, args.anomaly_rate,
+                       args.row_group_size, args.seed)
+    rows = sum(n for _, n, _ in written)
+    print(f"Wrote {len(written)} files, {rows:,} rows ({sum(a for _, _, a in written) / rows:.1%} anomalous) to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,18 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import awswrangler as wr
 import boto3
 import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import curated_index
+import downsample
+from data_cache import DataCache
+from event_index import EVENTS_KEY, EventIndex, well_of
+from query_backend import create_backend
 
 st.set_page_config(
     page_title="PetroStream",
@@ -45,6 +54,19 @@ st.markdown("""
 # ----------------- CONFIG & SECRETS -----------------
 CURATED_BUCKET = os.environ.get('CURATED_BUCKET_NAME', 'petrostream-curated-data-dev-84f59e73')
 AWS_REGION = os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')
+# Pre-aggregated KPIs maintained by the rollup compaction job (lambda/rollup.py)
+ROLLUP_KEY = 'rollup/rollup.parquet'
+# Read the curated bucket from a local directory (one subdirectory per bucket) instead of S3
+LOCAL_S3_ROOT = os.environ.get('LOCAL_S3_ROOT')
+# 'auto' runs queries with embedded DuckDB on the curated parquet and falls back to Athena,
+# 'duckdb' and 'athena' force one of them (see query_backend.py)
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'auto')
+ATHENA_DATABASE = 'petrostream_db_dev'
+ATHENA_OUTPUT = 's3://petrostream-athena-results-dev-84f59e73/'
+# Memory budget of the shared Arrow cache of curated files (see data_cache.py)
+DATA_CACHE_BYTES = int(os.environ.get('DATA_CACHE_BYTES', 512 * 1024 * 1024))
+# Anomaly events drawn as shaded spans on a chart (plotly shapes get slow past a few hundred)
+MAX_EVENT_SPANS = 200
 
 # ----------------- SIDEBAR NAV -----------------
 st.sidebar.markdown("<h2>🛢️ PetroStream</h2>", unsafe_allow_html=True)
@@ -62,59 +84,116 @@ st.sidebar.markdown("<br><br><br>", unsafe_allow_html=True)
 st.sidebar.markdown(f"**Region:** {AWS_REGION}")
 st.sidebar.markdown(f"**Database:** petrostream_db")
 st.sidebar.markdown(f"**Table:** sensor_stream")
+st.sidebar.markdown(f"**Query engine:** {QUERY_BACKEND}")
 st.sidebar.markdown("---")
 st.sidebar.markdown("<small style='color: #8b949e'>Built with Streamlit | PetroStream Project</small>", unsafe_allow_html=True)
 
 
 # ----------------- DATA CACHING CORE -----------------
+@st.cache_resource
+def get_s3_client():
+    """boto3 S3 client, or a local directory lister when LOCAL_S3_ROOT is set."""
+    if LOCAL_S3_ROOT:
+        return curated_index.LocalListing(LOCAL_S3_ROOT)
+    return boto3.client('s3', region_name=AWS_REGION)
+
+@st.cache_resource
+def get_data_cache():
+    """One Arrow cache of curated objects for the whole process, validated by ETag."""
+    s3 = None if LOCAL_S3_ROOT else boto3.client('s3', region_name=AWS_REGION)
+    return DataCache(CURATED_BUCKET, s3_client=s3, local_root=LOCAL_S3_ROOT, budget_bytes=DATA_CACHE_BYTES)
+
+def read_curated_table(key):
+    return get_data_cache().get_table(key)
+
+def curated_path(key):
+    return os.path.join(LOCAL_S3_ROOT, CURATED_BUCKET, *key.split('/')) if LOCAL_S3_ROOT else f"s3://{CURATED_BUCKET}/{key}"
+
+def curated_key(path):
+    """Inverse of curated_path()."""
+    prefix = os.path.join(LOCAL_S3_ROOT, CURATED_BUCKET) + os.sep if LOCAL_S3_ROOT else f"s3://{CURATED_BUCKET}/"
+    return path[len(prefix):].replace(os.sep, '/')
+
+@st.cache_data(ttl=30)
+def fetch_recent_objects(limit=30, cursor=None):
+    """
+    Newest curated objects from the listing index (curated_index.py): (entries, next cursor).
+    Buckets written before the index existed fall back to a full listing.
+    """
+    s3 = get_s3_client()
+    entries, next_cursor = curated_index.recent(s3, CURATED_BUCKET, limit, cursor)
+    if not entries and cursor is None:
+        return curated_index.recent_by_listing(s3, CURATED_BUCKET, limit), None
+    # A file re-scored between two index reads can appear twice; keep its newest entry
+    seen = set()
+    entries = [entry for entry in entries if not (entry['key'] in seen or seen.add(entry['key']))]
+    return entries, next_cursor
+
+@st.cache_resource
+def get_query_backend():
+    """One query backend (and DuckDB connection) shared by all sessions."""
+    return create_backend(QUERY_BACKEND, CURATED_BUCKET, local_root=LOCAL_S3_ROOT, region=AWS_REGION,
+                          athena_database=ATHENA_DATABASE, athena_output=ATHENA_OUTPUT)
+
+def fetch_rollup():
+    """
+    Reads the KPI rollup table written by lambda/rollup.py (one row per curated file and hour).
+    It is kilobytes, so this replaces a full scan of sensor_stream. Returns None if it does not exist yet.
+    """
+    try:
+        return read_curated_table(ROLLUP_KEY).to_pandas()
+    except Exception:
+        return None
+
+@st.cache_data(ttl=60)
+def fetch_event_index():
+    """
+    The anomaly event index folded by lambda/rollup.py (one row per contiguous anomaly run),
+    ready for time-range and well lookups. Returns None if it does not exist yet.
+    """
+    try:
+        return EventIndex(read_curated_table(EVENTS_KEY).to_pandas())
+    except Exception:
+        return None
+
 @st.cache_data(ttl=60)
 def fetch_global_metrics():
-    """Uses AWS Athena to instantly compute KPIs across 8.5M+ records without downloading data."""
+    """KPIs from the rollup table, falling back to a query over the whole table."""
+    rollup = fetch_rollup()
+    if rollup is not None:
+        return int(rollup['records'].sum()), int(rollup['anomalies'].sum())
     try:
         query = "SELECT COUNT(*) as total_records, SUM(CAST(anomaly_flag AS INTEGER)) as total_anomalies FROM sensor_stream"
-        df = wr.athena.read_sql_query(
-            sql=query,
-            database='petrostream_db_dev',
-            s3_output='s3://petrostream-athena-results-dev-84f59e73/'
-        )
+        df = get_query_backend().query(query)
         if not df.empty:
             return df.iloc[0]['total_records'], df.iloc[0]['total_anomalies']
         return 0, 0
     except Exception as e:
-        st.error(f"Error querying Athena: {e}")
+        st.error(f"Error querying sensor_stream: {e}")
         return 0, 0
 
 @st.cache_data(ttl=60)
 def fetch_explorer_data():
-    """Uses AWS Athena to fetch exactly 5,000 recent records instantly."""
+    """Fetches exactly 5,000 records through the configured query backend."""
     try:
         query = 'SELECT * FROM sensor_stream LIMIT 5000'
-        df = wr.athena.read_sql_query(
-            sql=query,
-            database='petrostream_db_dev',
-            s3_output='s3://petrostream-athena-results-dev-84f59e73/'
-        )
-        return df
+        return get_query_backend().query(query)
     except Exception as e:
-        st.error(f"Error querying Athena: {e}")
+        st.error(f"Error querying sensor_stream: {e}")
         return pd.DataFrame()
 
 @st.cache_data(ttl=30)
 def fetch_recent_data(limit=10):
     """Fetches a subset of recent data from the curated bucket to prevent hanging the dashboard."""
     try:
-        s3 = boto3.client('s3', region_name=AWS_REGION)
-        response = s3.list_objects_v2(Bucket=CURATED_BUCKET, Prefix='data/')
-        if 'Contents' not in response:
-            return pd.DataFrame()
-            
-        objects = sorted(response['Contents'], key=lambda x: x['LastModified'], reverse=True)
-        recent_keys = [f"s3://{CURATED_BUCKET}/{obj['Key']}" for obj in objects if obj['Key'].endswith('.parquet')][:limit]
+        entries, _ = fetch_recent_objects(limit)
+        recent_keys = [entry['key'] for entry in entries]
         
         if not recent_keys:
             return pd.DataFrame()
             
-        df = wr.s3.read_parquet(path=recent_keys)
+        tables = [read_curated_table(key) for key in recent_keys]
+        df = pa.concat_tables(tables, promote_options='default').to_pandas()
         # Ensure anomaly flag is numeric to avoid 100% bugs if pandas parses it as string/category
         if 'anomaly_flag' in df.columns:
             df['anomaly_flag'] = pd.to_numeric(df['anomaly_flag'], errors='coerce').fillna(0)
@@ -123,29 +202,105 @@ def fetch_recent_data(limit=10):
         st.error(f"Error loading data: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=30)
-def list_curated_batches():
-    """Lists recent parquet files stored by Lambda in the curated bucket."""
+def list_curated_batches(cursor=None):
+    """One page (30) of the parquet files stored by Lambda in the curated bucket, newest first."""
     try:
-        s3 = boto3.client('s3', region_name=AWS_REGION)
-        response = s3.list_objects_v2(Bucket=CURATED_BUCKET, Prefix='data/')
-        if 'Contents' not in response:
-            return []
-        objects = sorted(response['Contents'], key=lambda x: x['LastModified'], reverse=True)
-        return [f"s3://{CURATED_BUCKET}/{obj['Key']}" for obj in objects if obj['Key'].endswith('.parquet')][:30]
+        entries, next_cursor = fetch_recent_objects(30, cursor)
+        return [curated_path(entry['key']) for entry in entries], next_cursor
     except:
-        return []
+        return [], None
+
+def fetch_overview(curated_file, level, start, end):
+    """One level of the precomputed overview (lambda/overviews.py) of a curated file, for [start, end]."""
+    key = downsample.overview_key(curated_key(curated_file))
+    if key is None:
+        return None
+    try:
+        # The overview (kilobytes) is cached whole; the level and range are cut out in Arrow
+        overview = read_curated_table(key)
+        mask = pc.and_(pc.equal(overview['level'], level),
+                       pc.and_(pc.greater_equal(overview['timestamp'], pa.scalar(pd.Timestamp(start), overview.schema.field('timestamp').type)),
+                               pc.less_equal(overview['timestamp'], pa.scalar(pd.Timestamp(end), overview.schema.field('timestamp').type))))
+        return overview.filter(mask).to_pandas()
+    except Exception:
+        return None
 
 @st.cache_data(ttl=30)
-def fetch_specific_file(s3_path):
+def fetch_file_summary(curated_file):
+    """
+    The metrics of a curated file without reading its rows: {'records', 'anomalies', 'start',
+    'end', 'columns'}. Records, columns and the time span come from the parquet footer (the
+    row-group statistics of timestamp). Anomalies come from the file's rows of the rollup, or
+    from its anomaly_flag column alone when the rollup does not cover it (yet).
+    """
     try:
-        df = wr.s3.read_parquet(path=s3_path)
-        if 'anomaly_flag' in df.columns:
-            df['anomaly_flag'] = pd.to_numeric(df['anomaly_flag'], errors='coerce').fillna(0)
-        return df
-    except:
+        metadata = pq.read_metadata(curated_file)
+    except Exception:
+        return None
+    columns = metadata.schema.to_arrow_schema().names
+    summary = {'records': metadata.num_rows, 'anomalies': None, 'start': None, 'end': None, 'columns': columns}
+    if 'timestamp' in columns:
+        stats = [metadata.row_group(i).column(metadata.schema.names.index('timestamp')).statistics
+                 for i in range(metadata.num_row_groups)]
+        if stats and all(stat is not None and stat.has_min_max for stat in stats):
+            summary['start'] = pd.Timestamp(min(stat.min for stat in stats))
+            summary['end'] = pd.Timestamp(max(stat.max for stat in stats))
+
+    source = downsample.source_key(curated_key(curated_file))
+    rollup = fetch_rollup()
+    if source is not None and rollup is not None and summary['start'] is not None:
+        rows = rollup[(rollup['source_key'] == source) & (rollup['hour'] >= summary['start'].floor('h'))
+                      & (rollup['hour'] <= summary['end'])]
+        # A rollup that has not folded the latest version of the file yet disagrees on the count
+        if int(rows['records'].sum()) == summary['records']:
+            summary['anomalies'] = int(rows['anomalies'].sum())
+    if summary['anomalies'] is None and 'anomaly_flag' in columns:
+        flags = pq.read_table(curated_file, columns=['anomaly_flag']).column('anomaly_flag').to_numpy()
+        summary['anomalies'] = int(np.count_nonzero(flags))
+    return summary
+
+@st.cache_data(ttl=30)
+def fetch_rows(curated_file, columns, start=None, end=None):
+    """
+    The given columns of a curated file's rows in [start, end] (all rows without a range). The
+    timestamp filter is pushed into the parquet scan: row groups whose statistics lie outside the
+    range are neither downloaded nor decoded.
+    """
+    filters = None
+    if start is not None:
+        filters = [('timestamp', '>=', pd.Timestamp(start)), ('timestamp', '<=', pd.Timestamp(end))]
+    try:
+        return pq.read_table(curated_file, columns=list(columns), filters=filters).to_pandas()
+    except Exception:
         return pd.DataFrame()
 
+def chart_points(curated_file, sensor, start=None, end=None):
+    """
+    The points to plot for [start, end]: (line x, line y, anomaly x, anomaly y, resolution note).
+    The overview level that fits the range (fetch_overview) tells how many samples it holds; more
+    than MAX_POINTS are drawn as its min/max envelope without reading a raw row. Shorter ranges
+    read only their own rows and are reduced with LTTB, keeping every anomaly. Files without a
+    timestamp are drawn against the row number.
+    """
+    if start is None:
+        rows = fetch_rows(curated_file, (sensor, 'anomaly_flag'))
+        x = np.arange(len(rows))
+    else:
+        level = downsample.overview_level(start, end)
+        overview = fetch_overview(curated_file, level, start, end)
+        if overview is not None and overview['records'].sum() > downsample.MAX_POINTS:
+            samples = int(overview['records'].sum())
+            return (*downsample.overview_series(overview, sensor), f"Min/max per {level} s bucket ({samples:,} samples)")
+        rows = fetch_rows(curated_file, ('timestamp', sensor, 'anomaly_flag'), start, end)
+        x = rows['timestamp'].to_numpy() if not rows.empty else np.array([], dtype='datetime64[ns]')
+    if rows.empty:
+        return x, [], [], [], "No samples in this range"
+    y = rows[sensor].to_numpy()
+    flags = rows['anomaly_flag'].to_numpy()
+    keep = downsample.downsample(x, y, flags)
+    anomalies = keep[flags[keep] != 0]
+    return x[keep], y[keep], x[anomalies], y[anomalies], f"{len(keep):,} of {len(rows):,} samples"
+
 
 # ----------------- PAGE ROUTING -----------------
 
@@ -154,25 +309,37 @@ if nav == "Anomaly Detection":
     
     st.subheader("Load data from S3 and preview predictions")
     
-    batches = list_curated_batches()
+    # Cursors of the pages shown so far; the last one is the current page (None = newest files)
+    cursors = st.session_state.setdefault('batch_cursors', [None])
+    batches, next_cursor = list_curated_batches(cursors[-1])
     if not batches:
         st.warning("No curated files found. Upload data to Raw S3.")
     else:
         selected_batch = st.selectbox("Select a data file (processed by Lambda):", batches)
+        col_newer, col_older, _ = st.columns([1, 1, 4])
+        if col_newer.button("◀ Newer files", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        if col_older.button("Older files ▶", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
         
         col_btn, _ = st.columns([1, 4])
         # We don't really 'run' anomaly detection, we 'load' it, but we can call it this to mimic the screen
         if col_btn.button("Load Evaluated Batch"):
-            with st.spinner("Streaming..."):
-                batch_df = fetch_specific_file(selected_batch)
+            # Remembered so that moving the chart range (a rerun) keeps the batch on screen
+            st.session_state['loaded_batch'] = selected_batch
+        if st.session_state.get('loaded_batch') == selected_batch:
+            with st.spinner("Reading file metadata..."):
+                summary = fetch_file_summary(selected_batch)
                 
             st.markdown("<br>", unsafe_allow_html=True)
             
-            # Metrics Row
+            # Metrics Row (from the footer and the rollup, no rows are downloaded)
             m1, m2, m3, m4 = st.columns(4)
-            if not batch_df.empty:
-                t_rec = len(batch_df)
-                t_anom = batch_df['anomaly_flag'].sum() if 'anomaly_flag' in batch_df.columns else 0
+            if summary is not None and summary['records'] > 0:
+                t_rec = summary['records']
+                t_anom = summary['anomalies'] or 0
                 t_norm = t_rec - t_anom
                 pct = (t_anom / t_rec) * 100 if t_rec > 0 else 0
                 
@@ -186,30 +353,40 @@ if nav == "Anomaly Detection":
                 # Plotly Chart
                 st.markdown("**Pressure (P-PDG) with Anomalies Highlighted**")
                 
-                # Format time
-                df_chart = batch_df.reset_index() if batch_df.index.name == 'timestamp' else batch_df.copy()
-                if 'timestamp' not in df_chart.columns:
-                    df_chart['Time_Index'] = df_chart.index
-                t_col = 'timestamp' if 'timestamp' in df_chart.columns else 'Time_Index'
-                
-                if 'P-PDG' in df_chart.columns:
+                if 'P-PDG' in summary['columns']:
+                    # Visible range: only this slice is read and sent to the browser, downsampled
+                    visible = ()
+                    if summary['start'] is not None:
+                        visible = (summary['start'].to_pydatetime(), summary['end'].to_pydatetime())
+                        if visible[0] < visible[1]:
+                            visible = st.slider("Time range", min_value=visible[0], max_value=visible[1], value=visible)
+                    line_x, line_y, anom_x, anom_y, resolution = chart_points(selected_batch, 'P-PDG', *visible)
+                    st.caption(resolution)
                     fig = go.Figure()
                     
                     # Blue line for normal
-                    fig.add_trace(go.Scatter(
-                        x=df_chart[t_col], 
-                        y=df_chart['P-PDG'], 
+                    fig.add_trace(go.Scattergl(
+                        x=line_x, 
+                        y=line_y, 
                         mode='lines', 
                         name='Sensor P-PDG',
                         line=dict(color='#1f77b4', width=2)
                     ))
                     
-                    # Red markers for anomalies
-                    if 'anomaly_flag' in df_chart.columns:
-                        anomalies = df_chart[df_chart['anomaly_flag'] == 1]
-                        fig.add_trace(go.Scatter(
-                            x=anomalies[t_col], 
-                            y=anomalies['P-PDG'], 
+                    # Shaded spans for the well's anomaly events in range, from the event index
+                    event_index = fetch_event_index() if t_col == 'timestamp' else None
+                    if event_index is not None:
+                        in_view = event_index.overlapping(*visible, well=well_of(selected_batch))
+                        for event in in_view.head(MAX_EVENT_SPANS).itertuples():
+                            fig.add_vrect(x0=event.start, x1=event.end, fillcolor='red', opacity=0.15, line_width=0)
+                        if len(in_view):
+                            st.caption(f"{len(in_view):,} anomaly event(s) in range, longest {in_view['duration_s'].max():,.0f} s")
+
+                    # Red markers for anomalies (all of them, downsampling never drops one)
+                    if len(anom_x):
+                        fig.add_trace(go.Scattergl(
+                            x=anom_x, 
+                            y=anom_y, 
                             mode='markers', 
                             name='Anomaly Detected',
                             marker=dict(color='red', size=8, symbol='circle')
@@ -235,7 +412,7 @@ elif nav == "Overview":
     st.title("Project Overview")
     st.markdown("Global view of all sensor data processed strictly via cloud-native architecture.")
     
-    with st.spinner("Querying AWS Athena for 8.5M+ Global Records..."):
+    with st.spinner("Querying 8.5M+ Global Records..."):
         total, anom = fetch_global_metrics()
         
     if total > 0:
@@ -248,12 +425,34 @@ elif nav == "Overview":
         
         st.markdown("<br>", unsafe_allow_html=True)
         st.info(f"System running healthy. Processed {int(total):,} records via S3 -> SQS -> Lambda.")
+
+    event_index = fetch_event_index()
+    if event_index is not None and len(event_index):
+        st.subheader("Anomaly events")
+        reliability = event_index.per_well()
+        e1, e2, e3 = st.columns(3)
+        e1.metric("Anomaly Events", f"{len(event_index):,}")
+        e2.metric("Median Event Duration", f"{event_index.events['duration_s'].median():,.0f} s")
+        e3.metric("Mean Time Between Failures", f"{reliability['mtbf_h'].mean():,.1f} h")
+        st.dataframe(reliability, use_container_width=True)
+
+        first, last = event_index.events['start'].min(), event_index.events['end'].max()
+        f1, f2 = st.columns([1, 2])
+        well = f1.selectbox("Well", ["All wells"] + sorted(event_index.wells))
+        if first < last:
+            span = f2.slider("Event time range", min_value=first.to_pydatetime(), max_value=last.to_pydatetime(),
+                             value=(first.to_pydatetime(), last.to_pydatetime()))
+        else:
+            span = (first, last)
+        matches = event_index.overlapping(*span, well=None if well == "All wells" else well)
+        st.caption(f"{len(matches):,} event(s) overlap the range")
+        st.dataframe(matches.sort_values('duration_s', ascending=False), height=300, use_container_width=True)
         
 elif nav == "Data Explorer":
     st.title("Raw Data Explorer")
     st.markdown("Inspect the most recent 5,000 tuples of processed sensor data.")
     
-    with st.spinner("Fetching global data via Athena..."):
+    with st.spinner("Fetching global data..."):
         df_show = fetch_explorer_data()
         
     if not df_show.empty:
@@ -296,6 +495,18 @@ elif nav == "Settings":
     st.text_input("Curated Bucket Name", value=CURATED_BUCKET)
     st.slider("Anomaly Notification Threshold (%)", 0.0, 100.0, 5.0)
 
+    st.subheader("Data cache")
+    stats = get_data_cache().stats()
+    s1, s2, s3, s4 = st.columns(4)
+    s1.metric("Hit rate", f"{stats['hit_rate'] * 100:.1f}%")
+    s2.metric("Hits / misses", f"{stats['hits']:,} / {stats['misses']:,}")
+    s3.metric("Cached files", f"{stats['entries']:,}")
+    s4.metric("Evictions", f"{stats['evictions']:,}")
+    st.progress(min(stats['bytes'] / stats['budget_bytes'], 1.0),
+                text=f"{stats['bytes'] / 2**20:,.1f} MB of {stats['budget_bytes'] / 2**20:,.0f} MB budget, "
+                     f"{stats['stale']:,} file(s) reloaded after they changed in S3")
+
     if st.button("Clear Cache"):
         st.cache_data.clear()
+        get_data_cache().clear()
         st.success("Cache Cleared!")
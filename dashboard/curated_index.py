@@ -0,0 +1,100 @@
+"""
+Reader for the newest-first listing index the Lambda keeps in the curated bucket.
+
+Entries are zero-byte objects _index/<inverted write time>_<rows>_<bytes>/<curated key> (see
+lambda/listing_index.py, which writes them). One ListObjectsV2 call with MaxKeys=k returns the
+k newest curated objects with their row count and size, and the last index key of a page is the
+cursor for the next, older page.
+
+The dashboard image cannot import the Lambda modules, so the index format (listing_index.py)
+and the local listing (s3io.LocalS3Client) are vendored here verbatim; ml/test_dashboard.py
+fails if a copy drifts from its original.
+"""
+import datetime
+import os
+
+INDEX_PREFIX = '_index/'
+# 10^13 ms is the year 2286, so the inverted time always has 13 digits.
+INVERTED_BASE = 10 ** 13 - 1
+
+
+def parse_index_key(key):
+    """{'key', 'rows', 'size', 'last_modified', 'index_key'} for an index entry."""
+    stamp, _, curated_key = key[len(INDEX_PREFIX):].partition('/')
+    inverted, rows, size = stamp.split('_')
+    written_ms = INVERTED_BASE - int(inverted)
+    return {
+        'key': curated_key,
+        'rows': int(rows),
+        'size': int(size),
+        'last_modified': datetime.datetime.fromtimestamp(written_ms / 1000, datetime.timezone.utc),
+        'index_key': key,
+    }
+
+
+class LocalListing:
+    """The list_objects_v2 call of s3io.LocalS3Client, over a local directory holding the bucket."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        keys = []
+        # Only the directory part of the prefix can hold matching keys
+        for directory, _, names in os.walk(os.path.join(bucket_root, *os.path.dirname(Prefix).split('/'))):
+            for name in names:
+                if name.endswith('.partial'):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), bucket_root).replace(os.sep, '/')
+                if key.startswith(Prefix) and key > (ContinuationToken or StartAfter):
+                    keys.append(key)
+        keys.sort()
+        page = keys[:MaxKeys]
+        response = {'KeyCount': len(page), 'IsTruncated': len(keys) > MaxKeys}
+        if page:
+            response['Contents'] = []
+            for key in page:
+                stat = os.stat(self._path(Bucket, key))
+                response['Contents'].append({
+                    'Key': key, 'Size': stat.st_size,
+                    'LastModified': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+                })
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+
+def recent(s3_client, bucket, limit=30, cursor=None):
+    """
+    The `limit` most recently written objects older than `cursor` (None: the newest ones).
+    Returns (entries, next cursor or None when there is nothing older).
+    """
+    kwargs = {'Bucket': bucket, 'Prefix': INDEX_PREFIX, 'MaxKeys': limit}
+    if cursor:
+        kwargs['StartAfter'] = cursor
+    response = s3_client.list_objects_v2(**kwargs)
+    entries = [parse_index_key(obj['Key']) for obj in response.get('Contents', [])]
+    next_cursor = entries[-1]['index_key'] if entries and response.get('IsTruncated') else None
+    return entries, next_cursor
+
+
+def recent_by_listing(s3_client, bucket, limit=30, prefix='data/'):
+    """
+    Fallback for buckets without an index: a full, paginated listing sorted by LastModified.
+    Row counts are unknown (None).
+    """
+    objects = []
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        objects.extend(obj for obj in response.get('Contents', []) if obj['Key'].endswith('.parquet'))
+        if not response.get('IsTruncated'):
+            break
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+    objects.sort(key=lambda obj: obj['LastModified'], reverse=True)
+    return [{'key': obj['Key'], 'rows': None, 'size': obj['Size'], 'last_modified': obj['LastModified'], 'index_key': None}
+            for obj in objects[:limit]]
@@ -0,0 +1,102 @@
+"""
+Process-wide cache of curated parquet objects as Arrow tables, shared by all dashboard sessions.
+
+Unlike st.cache_data, which pickles a DataFrame per function argument and expires on a timer,
+entries here are keyed by S3 key, kept as Arrow tables (handed out as-is, no copy or pickle)
+and validated by ETag: a lookup costs one HeadObject, and the object is only downloaded again
+when it actually changed. Entries are evicted least recently used first once the decoded size
+of all tables exceeds the byte budget; a table larger than the whole budget is not cached.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_BUDGET_BYTES = 512 * 1024 * 1024
+# Lookups of the same key within this many seconds reuse the last validation (Streamlit reruns
+# a page on every widget change, which would otherwise HEAD the same object again and again).
+DEFAULT_REVALIDATE_SECONDS = 5
+
+
+class DataCache:
+    def __init__(self, bucket, s3_client=None, local_root=None, budget_bytes=DEFAULT_BUDGET_BYTES,
+                 revalidate_seconds=DEFAULT_REVALIDATE_SECONDS):
+        self.bucket = bucket
+        self.s3_client = s3_client
+        self.local_root = local_root
+        self.budget_bytes = budget_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.entries = OrderedDict()  # key -> (etag, table, validated_at), least recently used first
+        self.bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.local_root, self.bucket, *key.split('/'))
+
+    def etag(self, key):
+        """The object's current ETag (size and mtime for a local directory)."""
+        if self.local_root:
+            stat = os.stat(self._path(key))
+            return f"{stat.st_size}-{stat.st_mtime_ns}"
+        return self.s3_client.head_object(Bucket=self.bucket, Key=key)['ETag']
+
+    def _load(self, key):
+        """(table, etag of the version that was read)."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.local_root:
+            etag = self.etag(key)
+            return pq.read_table(self._path(key)), etag
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        return pq.read_table(pa.BufferReader(response['Body'].read())), response['ETag']
+
+    def get_table(self, key):
+        """The object as an Arrow table, from the cache while its ETag is unchanged."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[2] < self.revalidate_seconds:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[1]
+        etag = self.etag(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == etag:
+                    self.entries[key] = (etag, entry[1], now)
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                self.counters['stale'] += 1
+                self._drop(key)
+            self.counters['misses'] += 1
+        # Downloaded outside the lock; two sessions missing the same key both load it once
+        table, etag = self._load(key)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if table.nbytes <= self.budget_bytes:
+                self.entries[key] = (etag, table, now)
+                self.bytes += table.nbytes
+                while self.bytes > self.budget_bytes:
+                    self._drop(next(iter(self.entries)))
+                    self.counters['evictions'] += 1
+        return table
+
+    def _drop(self, key):
+        _, table, _ = self.entries.pop(key)
+        self.bytes -= table.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return dict(self.counters, entries=len(self.entries), bytes=self.bytes, budget_bytes=self.budget_bytes,
+                        hit_rate=self.counters['hits'] / lookups if lookups else 0.0)
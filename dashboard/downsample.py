@@ -0,0 +1,101 @@
+"""
+Shape-preserving downsampling for the sensor charts.
+
+  lttb()            Largest-Triangle-Three-Buckets: picks one point per bucket so that the
+                    polyline keeps the visual shape (peaks, steps) of the full series.
+  downsample()      lttb() on the line plus every anomaly point, so flagged samples are never
+                    dropped however far the series is reduced.
+  overview_series() turns rows of the precomputed overviews (lambda/overviews.py) into a
+                    min/max envelope and anomaly points for a time range, without raw rows.
+
+Charts ask for about MAX_POINTS points, a few per horizontal pixel of a wide chart.
+"""
+import numpy as np
+
+MAX_POINTS = 2000
+OVERVIEWS_PREFIX = 'overviews/'
+# Bucket widths (seconds) written by lambda/overviews.py, finest first.
+OVERVIEW_LEVELS = (8, 64, 512, 4096)
+
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points LTTB keeps out of the numeric series (x, y)."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Bucket edges for the n - 2 inner points; the first and last points are always kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        # The next bucket's average point (the last bucket is followed by the last point)
+        avg_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+        avg_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+        # Twice the area of the triangle (point a, candidate, next average) for every candidate
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(x, y, anomalies=None, n_out=MAX_POINTS):
+    """
+    Indices (sorted) of the points to draw: about n_out points of the line chosen by LTTB,
+    plus every index where anomalies is set. x may be datetime64, it is compared as int64.
+    """
+    x = np.asarray(x)
+    if x.dtype.kind == 'M':
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    keep = lttb(x, y, n_out)
+    if anomalies is not None:
+        keep = np.union1d(keep, np.flatnonzero(np.asarray(anomalies) != 0))
+    return keep
+
+
+def source_key(curated_key):
+    """
+    The raw key a curated file was scored from. Partitioned keys data/well=W/date=D/class=C/F
+    map back to data/C/F; merged part- files hold several sources and have none (None).
+    """
+    parts = curated_key.split('/')
+    if parts[-1].startswith('part-'):
+        return None
+    partition = dict(part.split('=', 1) for part in parts[:-1] if '=' in part)
+    if 'class' in partition:
+        return f"data/{partition['class']}/{parts[-1]}"
+    return curated_key
+
+
+def overview_key(curated_key):
+    """The overview object of a curated file: overviews/<raw key>, or None (see source_key)."""
+    source = source_key(curated_key)
+    return None if source is None else f"{OVERVIEWS_PREFIX}{source}"
+
+
+def overview_level(start, end, n_out=MAX_POINTS):
+    """The finest level whose buckets (two points each, min and max) fit n_out over [start, end]."""
+    seconds = (np.datetime64(end, 's') - np.datetime64(start, 's')).astype(np.int64)
+    for level in OVERVIEW_LEVELS:
+        if 2 * seconds / level <= n_out:
+            return level
+    return OVERVIEW_LEVELS[-1]
+
+
+def overview_series(overview, sensor):
+    """
+    (line x, line y, anomaly x, anomaly y) for one level of an overview DataFrame: the bucket
+    min and max as an envelope, and the extremes of the anomalous samples of every bucket.
+    """
+    times = overview['timestamp'].to_numpy()
+    line_x = np.repeat(times, 2)
+    line_y = np.column_stack([overview[f"{sensor}_min"].to_numpy(), overview[f"{sensor}_max"].to_numpy()]).ravel()
+    flagged = overview['anomalies'].to_numpy() > 0
+    anomaly_x = np.repeat(times[flagged], 2)
+    anomaly_y = np.column_stack([overview[f"{sensor}_anomaly_min"].to_numpy()[flagged],
+                                 overview[f"{sensor}_anomaly_max"].to_numpy()[flagged]]).ravel()
+    return line_x, line_y, anomaly_x, anomaly_y
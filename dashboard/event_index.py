@@ -0,0 +1,91 @@
+"""
+Time-range and well lookups on the anomaly event index (rollup/events.parquet, written by
+lambda/events.py: one row per contiguous run of flagged samples).
+
+EventIndex keeps the event start and end times as int64 arrays sorted by start, for all events
+and for every well. An event overlaps [a, b] when start <= b and end >= a. No event is longer
+than the longest one, so every match starts in [a - longest, b]: two binary searches cut that
+slice out of the sorted starts and only the slice is checked against end >= a. A query costs
+O(log n + candidates) and needs no tree, and the whole index is a few kilobytes per thousand
+events.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+EVENTS_KEY = 'rollup/events.parquet'
+
+
+def well_of(key):
+    """The 3W instance name of a curated key without the start timestamp (as lambda/layout.py)."""
+    stem = os.path.splitext(os.path.basename(key))[0]
+    return re.sub(r'_\d{14}$', '', stem)
+
+
+def to_nanoseconds(value):
+    return pd.Timestamp(value).value
+
+
+class EventIndex:
+    """Sorted-array interval lookups over a DataFrame of events (well, start, end, ...)."""
+
+    def __init__(self, events):
+        self.events = events.sort_values('start', kind='stable').reset_index(drop=True)
+        starts = self.events['start'].to_numpy('datetime64[ns]').view(np.int64)
+        ends = self.events['end'].to_numpy('datetime64[ns]').view(np.int64)
+        self.all = self._arrays(np.arange(len(starts)), starts, ends)
+        self.wells = {}
+        wells = self.events['well'].to_numpy()
+        for well in pd.unique(wells):
+            positions = np.flatnonzero(wells == well)  # ascending positions: still sorted by start
+            self.wells[well] = self._arrays(positions, starts[positions], ends[positions])
+
+    @staticmethod
+    def _arrays(positions, starts, ends):
+        longest = int((ends - starts).max()) if len(starts) else 0
+        return positions, starts, ends, longest
+
+    def __len__(self):
+        return len(self.events)
+
+    def positions(self, start=None, end=None, well=None):
+        """Row positions (in start order) of the events overlapping [start, end], optionally of one well."""
+        arrays = self.all if well is None else self.wells.get(well)
+        if arrays is None:
+            return np.empty(0, dtype=np.int64)
+        positions, starts, ends, longest = arrays
+        low, high = 0, len(starts)
+        if start is not None:
+            start = to_nanoseconds(start)
+            low = np.searchsorted(starts, start - longest, side='left')
+        if end is not None:
+            high = np.searchsorted(starts, to_nanoseconds(end), side='right')
+        candidates = np.arange(low, max(low, high))
+        if start is not None:
+            candidates = candidates[ends[candidates] >= start]
+        return positions[candidates]
+
+    def overlapping(self, start=None, end=None, well=None):
+        """The events overlapping [start, end] (open-ended when None), optionally of one well."""
+        return self.events.iloc[self.positions(start, end, well)]
+
+    def per_well(self):
+        """
+        Reliability per well: events, anomalous hours, longest event and the mean time between
+        failures (from the end of one event to the start of the next), in hours.
+        """
+        rows = []
+        for well, (positions, starts, ends, longest) in self.wells.items():
+            gaps = starts[1:] - np.maximum.accumulate(ends)[:-1]
+            rows.append({
+                'well': well,
+                'events': len(positions),
+                'anomalous_hours': float((ends - starts).sum()) / 3.6e12,
+                'longest_event_h': longest / 3.6e12,
+                'mtbf_h': float(np.clip(gaps, 0, None).mean()) / 3.6e12 if len(gaps) else np.nan,
+                'last_event': pd.Timestamp(int(ends.max())),
+            })
+        columns = ['well', 'events', 'anomalous_hours', 'longest_event_h', 'mtbf_h', 'last_event']
+        return pd.DataFrame(rows, columns=columns).sort_values('events', ascending=False, ignore_index=True)
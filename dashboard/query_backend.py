@@ -0,0 +1,167 @@
+"""
+Query backends for the dashboard.
+
+Every backend runs the dashboard's SQL against a `sensor_stream` table and returns a DataFrame:
+
+  DuckDBBackend   embedded DuckDB over the curated parquet files, read either from a local
+                  mirror of the bucket or straight from S3 with ranged reads (pyarrow S3FileSystem).
+                  The table is a pyarrow dataset, so DuckDB pushes column projections and filters
+                  into the scan: only the needed column chunks are read, and row groups and Hive
+                  partitions (well=/date=/class=) whose statistics exclude the filter are skipped.
+  AthenaBackend   the original awswrangler + Athena path.
+  FallbackBackend tries several backends in order, e.g. DuckDB first and Athena if it fails.
+
+Nothing here imports streamlit, so queries can be run and tested offline:
+    python dashboard/query_backend.py --local-root /data/lake "SELECT COUNT(*) FROM sensor_stream"
+"""
+import os
+import threading
+import time
+
+TABLE_NAME = 'sensor_stream'
+CURATED_PREFIX = 'data/'
+# How long the listing of the curated files is reused before the bucket is listed again.
+LISTING_TTL_SECONDS = 60
+
+
+class QueryBackend:
+    name = 'base'
+
+    def query(self, sql):
+        """Runs sql against the sensor_stream table and returns a pandas DataFrame."""
+        raise NotImplementedError
+
+
+class DuckDBBackend(QueryBackend):
+    """Embedded DuckDB over the curated parquet files of a local directory or S3 bucket."""
+
+    name = 'duckdb'
+
+    def __init__(self, bucket, local_root=None, region=None, prefix=CURATED_PREFIX):
+        import duckdb
+        import pyarrow.fs as pafs
+
+        if local_root:
+            self.filesystem = pafs.LocalFileSystem()
+            self.base_dir = os.path.join(local_root, bucket).replace(os.sep, '/')
+        else:
+            self.filesystem = pafs.S3FileSystem(region=region)
+            self.base_dir = bucket
+        self.prefix = prefix
+        self.connection = duckdb.connect()
+        self.lock = threading.Lock()
+        self.files = None
+        self.listed_at = 0.0
+        self.schemas = {}  # path -> physical schema, so a refresh only reads the footers of new files
+
+    def live_files(self):
+        """
+        The curated parquet files. lambda/compaction.py stages merged and rescored files outside
+        the prefix, so a plain listing never holds the same rows twice.
+        """
+        import pyarrow.fs as pafs
+
+        selector = pafs.FileSelector(f"{self.base_dir}/{self.prefix}", recursive=True, allow_not_found=True)
+        return sorted(info.path for info in self.filesystem.get_file_info(selector)
+                      if info.type == pafs.FileType.File and info.path.endswith('.parquet'))
+
+    def refresh(self):
+        """(Re)registers sensor_stream over the current files once the listing has expired."""
+        if self.files is not None and time.monotonic() - self.listed_at < LISTING_TTL_SECONDS:
+            return
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        files = self.live_files()
+        if not files:
+            raise FileNotFoundError(f"No curated parquet files under {self.base_dir}/{self.prefix}")
+        if files != self.files:
+            dataset = ds.dataset(files, filesystem=self.filesystem, format='parquet',
+                                 partitioning='hive', partition_base_dir=self.base_dir)
+            # Mirrored, partitioned and compacted files carry slightly different columns
+            self.schemas = {fragment.path: self.schemas.get(fragment.path) or fragment.physical_schema
+                            for fragment in dataset.get_fragments()}
+            schema = pa.unify_schemas([dataset.schema] + list(self.schemas.values()), promote_options='permissive')
+            dataset = ds.dataset(files, schema=schema, filesystem=self.filesystem, format='parquet',
+                                 partitioning=ds.partitioning(pa.schema([field for field in schema if field.name in ('well', 'date', 'class')]), flavor='hive'),
+                                 partition_base_dir=self.base_dir)
+            self.connection.register(TABLE_NAME, dataset)
+            self.files = files
+        self.listed_at = time.monotonic()
+
+    def query(self, sql):
+        with self.lock:
+            self.refresh()
+            return self.connection.execute(sql).df()
+
+
+class AthenaBackend(QueryBackend):
+    """The Glue/Athena sensor_stream table, queried through awswrangler."""
+
+    name = 'athena'
+
+    def __init__(self, database, s3_output):
+        self.database = database
+        self.s3_output = s3_output
+
+    def query(self, sql):
+        import awswrangler as wr
+        return wr.athena.read_sql_query(sql=sql, database=self.database, s3_output=self.s3_output)
+
+
+class FallbackBackend(QueryBackend):
+    """Runs a query on the first backend that succeeds."""
+
+    name = 'fallback'
+
+    def __init__(self, backends):
+        self.backends = list(backends)
+        self.last_used = None
+
+    def query(self, sql):
+        errors = []
+        for backend in self.backends:
+            try:
+                result = backend.query(sql)
+                self.last_used = backend.name
+                return result
+            except Exception as e:
+                print(f"{backend.name} query failed, trying the next backend: {e}")
+                errors.append(e)
+        raise errors[-1]
+
+
+def create_backend(kind, bucket, local_root=None, region=None, athena_database=None, athena_output=None):
+    """
+    Builds the backend for kind: 'duckdb', 'athena' or 'auto' (DuckDB, falling back to Athena).
+    A DuckDB backend that cannot be created (e.g. duckdb is not installed) degrades to Athena.
+    """
+    athena = AthenaBackend(athena_database, athena_output)
+    if kind == 'athena':
+        return athena
+    try:
+        duck = DuckDBBackend(bucket, local_root=local_root, region=region)
+    except Exception as e:
+        if kind == 'duckdb':
+            raise
+        print(f"DuckDB backend unavailable, using Athena: {e}")
+        return athena
+    if kind == 'duckdb' or local_root:
+        return duck
+    return FallbackBackend([duck, athena])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a query against the curated sensor_stream table.")
+    parser.add_argument('sql')
+    parser.add_argument('--bucket', default=os.environ.get('CURATED_BUCKET_NAME'))
+    parser.add_argument('--local-root', default=os.environ.get('LOCAL_S3_ROOT'))
+    parser.add_argument('--backend', default='duckdb', choices=['duckdb', 'athena', 'auto'])
+    args = parser.parse_args()
+    backend = create_backend(args.backend, args.bucket, local_root=args.local_root,
+                             region=os.environ.get('AWS_DEFAULT_REGION'))
+    start = time.perf_counter()
+    print(backend.query(args.sql).to_string())
+    print(f"{(time.perf_counter() - start) * 1000:.0f} ms")
@@ -21,4 +21,5 @@ module "compute" {
   curated_bucket_arn = module.s3_storage.curated_bucket_arn
   curated_bucket_id  = module.s3_storage.curated_bucket_id
   ingest_queue_arn   = module.queue.ingest_queue_arn
+  curated_layout     = var.curated_layout
 }
@@ -59,7 +59,10 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Effect = "Allow"
         Action = [
           "s3:PutObject",
-          "s3:GetObject"
+          "s3:GetObject",
+          "s3:AbortMultipartUpload", # Failed streamed uploads are aborted instead of left dangling
+          "s3:DeleteObject", # Compaction removes the small files it merged
+          "s3:ListBucket" # HeadObject on a missing marker returns 404 instead of 403
         ]
         Resource = [
           var.curated_bucket_arn,
@@ -99,6 +102,16 @@ resource "aws_lambda_function" "ml_inference_lambda" {
     variables = {
       RAW_BUCKET_NAME     = var.raw_bucket_id
       CURATED_BUCKET_NAME = var.curated_bucket_id
+      # mirror keeps the raw keys; "partitioned" (see lambda/layout.py) also deploys the compaction job
+      CURATED_LAYOUT      = var.curated_layout
+      # Curated parquet encoding (see lambda/curated_format.py); keep in sync with the compaction job.
+      # A narrower flag type changes the sensor_stream schema and needs a backfill first
+      CURATED_FLAG_TYPE   = "int64"
+      CURATED_COMPRESSION = "zstd"
+      # Per-stage timings as CloudWatch Embedded Metric Format log lines (see lambda/metrics.py);
+      # lower the sample rate if the log volume matters more than per-object detail
+      METRICS_MODE        = "emf"
+      METRICS_SAMPLE_RATE = "1"
     }
   }
 }
@@ -108,6 +121,99 @@ resource "aws_lambda_event_source_mapping" "sqs_trigger" {
   event_source_arn = var.ingest_queue_arn
   function_name    = aws_lambda_function.ml_inference_lambda.arn
   batch_size       = 10 # Process up to 10 incoming S3 uploads at a time
+
+  # Only the messages listed in the handler's batchItemFailures are redelivered
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# 6. Scheduled rollup compaction: folds the per-file KPI aggregates written by the inference
+# Lambda (aggregates/) into rollup/rollup.parquet, which the dashboard reads instead of Athena.
+# Same image, different handler.
+resource "aws_lambda_function" "rollup_lambda" {
+  function_name = "${var.project_name}-rollup-${var.environment}"
+  role          = aws_iam_role.lambda_role.arn
+  package_type  = "Image"
+  image_uri     = "${aws_ecr_repository.lambda_repo.repository_url}:latest"
+  architectures = ["arm64"]
+
+  image_config {
+    command = ["rollup.lambda_handler"]
+  }
+
+  timeout     = 300
+  memory_size = 512
+
+  environment {
+    variables = {
+      CURATED_BUCKET_NAME = var.curated_bucket_id
+    }
+  }
+}
+
+resource "aws_cloudwatch_event_rule" "rollup_schedule" {
+  name                = "${var.project_name}-rollup-schedule-${var.environment}"
+  schedule_expression = "rate(5 minutes)"
+}
+
+resource "aws_cloudwatch_event_target" "rollup_target" {
+  rule = aws_cloudwatch_event_rule.rollup_schedule.name
+  arn  = aws_lambda_function.rollup_lambda.arn
+}
+
+resource "aws_lambda_permission" "rollup_schedule" {
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.rollup_lambda.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.rollup_schedule.arn
+}
+
+# 7. Scheduled compaction of the partitioned curated layout: merges the small per-file objects
+# of every well/date/class partition into large sorted files (lambda/compaction.py). Only
+# deployed with curated_layout = "partitioned"; the mirror layout has no partitions to merge.
+resource "aws_lambda_function" "compaction_lambda" {
+  count         = var.curated_layout == "partitioned" ? 1 : 0
+  function_name = "${var.project_name}-compaction-${var.environment}"
+  role          = aws_iam_role.lambda_role.arn
+  package_type  = "Image"
+  image_uri     = "${aws_ecr_repository.lambda_repo.repository_url}:latest"
+  architectures = ["arm64"]
+
+  image_config {
+    command = ["compaction.lambda_handler"]
+  }
+
+  timeout     = 900
+  memory_size = 2048
+
+  environment {
+    variables = {
+      CURATED_BUCKET_NAME = var.curated_bucket_id
+      CURATED_FLAG_TYPE   = "int64"
+      CURATED_COMPRESSION = "zstd"
+    }
+  }
+}
+
+resource "aws_cloudwatch_event_rule" "compaction_schedule" {
+  count               = var.curated_layout == "partitioned" ? 1 : 0
+  name                = "${var.project_name}-compaction-schedule-${var.environment}"
+  schedule_expression = "rate(1 hour)"
+}
+
+resource "aws_cloudwatch_event_target" "compaction_target" {
+  count = var.curated_layout == "partitioned" ? 1 : 0
+  rule  = aws_cloudwatch_event_rule.compaction_schedule[0].name
+  arn   = aws_lambda_function.compaction_lambda[0].arn
+}
+
+resource "aws_lambda_permission" "compaction_schedule" {
+  count         = var.curated_layout == "partitioned" ? 1 : 0
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.compaction_lambda[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.compaction_schedule[0].arn
 }
 
 output "ecr_repository_url" {
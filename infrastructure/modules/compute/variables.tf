@@ -5,3 +5,4 @@ variable "raw_bucket_id" {}
 variable "curated_bucket_arn" {}
 variable "curated_bucket_id" {}
 variable "ingest_queue_arn" {}
+variable "curated_layout" {}
@@ -15,3 +15,9 @@ variable "environment" {
   type        = string
   default     = "dev"
 }
+
+variable "curated_layout" {
+  description = "Curated key layout: mirror (raw keys) or partitioned (well/date/class, compacted hourly)"
+  type        = string
+  default     = "mirror"
+}
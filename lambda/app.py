@@ -1,104 +1,594 @@
+import startup
+from startup import lazy_import
+import metrics
 import json
 import os
-import boto3
+import re
+import shutil
+import threading
+import time
 import urllib.parse
-import pandas as pd
-import joblib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from s3io import open_object, is_missing, S3RangeReader, S3MultipartWriter, LocalS3Client
 
-s3_client = boto3.client('s3')
+# Heavy libraries (boto3, pyarrow, numpy, pandas, joblib/sklearn) are imported lazily through
+# lazy_import() where they are first needed, which keeps them out of the init phase and keeps
+# pandas/sklearn out of the process entirely when the compiled engine is used.
+# EAGER_IMPORTS=1 imports the hot path during init instead, which can pay off because Lambda
+# runs the init phase with a full vCPU.
+EAGER_IMPORTS = os.environ.get('EAGER_IMPORTS') == '1'
 
-# We load the model outside the handler so it stays cached in memory for subsequent invocations
-# of the same Lambda execution environment.
-MODEL_FILE = '/tmp/model.joblib'
-FEATURES = ['P-PDG', 'P-TPT', 'T-TPT', 'P-MON-CKP', 'T-JUS-CKP']
 CURATED_BUCKET = os.environ.get('CURATED_BUCKET_NAME')
 RAW_BUCKET = os.environ.get('RAW_BUCKET_NAME')
+# 'mirror' keeps the raw key (data/<class>/<file>), 'partitioned' writes Hive-style
+# data/well=<well>/date=<day>/class=<class>/<file> partitions (see layout.py).
+CURATED_LAYOUT = os.environ.get('CURATED_LAYOUT', 'mirror')
+# Run against a local directory (one subdirectory per bucket) instead of S3, e.g. in tests.
+LOCAL_S3_ROOT = os.environ.get('LOCAL_S3_ROOT')
 MODEL_KEY = 'model.joblib'
+# 'sklearn' runs the pickled RandomForestClassifier, 'compiled' runs the flat-array forest from
+# forest.py (bit-for-bit identical predictions, no sklearn on the hot path).
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'sklearn')
+metrics.dimensions['engine'] = INFERENCE_ENGINE
+COMPILED_MODEL_KEY = 'model.forest.npz'
+# NO_PANDAS=1 (compiled engine only) keeps pandas out of the process for pyarrow-only IO.
+NO_PANDAS = os.environ.get('NO_PANDAS') == '1' and INFERENCE_ENGINE == 'compiled'
+if NO_PANDAS:
+    startup.block_imports('pandas')
+
+# We load the model outside the handler so it stays cached in memory for subsequent invocations
+# of the same Lambda execution environment. The on-disk copy is keyed by the S3 version (or ETag)
+# of the model object, and a cheap HEAD request at most every MODEL_REFRESH_SECONDS picks up a
+# newly uploaded model without restarting the container.
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', '/tmp/model-cache')
+MODEL_REFRESH_SECONDS = float(os.environ.get('MODEL_REFRESH_SECONDS', '60'))
+# Small marker objects in the curated bucket remember which raw object versions were already
+# scored, and by which model version, so a redelivered SQS message does not download, predict
+# and upload the file again (and a backfill only re-scores what an older model scored).
+MARKER_PREFIX = '_processed/'
+
+# Models trained with rolling-window features (see rolling.py) need the recent history of each
+# well. It is kept per well between invocations, so the next file of a well continues its
+# windows if it starts at most ROLLING_MAX_GAP_SECONDS after the previous one ended.
+ROLLING_MAX_GAP_SECONDS = float(os.environ.get('ROLLING_MAX_GAP_SECONDS', '1'))
+
+# Concurrency: how many S3 objects of one batch are processed at the same time.
+# MAX_WORKERS=1 restores the old strictly sequential behaviour.
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '0'))  # 0 = size automatically
+OBJECT_MEMORY_MB = int(os.environ.get('OBJECT_MEMORY_MB', '256'))  # working set budget per in-flight file
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+# well id -> (RollingFeatures, lock held while one of the well's files is scored)
+_rolling_states = {}
+_rolling_states_lock = threading.Lock()
 
-model_loaded = False
 global_model = None
+model_version = None
+model_checked_at = 0.0
+# Timings of the last (re)load, in milliseconds, so cold-start cost can be tracked.
+model_load_stats = {}
+
+def get_s3_client():
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            if LOCAL_S3_ROOT:
+                _s3_client = LocalS3Client(LOCAL_S3_ROOT)
+            else:
+                _s3_client = lazy_import('boto3').client('s3')
+    return _s3_client
+
+def model_object_version(key):
+    """Returns the S3 VersionId of the model object, or its ETag on unversioned buckets."""
+    head = get_s3_client().head_object(Bucket=RAW_BUCKET, Key=key)
+    version_id = head.get('VersionId')
+    if version_id and version_id != 'null':
+        return version_id
+    return head['ETag'].strip('"')
+
+def fetch_model(key, version):
+    """
+    Downloads one model version into MODEL_CACHE_DIR (once) and returns its local path.
+
+    The compiled forest is unpacked into uncompressed .npy files so it can be memory-mapped:
+    loading is then just mapping pages, and processes sharing the container share them too.
+    """
+    safe_version = re.sub(r'[^A-Za-z0-9._-]', '_', version)
+    version_dir = os.path.join(MODEL_CACHE_DIR, safe_version)
+    local_path = os.path.join(version_dir, 'forest' if key == COMPILED_MODEL_KEY else os.path.basename(key))
+    if os.path.exists(local_path):
+        return local_path
+
+    os.makedirs(version_dir, exist_ok=True)
+    download_path = os.path.join(version_dir, f"download-{os.getpid()}-{os.path.basename(key)}")
+    get_s3_client().download_file(RAW_BUCKET, key, download_path)
+    if key == COMPILED_MODEL_KEY:
+        CompiledForest = lazy_import('forest').CompiledForest
+        staging_dir = local_path + '.partial'
+        CompiledForest.load(download_path).save_dir(staging_dir)
+        os.replace(staging_dir, local_path)
+        os.remove(download_path)
+    else:
+        os.replace(download_path, local_path)
+
+    # Only the current version is kept, so /tmp does not grow with every model upload.
+    for entry in os.listdir(MODEL_CACHE_DIR):
+        if entry != safe_version:
+            shutil.rmtree(os.path.join(MODEL_CACHE_DIR, entry), ignore_errors=True)
+    return local_path
 
 def load_model():
-    global model_loaded, global_model
-    if not model_loaded:
-        print(f"Downloading model from s3://{RAW_BUCKET}/{MODEL_KEY}")
-        s3_client.download_file(RAW_BUCKET, MODEL_KEY, MODEL_FILE)
-        global_model = joblib.load(MODEL_FILE)
-        model_loaded = True
-        print("Model loaded successfully.")
+    """Returns the cached model, reloading it when a new version was uploaded to S3."""
+    global global_model, model_version, model_checked_at, model_load_stats
+    now = time.monotonic()
+    if global_model is not None and now - model_checked_at < MODEL_REFRESH_SECONDS:
+        return global_model
+
+    key = COMPILED_MODEL_KEY if INFERENCE_ENGINE == 'compiled' else MODEL_KEY
+    start = time.perf_counter()
+    try:
+        version = model_object_version(key)
+    except Exception as e:
+        if global_model is None:
+            raise
+        # A failed freshness check (throttling, a timeout) must not fail the whole batch:
+        # keep serving the cached model and check again after the next interval.
+        print(f"Model freshness check failed, keeping version {model_version}: {e}")
+        model_checked_at = now
+        return global_model
+    model_checked_at = now
+    if global_model is not None and version == model_version:
+        return global_model
+
+    print(f"Loading model s3://{RAW_BUCKET}/{key} (version {version})")
+    check_done = time.perf_counter()
+    local_path = fetch_model(key, version)
+    fetch_done = time.perf_counter()
+    if INFERENCE_ENGINE == 'compiled':
+        model = lazy_import('forest').CompiledForest.load(local_path, mmap_mode='r')
+    else:
+        model = lazy_import('joblib').load(local_path, mmap_mode='r')
+    load_done = time.perf_counter()
+
+    global_model, model_version = model, version
+    model_load_stats = {
+        'version': version,
+        'freshness_check_ms': round((check_done - start) * 1000, 1),
+        'fetch_ms': round((fetch_done - check_done) * 1000, 1),
+        'deserialize_ms': round((load_done - fetch_done) * 1000, 1),
+    }
+    print(f"Model loaded successfully ({INFERENCE_ENGINE} engine): {json.dumps(model_load_stats)}")
     return global_model
 
-def lambda_handler(event, context):
-    print("Received event: " + json.dumps(event))
-    
-    # 1. Load the ML model
-    model = load_model()
-    
-    # 2. Process SQS messages
+def pool_size(n_objects):
+    """Sizes the worker pool from the Lambda's memory and vCPUs, capped by the number of objects."""
+    if MAX_WORKERS > 0:
+        return max(1, min(MAX_WORKERS, n_objects))
+    memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024'))
+    # Downloads and uploads are network bound, so allow two workers per vCPU as long as
+    # every in-flight file still fits into the function's memory.
+    by_cpu = 2 * (os.cpu_count() or 1)
+    by_memory = max(1, memory_mb // OBJECT_MEMORY_MB)
+    return max(1, min(by_cpu, by_memory, n_objects))
+
+def collect_objects(event):
+    """Flattens the SQS batch into (message_id, bucket, key, etag) tuples that should be scored."""
+    objects = []
     for record in event['Records']:
         body = json.loads(record['body'])
-        
+
         # SQS could contain multiple S3 events (or test events)
         if 'Records' not in body:
             print("No S3 records found in SQS body. Skipping.")
             continue
-            
+
         for s3_event in body['Records']:
             source_bucket = s3_event['s3']['bucket']['name']
             source_key = urllib.parse.unquote_plus(s3_event['s3']['object']['key'])
-            
+
             # Prevent accidental infinite loops if the model runs directly on the curated bucket,
             # or if it's the model file itself
             if source_bucket == CURATED_BUCKET:
                 print(f"Skipping key {source_key} - it is already in the curated bucket.")
                 continue
-            if 'model.joblib' in source_key:
+            if 'model.joblib' in source_key or 'model.forest.npz' in source_key:
                 print("Skipping the model file.")
                 continue
             if not source_key.endswith('.parquet'):
                 print(f"Skipping non-parquet file: {source_key}")
                 continue
-                
+            source_etag = s3_event['s3']['object'].get('eTag')
+            objects.append((record.get('messageId'), source_bucket, source_key, source_etag))
+    return objects
+
+def warm_imports():
+    """Imports everything the hot path of the configured engine needs."""
+    for name in ('boto3', 'numpy', 'pyarrow', 'pyarrow.parquet', 'features', 'rolling', 'rollup', 'layout',
+                 'listing_index', 'overviews', 'events', 'curated_format'):
+        lazy_import(name)
+    if CURATED_LAYOUT == 'partitioned':
+        lazy_import('compaction')
+    if INFERENCE_ENGINE == 'compiled':
+        lazy_import('forest')
+    else:
+        lazy_import('pandas')
+        lazy_import('joblib')
+        lazy_import('sklearn.ensemble')
+
+def predict(model, features):
+    """
+    Runs the model on a float matrix whose columns are in the model's feature order.
+    Returns (predictions, anomaly scores); the scores are None for models without predict_proba.
+    Classifiers predict the argmax of predict_proba anyway, so the scores cost no second pass.
+    """
+    if INFERENCE_ENGINE != 'compiled':
+        # sklearn was fitted on a DataFrame and warns about unnamed inputs, so give it one.
+        pd = lazy_import('pandas')
+        features = pd.DataFrame(features, columns=model_features(model))
+    if not hasattr(model, 'predict_proba'):
+        return model.predict(features), None
+    np = lazy_import('numpy')
+    probabilities = model.predict_proba(features)
+    classes = np.asarray(model.classes_)
+    return classes.take(np.argmax(probabilities, axis=1)), lazy_import('features').anomaly_scores(probabilities, classes)
+
+def model_features(model):
+    """The model's own feature order (recorded at fit time), falling back to FEATURES."""
+    names = getattr(model, 'feature_names_in_', None)
+    return lazy_import('features').FEATURES if names is None else list(names)
+
+def well_id(key):
+    """'data/3/WELL-00014_20170101000000.parquet' -> 'WELL-00014'. Simulated/drawn instances have none."""
+    match = re.match(r'^(WELL-\d+)_\d{14}\.parquet$', os.path.basename(key))
+    return match.group(1) if match else None
+
+def rolling_state(model, source_key):
+    """Returns (RollingFeatures, lock) for the file: the well's carried state, or a fresh one."""
+    rolling = lazy_import('rolling')
+    names = model_features(model)
+    well = well_id(source_key)
+    if well is None or not rolling.has_rolling_features(names):
+        return rolling.RollingFeatures(names), nullcontext()
+    with _rolling_states_lock:
+        entry = _rolling_states.get(well)
+        if entry is None or entry[0].names != names:
+            # First file of this well, or a hot-reloaded model with different features
+            entry = _rolling_states[well] = (rolling.RollingFeatures(names), threading.Lock())
+        return entry
+
+def continues(state, timestamps):
+    """True if the chunk starting at timestamps[0] directly follows the state's last sample."""
+    np = lazy_import('numpy')
+    if state.last_timestamp is None or timestamps is None or len(timestamps) == 0:
+        return False
+    gap = (timestamps[0] - state.last_timestamp) / np.timedelta64(1, 's')
+    return 0 < gap <= ROLLING_MAX_GAP_SECONDS
+
+def score_table(model, table, state):
+    """Scores one Arrow table (a row group) and returns the rows we predicted on, or None."""
+    pa = lazy_import('pyarrow')
+    features = lazy_import('features')
+
+    metrics.count('rows_in', table.num_rows)
+    with metrics.span('features'):
+        # Raw sensors plus any rolling-window features, continuing the windows of earlier chunks
+        columns = state.transform({name: table.column(name).to_numpy() for name in state.bases})
+        if 'timestamp' in table.column_names and table.num_rows:
+            state.last_timestamp = table.column('timestamp').to_numpy()[-1]
+
+        # Same cleaning as training: drop rows with NaN/inf (or null) features, clip the rest
+        X, valid = features.prepare_features(columns)
+        if len(X) == 0:
+            return None
+        if len(X) < table.num_rows:
+            table = table.filter(pa.array(valid))
+
+    with metrics.span('predict'):
+        predictions, scores = predict(model, X)
+
+    # Clean it up for the database: 0 = Normal, 1 = Anomaly
+    # To keep it simple and clean, let's just save the rows we predicted on.
+    flags = features.anomaly_flags(predictions, getattr(model, 'classes_', (-1, 1)))
+    metrics.count('rows_out', len(flags))
+    table = table.append_column('anomaly_flag', pa.array(flags))
+    if scores is not None:
+        table = table.append_column('anomaly_score', pa.array(scores))
+    return table
+
+def score_parquet(model, source, sink, state=None, aggregators=()):
+    """
+    Scores a parquet file row group by row group and writes the result incrementally to sink.
+
+    sink is a layout table sink (see layout.py) or a plain binary file object. Only the sensors
+    the model needs (plus the timestamp index) are read, so peak memory is bounded by one
+    projected row group instead of the whole file. Rolling windows continue across row groups,
+    and across files when `state` carries a well's history that this file directly follows.
+    Every scored row group is also fed to each of `aggregators` (rollup.FileAggregator,
+    overviews.OverviewBuilder, events.EventBuilder).
+    Returns the number of rows written.
+    """
+    pq = lazy_import('pyarrow.parquet')
+    wrapped = not hasattr(sink, 'write_table')
+    if wrapped:
+        sink = lazy_import('layout').ParquetFileSink(sink)
+    if state is None:
+        state = lazy_import('rolling').RollingFeatures(model_features(model))
+    with metrics.span('decode'):
+        parquet_file = pq.ParquetFile(source)
+    rows_written = 0
+    try:
+        for row_group in range(parquet_file.num_row_groups):
+            with metrics.span('decode'):
+                table = parquet_file.read_row_group(row_group, columns=state.bases, use_pandas_metadata=True)
+            metrics.count('row_groups')
+            if row_group == 0 and state.position:
+                timestamps = table.column('timestamp').to_numpy() if 'timestamp' in table.column_names else None
+                if not continues(state, timestamps):
+                    state.reset()
+            scored = score_table(model, table, state)
+            if scored is None:
+                continue
+            with metrics.span('encode'):
+                sink.write_table(scored)
+            rows_written += scored.num_rows
+            with metrics.span('aggregate'):
+                for aggregator in aggregators:
+                    aggregator.add(scored)
+    finally:
+        # A plain file object stays open for the caller, only the parquet footer is written here
+        if wrapped and sink.writer is not None:
+            sink.writer.close()
+    return rows_written
+
+def marker_key(source_bucket, source_key):
+    return f"{MARKER_PREFIX}{source_bucket}/{source_key}"
+
+def already_processed(source_bucket, source_key, source_etag):
+    """
+    Checks the marker object to see whether this exact object version was already scored, by
+    the current model version when one was loaded from S3 (a new model re-scores the object).
+    """
+    s3_client = get_s3_client()
+    try:
+        head = s3_client.head_object(Bucket=CURATED_BUCKET, Key=marker_key(source_bucket, source_key))
+    except lazy_import('botocore.exceptions').ClientError as e:
+        if is_missing(e):
+            return False
+        raise
+    if source_etag is None:
+        source_etag = s3_client.head_object(Bucket=source_bucket, Key=source_key)['ETag'].strip('"')
+    metadata = head.get('Metadata', {})
+    if model_version is not None and metadata.get('model-version') != model_version:
+        return False
+    return metadata.get('source-etag') == source_etag
+
+def previous_outputs(source_bucket, source_key):
+    """The output keys recorded by the marker of an earlier version of this object, if any."""
+    try:
+        body = get_s3_client().get_object(Bucket=CURATED_BUCKET, Key=marker_key(source_bucket, source_key))['Body'].read()
+    except lazy_import('botocore.exceptions').ClientError as e:
+        if is_missing(e):
+            return []
+        raise
+    return json.loads(body).get('outputs', [])
+
+def remove_stale_outputs(s3_client, previous, current):
+    """
+    Deletes what an earlier version of the object wrote and this version did not overwrite: its
+    listing index entries, and outputs such as a day partition or the curated rows of a version
+    that now scores to nothing. Called once the new outputs are in place.
+    """
+    listing_index = lazy_import('listing_index')
+    stale = [key for key in previous if key not in set(current)]
+    listing_index.remove(s3_client, CURATED_BUCKET, [key for key in stale if key.startswith(listing_index.INDEX_PREFIX)])
+    for key in stale:
+        if not key.startswith(listing_index.INDEX_PREFIX):
+            s3_client.delete_object(Bucket=CURATED_BUCKET, Key=key)
+
+def remove_stale_outputs(s3_client, previous, current):
+    """
+    Deletes what an earlier version of the object wrote and this version did not overwrite: its
+    listing index entries, and outputs such as a day partition or the curated rows of a version
+    that now scores to nothing. Called once the new outputs are in place.
+    """
+    listing_index = lazy_import('listing_index')
+    stale = [key for key in previous if key not in set(current)]
+    listing_index.remove(s3_client, CURATED_BUCKET, [key for key in stale if key.startswith(listing_index.INDEX_PREFIX)])
+    for key in stale:
+        if not key.startswith(listing_index.INDEX_PREFIX):
+            s3_client.delete_object(Bucket=CURATED_BUCKET, Key=key)
+
+def mark_processed(source_bucket, source_key, source_etag, output_keys):
+    """Writes the marker after the curated output is in place. Overwriting it is harmless."""
+    s3_client = get_s3_client()
+    if source_etag is None:
+        source_etag = s3_client.head_object(Bucket=source_bucket, Key=source_key)['ETag'].strip('"')
+    metadata = {'source-etag': source_etag}
+    if model_version is not None:
+        metadata['model-version'] = model_version
+    s3_client.put_object(
+        Bucket=CURATED_BUCKET,
+        Key=marker_key(source_bucket, source_key),
+        Body=json.dumps({'source': f"s3://{source_bucket}/{source_key}", 'model_version': model_version,
+                         'outputs': output_keys}).encode('utf-8'),
+        ContentType='application/json',
+        Metadata=metadata
+    )
+
+def curated_sink(s3_client, source_key):
+    """The table sink for one raw object in the configured CURATED_LAYOUT and encoding (see curated_format.py)."""
+    layout = lazy_import('layout')
+    encoding = lazy_import('curated_format').DEFAULT_ENCODING
+    if CURATED_LAYOUT == 'partitioned':
+        compaction = lazy_import('compaction')
+        return layout.PartitionedSink(s3_client, CURATED_BUCKET, source_key, encoding,
+                                      output_key=lambda key: compaction.output_key(s3_client, CURATED_BUCKET, key))
+    return layout.ParquetFileSink(S3MultipartWriter(s3_client, CURATED_BUCKET, source_key), source_key, encoding)
+
+def process_object(model, source_bucket, source_key, source_etag=None):
+    """
+    Downloads, scores and uploads a single raw parquet object.
+    Returns the number of rows written, or None if this version was already processed.
+    """
+    with metrics.trace('object', source_key=source_key, model_version=model_version) as trace:
+        with metrics.span('marker'):
+            if already_processed(source_bucket, source_key, source_etag):
+                print(f"Skipping s3://{source_bucket}/{source_key} - this version was already processed.")
+                trace.set(skipped=True)
+                return None
             print(f"Processing object: s3://{source_bucket}/{source_key}")
-            
-            # 3. Download the data file
-            local_input_path = f"/tmp/input_{os.path.basename(source_key)}"
-            s3_client.download_file(source_bucket, source_key, local_input_path)
-            
-            # 4. Run Inference
-            try:
-                df = pd.read_parquet(local_input_path)
-                
-                # Filter down to the exact rows we can predict on (no NaNs)
-                inference_df = df.dropna(subset=FEATURES).copy()
-                
-                if inference_df.empty:
-                    print("No valid data available for inference after dropping NaNs.")
+            s3_client = get_s3_client()
+            listing_index = lazy_import('listing_index')
+            previous = previous_outputs(source_bucket, source_key)
+
+        # 3. Stream the data file straight from S3 into Arrow (nothing is written to /tmp)
+        # 4. Run Inference one row group at a time
+        # 5. Stream the predictions to the Curated Bucket as multipart uploads (see layout.py)
+        # The mirror layout uses the exact same key structure:
+        # For example: data/9/SIMULATED_00002.parquet -> curved_bucket/data/9/SIMULATED_00002.parquet
+        # The partitioned layout writes data/well=SIMULATED_00002/date=.../class=9/SIMULATED_00002.parquet
+        state, well_lock = rolling_state(model, source_key)
+        aggregator = lazy_import('rollup').FileAggregator(source_key, state.bases)
+        overview = lazy_import('overviews').OverviewBuilder(state.bases)
+        events = lazy_import('events').EventBuilder(source_key, state.bases)
+        with well_lock, open_object(s3_client, source_bucket, source_key) as source:
+            with curated_sink(s3_client, source_key) as sink:
+                rows_written = score_parquet(model, source, sink, state, (aggregator, overview, events))
+        # Ranged reads of a large object happen while pyarrow decodes it
+        reader = getattr(source, 'raw', None)
+        if isinstance(reader, S3RangeReader):
+            trace.shift('decode', 'download', reader.fetch_seconds * 1000)
+            trace.count('bytes_in', reader.bytes_read)
+
+        if rows_written == 0:
+            print(f"No valid data available for inference after dropping NaNs: {source_key}")
+            with metrics.span('marker'):
+                remove_stale_outputs(s3_client, previous, [])
+                mark_processed(source_bucket, source_key, source_etag, [])
+            return 0
+
+        print(f"Successfully uploaded {rows_written:,} predictions to s3://{CURATED_BUCKET}/{', '.join(sink.keys)}")
+
+        # 6. Per-hour KPI aggregates for the rollup table read by the dashboard (see rollup.py)
+        rollup = lazy_import('rollup')
+        aggregate_key = rollup.aggregate_key(source_key)
+        with metrics.span('aggregate'):
+            s3_client.put_object(Bucket=CURATED_BUCKET, Key=aggregate_key, Body=rollup.to_parquet_bytes(aggregator.to_table()))
+        output_keys = sink.keys + [aggregate_key]
+
+        # 7. Multi-resolution overviews for the dashboard charts (see overviews.py)
+        overviews = lazy_import('overviews')
+        with metrics.span('aggregate'):
+            overview_table = overview.to_table()
+            if overview_table is not None:
+                overview_key = overviews.overview_key(source_key)
+                s3_client.put_object(Bucket=CURATED_BUCKET, Key=overview_key, Body=overviews.to_parquet_bytes(overview_table))
+                output_keys.append(overview_key)
+
+        # 8. Anomaly event records, folded into the event index the dashboard queries (see events.py)
+        events_key = lazy_import('events').event_key(source_key)
+        with metrics.span('aggregate'):
+            s3_client.put_object(Bucket=CURATED_BUCKET, Key=events_key, Body=rollup.to_parquet_bytes(events.to_table()))
+            output_keys.append(events_key)
+
+        # 9. Newest-first listing index read by the dashboard (see listing_index.py); the entries of
+        # the outputs this version replaces are dropped once the new ones are in place
+        with metrics.span('index'):
+            index_keys = [listing_index.append(s3_client, CURATED_BUCKET, key, rows, size) for key, rows, size in sink.outputs()]
+            remove_stale_outputs(s3_client, previous, output_keys + index_keys)
+        with metrics.span('marker'):
+            mark_processed(source_bucket, source_key, source_etag, output_keys + index_keys)
+        return rows_written
+
+def object_tasks(model, objects):
+    """
+    Splits the batch into the tasks of the worker pool. With rolling-window features, the files
+    of one well must be scored in time order for their windows to continue (see rolling_state),
+    so they form one task in file name order (the name ends with the start timestamp); every
+    other object is a task of its own.
+    """
+    if not lazy_import('rolling').has_rolling_features(model_features(model)):
+        return [[obj] for obj in objects]
+    tasks, wells = [], {}
+    for obj in objects:
+        well = well_id(obj[2])
+        if well is None:
+            tasks.append([obj])
+        elif well not in wells:
+            wells[well] = [obj]
+            tasks.append(wells[well])
+        else:
+            wells[well].append(obj)
+    for group in wells.values():
+        group.sort(key=lambda obj: os.path.basename(obj[2]))
+    return tasks
+
+def process_objects(model, objects):
+    """Scores objects one after the other. Returns [(message id, source key, exception or None)]."""
+    results = []
+    for message_id, source_bucket, source_key, source_etag in objects:
+        try:
+            process_object(model, source_bucket, source_key, source_etag)
+            results.append((message_id, source_key, None))
+        except Exception as e:
+            results.append((message_id, source_key, e))
+    return results
+
+def lambda_handler(event, context):
+    # The event itself is not logged: a batch of S3 notifications can be large and every
+    # logged byte is ingested by CloudWatch. Per-stage timings go out as metrics (metrics.py).
+    start_type = metrics.start_invocation()
+    with metrics.trace('invocation', request_id=getattr(context, 'aws_request_id', None)) as trace:
+        return handle_batch(event, trace, start_type)
+
+def handle_batch(event, trace, start_type):
+    """Scores the objects of one SQS batch and returns the partial batch response."""
+    print(f"Received {len(event.get('Records', []))} SQS record(s) ({start_type} start).")
+
+    # 1. Load the ML model
+    with metrics.span('model_load'):
+        model = load_model()
+    trace.set(model_version=model_version)
+    breakdown = startup.report({'engine': INFERENCE_ENGINE, 'model_load_ms': model_load_stats})
+    if breakdown is not None:
+        print("Startup profile: " + json.dumps(breakdown))
+
+    # 2. Process SQS messages
+    objects = collect_objects(event)
+    trace.count('objects', len(objects))
+    if not objects:
+        return {'batchItemFailures': []}
+
+    # Each object succeeds or fails on its own: a bad file is logged and the rest of the
+    # batch is still scored, instead of aborting on the first exception.
+    tasks = object_tasks(model, objects)
+    workers = pool_size(len(tasks))
+    print(f"Processing {len(objects)} object(s) with {workers} worker(s).")
+    failed_messages = []
+    with metrics.span('objects'), ThreadPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(lambda task: process_objects(model, task), tasks):
+            for message_id, source_key, error in results:
+                if error is None:
                     continue
-                    
-                # The model returns 1 for inliers (normal) and -1 for outliers (anomalies)
-                predictions = model.predict(inference_df[FEATURES])
-                
-                # Clean it up for the database: 0 = Normal, 1 = Anomaly
-                inference_df['anomaly_flag'] = [0 if p == 1 else 1 for p in predictions]
-                
-                # Merge back to the main DataFrame (or just save the inference_df)
-                # To keep it simple and clean, let's just save the rows we predicted on.
-                local_output_path = f"/tmp/output_{os.path.basename(source_key)}"
-                
-                # 5. Save and Upload to Curated Bucket
-                inference_df.to_parquet(local_output_path, engine='pyarrow')
-                
-                # Using the exact same key structure means it organizes nicely
-                # For example: data/9/SIMULATED_00002.parquet -> curved_bucket/data/9/SIMULATED_00002.parquet
-                s3_client.upload_file(local_output_path, CURATED_BUCKET, source_key)
-                print(f"Successfully uploaded predictions to s3://{CURATED_BUCKET}/{source_key}")
-                
-            except Exception as e:
-                print(f"Error processing {source_key}: {e}")
-                raise e
-
-    return {
-        'statusCode': 200,
-        'body': json.dumps('Inference processing complete.')
-    }
+                print(f"Error processing {source_key}: {error}")
+                if message_id is None:
+                    # Without a message id SQS cannot retry just this record, so fail the whole batch.
+                    raise error
+                if message_id not in failed_messages:
+                    failed_messages.append(message_id)
+
+    # Partial batch response: SQS only redelivers the messages listed here. Requires
+    # function_response_types = ["ReportBatchItemFailures"] on the event source mapping.
+    if failed_messages:
+        print(f"{len(failed_messages)} message(s) failed and will be retried: {failed_messages}")
+    trace.count('failed_messages', len(failed_messages))
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_messages]}
+
+if EAGER_IMPORTS:
+    _eager_start = time.perf_counter()
+    warm_imports()
+    startup.record_phase('eager_imports', _eager_start)
+startup.record_phase('handler_module_import', startup.INIT_START)
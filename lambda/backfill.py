@@ -0,0 +1,177 @@
+"""
+Backfill: re-scores the raw bucket with the current model, on one machine.
+
+After ml/train_model.py uploads a new model, historical data is only re-scored when its S3
+event is replayed. This job enumerates the raw parquet objects instead (optionally only some
+class directories, or files starting in a date range), and scores them with the Lambda's own
+process_object: same layout, aggregates, overviews, listing index and markers.
+
+Objects are sharded by well, each well's files in time order, so rolling windows carry from one
+file to the next exactly as in the Lambda, and the shards are spread over a process pool.
+Objects whose marker already records the current model version (and the same source ETag) are
+skipped, and every completed shard is appended to a local checkpoint file, so an interrupted
+run resumes where it stopped without even checking the markers of finished objects again.
+
+Usage:
+    python backfill.py <raw bucket> --curated-bucket <bucket> [--class 3 --class 4]
+                       [--since 2017-01-01] [--until 2017-12-31] [--workers 4] [--local-root DIR]
+
+--workers 1 scores in the calling process, which also works with an in-process moto mock.
+"""
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app
+
+RAW_PREFIX = 'data/'
+CHECKPOINT_FILE = os.environ.get('BACKFILL_CHECKPOINT', 'backfill-checkpoint.jsonl')
+
+
+def start_date(key):
+    """'data/3/WELL-00014_20170101000000.parquet' -> '2017-01-01'; None without a timestamp."""
+    match = re.search(r'_(\d{4})(\d{2})(\d{2})\d{6}\.parquet$', key)
+    return '-'.join(match.groups()) if match else None
+
+
+def list_raw_objects(s3_client, bucket, classes=None, since=None, until=None, prefix=RAW_PREFIX):
+    """[(key, etag or None, size)] of the raw parquet objects to score."""
+    prefixes = [f"{prefix}{label}/" for label in classes] if classes else [prefix]
+    objects = []
+    for object_prefix in prefixes:
+        kwargs = {'Bucket': bucket, 'Prefix': object_prefix}
+        while True:
+            response = s3_client.list_objects_v2(**kwargs)
+            for obj in response.get('Contents', []):
+                key = obj['Key']
+                if not key.endswith('.parquet') or os.path.basename(key).startswith('model.'):
+                    continue
+                if since or until:
+                    date = start_date(key)
+                    if date is None or (since and date < since) or (until and date > until):
+                        continue
+                objects.append((key, obj.get('ETag', '').strip('"') or None, obj['Size']))
+            if not response.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+    return objects
+
+
+def shard_by_well(objects):
+    """One shard per well (its files in key, i.e. time, order), largest first; no well: one per file."""
+    shards = {}
+    for key, etag, size in sorted(objects):
+        shards.setdefault(app.well_id(key) or key, []).append((key, etag, size))
+    return sorted(shards.values(), key=lambda shard: -sum(size for _, _, size in shard))
+
+
+def load_checkpoint(path, model_version):
+    """{key: (etag, size)} of the objects a previous run already scored with model_version."""
+    done = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted write
+                if entry.get('model_version') == model_version and entry.get('rows') is not None:
+                    done[entry['key']] = (entry.get('etag'), entry.get('size'))
+    return done
+
+
+def init_worker(raw_bucket, curated_bucket, local_root):
+    """Points the Lambda module at the buckets (pool processes may be forked or spawned)."""
+    app.RAW_BUCKET, app.CURATED_BUCKET, app.LOCAL_S3_ROOT = raw_bucket, curated_bucket, local_root
+    app._s3_client = None  # a client inherited through fork is not safe to reuse
+
+
+def score_shard(raw_bucket, shard):
+    """Scores one shard in this process: [(key, etag, size, model version, rows or None if skipped, error)]."""
+    model = app.load_model()
+    results = []
+    for key, etag, size in shard:
+        try:
+            rows = app.process_object(model, raw_bucket, key, etag)
+            results.append((key, etag, size, app.model_version, rows, None))
+        except Exception as e:
+            # Like the Lambda, one bad file does not stop the others (it is retried on resume)
+            print(f"Error processing {key}: {e}")
+            results.append((key, etag, size, app.model_version, None, str(e)))
+    return results
+
+
+def backfill(raw_bucket, curated_bucket, classes=None, since=None, until=None, workers=None,
+             local_root=None, checkpoint_path=CHECKPOINT_FILE):
+    init_worker(raw_bucket, curated_bucket, local_root)
+    s3_client = app.get_s3_client()
+    # Loaded once here, so the workers find it in MODEL_CACHE_DIR (or inherit it when forked)
+    app.load_model()
+    model_version = app.model_version
+    done = load_checkpoint(checkpoint_path, model_version)
+
+    objects = list_raw_objects(s3_client, raw_bucket, classes, since, until)
+    pending = [(key, etag, size) for key, etag, size in objects if done.get(key) != (etag, size)]
+    shards = shard_by_well(pending)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(shards) or 1))
+    print(f"Backfill of s3://{raw_bucket}/ with model version {model_version}: {len(objects)} object(s), "
+          f"{len(objects) - len(pending)} done in an earlier run, {len(shards)} shard(s) on {workers} worker(s).")
+
+    totals = {'files': 0, 'skipped': 0, 'failed': 0, 'rows': 0}
+    start = time.perf_counter()
+    checkpoint = open(checkpoint_path, 'a') if checkpoint_path else None
+
+    def record(results):
+        for key, etag, size, version, rows, error in results:
+            if error is not None:
+                totals['failed'] += 1
+                continue
+            totals['files' if rows is not None else 'skipped'] += 1
+            totals['rows'] += rows or 0
+            if checkpoint is not None:
+                checkpoint.write(json.dumps({'key': key, 'etag': etag, 'size': size, 'model_version': version,
+                                             'rows': rows or 0}) + '\n')
+        if checkpoint is not None:
+            checkpoint.flush()
+        elapsed = time.perf_counter() - start
+        print(f"  {totals['files'] + totals['skipped'] + totals['failed']}/{len(pending)} objects, "
+              f"{totals['rows'] / elapsed:,.0f} rows/s, {totals['files'] / elapsed:.2f} files/s")
+
+    try:
+        if workers == 1:
+            for shard in shards:
+                record(score_shard(raw_bucket, shard))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(raw_bucket, curated_bucket, local_root)) as pool:
+                for future in as_completed([pool.submit(score_shard, raw_bucket, shard) for shard in shards]):
+                    record(future.result())
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    elapsed = time.perf_counter() - start
+    return dict(totals, model_version=model_version, seconds=round(elapsed, 2),
+                rows_per_second=round(totals['rows'] / elapsed, 1) if elapsed else 0.0,
+                files_per_second=round(totals['files'] / elapsed, 3) if elapsed else 0.0)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Re-score the raw bucket with the current model.")
+    parser.add_argument('raw_bucket')
+    parser.add_argument('--curated-bucket', default=app.CURATED_BUCKET, required=app.CURATED_BUCKET is None)
+    parser.add_argument('--class', dest='classes', action='append', help="Only this class directory (repeatable)")
+    parser.add_argument('--since', help="Only files starting on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--until', help="Only files starting on or before this date (YYYY-MM-DD)")
+    parser.add_argument('--workers', type=int, help="Processes (default: one per CPU)")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, help="Progress file for resuming")
+    parser.add_argument('--local-root', default=app.LOCAL_S3_ROOT,
+                        help="Directory holding the buckets as subdirectories, instead of S3")
+    args = parser.parse_args()
+    summary = backfill(args.raw_bucket, args.curated_bucket, args.classes, args.since, args.until, args.workers,
+                       args.local_root, args.checkpoint)
+    print(json.dumps(summary))
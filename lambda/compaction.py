@@ -0,0 +1,283 @@
+"""
+Background compaction of the partitioned curated layout (see layout.py).
+
+Every raw file becomes one small parquet object per partition (well, day, class). This job
+merges the small objects of a partition into part-<id>.parquet files of up to TARGET_FILE_BYTES,
+sorted by timestamp, in row groups of ROW_GROUP_ROWS with column statistics and the curated
+encoding (curated_format.py), so Athena and wr.s3.read_parquet open few objects and can skip
+row groups by time. Merged rows keep the curated key they came from in a source_file column.
+
+S3 has no rename, so every swap goes through STAGING_PREFIX, which no reader of data/ covers,
+and is recorded in a per-partition journal, _compaction.json:
+
+  1. the journal entry {merged key: inputs, sources, state 'pending'} is written
+  2. the merged object is uploaded to STAGING_PREFIX + merged key
+  3. the inputs are deleted
+  4. the staged object is copied to the merged key, deleted, and the entry is marked 'done'
+
+A plain prefix listing of data/ (Athena, wr.s3.read_parquet) therefore never sees an input and
+the merged object together; for the seconds between steps 3 and 4 the rows are missing instead.
+A job that dies after step 2 is finished by the next run, one that dies before it is dropped.
+
+A raw file that is scored again after its rows were merged must not reappear next to the merged
+object either: the inference Lambda writes it to STAGING_PREFIX + its key (see output_key), and
+the next run rebuilds every object holding its old rows with the new ones, in the same four steps.
+
+Usage (--local-root runs against a local directory instead of S3, see s3io.client_for):
+    python lambda/compaction.py <curated bucket> [--local-root /data/lake]
+"""
+import datetime
+import json
+import os
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import listing_index
+from curated_format import DEFAULT_ENCODING
+from layout import CURATED_PREFIX
+from rollup import read_parquet_object
+from s3io import S3MultipartWriter, client_for, is_missing, open_object
+
+TARGET_FILE_BYTES = int(os.environ.get('COMPACTION_TARGET_BYTES', 128 * 1024 * 1024))
+# Objects below this size are merged; larger ones are left alone.
+SMALL_FILE_BYTES = TARGET_FILE_BYTES // 4
+ROW_GROUP_ROWS = 128 * 1024
+# Objects younger than this may still be rewritten by the inference Lambda.
+MIN_AGE_SECONDS = int(os.environ.get('COMPACTION_MIN_AGE_SECONDS', 15 * 60))
+JOURNAL_NAME = '_compaction.json'
+MERGED_PREFIX = 'part-'
+# Merged objects before they are published, and sources scored again after they were merged
+STAGING_PREFIX = '_compaction/'
+
+
+def list_partitions(s3_client, bucket, prefix=CURATED_PREFIX):
+    """{partition prefix: {key: listing entry}} for every Hive-style partition under prefix."""
+    partitions = {}
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            directory, _, name = obj['Key'].rpartition('/')
+            if 'well=' in directory:
+                partitions.setdefault(directory + '/', {})[obj['Key']] = obj
+        if not response.get('IsTruncated'):
+            return partitions
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def load_journal(s3_client, bucket, partition, objects=None):
+    """The partition's journal; objects (the partition listing) saves the request if it has none."""
+    key = partition + JOURNAL_NAME
+    if objects is not None and key not in objects:
+        return {}
+    try:
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except Exception as e:
+        if is_missing(e):
+            return {}
+        raise
+
+
+def save_journal(s3_client, bucket, partition, journal):
+    s3_client.put_object(Bucket=bucket, Key=partition + JOURNAL_NAME, Body=json.dumps(journal, indent=1).encode('utf-8'),
+                         ContentType='application/json')
+
+
+def output_key(s3_client, bucket, key):
+    """
+    Where the inference Lambda writes the partitioned curated key: key itself, or STAGING_PREFIX +
+    key if its rows were merged (or are being merged) into a part file, so they are not read twice.
+    """
+    partition = key.rpartition('/')[0] + '/'
+    if any(key in entry['sources'] for entry in load_journal(s3_client, bucket, partition).values()):
+        return STAGING_PREFIX + key
+    return key
+
+
+def live_files(s3_client, bucket, prefix=CURATED_PREFIX):
+    """The parquet keys a reader should open under prefix."""
+    return [key for objects in list_partitions(s3_client, bucket, prefix).values()
+            for key in sorted(objects) if key.endswith('.parquet')]
+
+
+def read_input(s3_client, bucket, key, drop_sources, source_file=None):
+    """One input as a table with the source_file column, minus the rows of drop_sources."""
+    table = read_parquet_object(s3_client, bucket, key)
+    if 'source_file' not in table.column_names:
+        table = table.append_column('source_file', pa.array([source_file or key] * table.num_rows).dictionary_encode())
+    elif drop_sources:
+        table = table.filter(pc.invert(pc.is_in(table.column('source_file').cast(pa.string()), value_set=pa.array(sorted(drop_sources)))))
+    return table
+
+
+def write_merged(s3_client, bucket, key, tables):
+    # Inputs written before the curated encoding changed are re-encoded, so the types agree
+    encoding = DEFAULT_ENCODING
+    table = pa.concat_tables([encoding.encode(table) for table in tables], promote_options='default')
+    if 'timestamp' in table.column_names:
+        table = table.sort_by('timestamp')
+    options = encoding.writer_options(table.schema, sorted_by_timestamp='timestamp' in table.column_names)
+    with S3MultipartWriter(s3_client, bucket, key) as sink:
+        pq.write_table(table, sink, row_group_size=ROW_GROUP_ROWS, **options)
+    return table.num_rows, sink.bytes_written
+
+
+def staged_output(s3_client, bucket, merged_key):
+    """(rows, bytes) of a merged object staged by an earlier run."""
+    key = STAGING_PREFIX + merged_key
+    with open_object(s3_client, bucket, key) as source:
+        rows = pq.ParquetFile(source).metadata.num_rows
+    return rows, s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+
+def bin_pack(sizes, target):
+    """First-fit decreasing: groups of keys whose sizes add up to at most target."""
+    bins = []
+    for key in sorted(sizes, key=sizes.get, reverse=True):
+        for group in bins:
+            if group['bytes'] + sizes[key] <= target:
+                group['keys'].append(key)
+                group['bytes'] += sizes[key]
+                break
+        else:
+            bins.append({'keys': [key], 'bytes': sizes[key]})
+    return [group['keys'] for group in bins]
+
+
+def delete_inputs(s3_client, bucket, keys):
+    for key in keys:
+        s3_client.delete_object(Bucket=bucket, Key=key)
+
+
+def publish(s3_client, bucket, merged_key, inputs):
+    """Steps 3 and 4: deletes the inputs, then moves the staged merged object into place."""
+    delete_inputs(s3_client, bucket, inputs)
+    s3_client.copy_object(Bucket=bucket, Key=merged_key, CopySource={'Bucket': bucket, 'Key': STAGING_PREFIX + merged_key})
+    s3_client.delete_object(Bucket=bucket, Key=STAGING_PREFIX + merged_key)
+
+
+def merge(s3_client, bucket, partition, journal, inputs, sources, read):
+    """
+    Merges inputs (read(key) gives each one's rows) into a new part file.
+    Returns (merged key, rows, bytes, inputs).
+    """
+    merged_key = f"{partition}{MERGED_PREFIX}{uuid.uuid4().hex}.parquet"
+    journal[merged_key] = {'state': 'pending', 'inputs': sorted(inputs), 'sources': sorted(sources)}
+    save_journal(s3_client, bucket, partition, journal)
+    tables = [table for table in map(read, sorted(inputs)) if table is not None]
+    rows, size = write_merged(s3_client, bucket, STAGING_PREFIX + merged_key, tables)
+    publish(s3_client, bucket, merged_key, inputs)
+    for key in inputs:
+        journal.pop(key, None)
+    journal[merged_key]['state'] = 'done'
+    save_journal(s3_client, bucket, partition, journal)
+    print(f"Compacted {len(inputs)} objects ({rows:,} rows) into s3://{bucket}/{merged_key}")
+    return merged_key, rows, size, inputs
+
+
+def compact_partition(s3_client, bucket, partition, objects, staged, now):
+    """
+    Compacts one partition: objects is its listing, staged the listing of STAGING_PREFIX +
+    partition. Returns [(merged key, rows, bytes, input keys)] of the objects published.
+    """
+    journal = load_journal(s3_client, bucket, partition, objects)
+    written = []
+
+    # 1. Finish the swaps of a run that died after staging its merged object, drop the others
+    for merged_key, entry in list(journal.items()):
+        if entry['state'] == 'pending':
+            if merged_key in objects:
+                delete_inputs(s3_client, bucket, entry['inputs'] + [STAGING_PREFIX + merged_key])
+            elif STAGING_PREFIX + merged_key in staged:
+                rows, size = staged_output(s3_client, bucket, merged_key)
+                publish(s3_client, bucket, merged_key, entry['inputs'])
+                written.append((merged_key, rows, size, entry['inputs']))
+            else:
+                del journal[merged_key]
+                continue
+            for key in entry['inputs'] + [STAGING_PREFIX + merged_key]:
+                objects.pop(key, None)
+                staged.pop(key, None)
+                journal.pop(key, None)
+            entry['state'] = 'done'
+            save_journal(s3_client, bucket, partition, journal)
+        elif merged_key not in objects:
+            del journal[merged_key]  # merged again into a newer part
+
+    settled = lambda obj: (now - obj['LastModified']).total_seconds() >= MIN_AGE_SECONDS
+
+    # 2. Sources scored again after they were merged: rebuild the objects holding their old rows
+    rescored = {key[len(STAGING_PREFIX):]: key for key, obj in staged.items()
+                if key.endswith('.parquet') and not os.path.basename(key).startswith(MERGED_PREFIX) and settled(obj)}
+    if rescored:
+        rebuilt = [key for key, entry in journal.items() if key in objects and set(entry['sources']) & set(rescored)]
+        replaced = [key for key in rescored if key in objects]
+        sources = set(rescored).union(*(journal[key]['sources'] for key in rebuilt))
+        staged_sources = {staged_key: key for key, staged_key in rescored.items()}
+
+        def read(key):
+            if key in staged_sources:
+                return read_input(s3_client, bucket, key, (), source_file=staged_sources[key])
+            if key in rebuilt:
+                return read_input(s3_client, bucket, key, set(rescored))
+            return None  # an unmerged object that was scored again: the staged copy replaces it
+
+        written.append(merge(s3_client, bucket, partition, journal, rebuilt + replaced + list(staged_sources), sources, read))
+        for key in rebuilt + replaced:
+            objects.pop(key)
+
+    # 3. Bin-pack the small, settled objects into target-size files
+    sizes = {key: obj['Size'] for key, obj in objects.items()
+             if key.endswith('.parquet') and settled(obj) and obj['Size'] < SMALL_FILE_BYTES}
+    for group in bin_pack(sizes, TARGET_FILE_BYTES):
+        if len(group) < 2:
+            continue
+        sources = set()
+        for key in group:
+            sources.update(journal[key]['sources'] if key in journal else [key])
+        written.append(merge(s3_client, bucket, partition, journal, group, sources,
+                             lambda key: read_input(s3_client, bucket, key, ())))
+    return written
+
+
+def compact(s3_client, bucket, prefix=CURATED_PREFIX):
+    """Compacts every partition under prefix. Returns a summary dict."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    partitions = list_partitions(s3_client, bucket, prefix)
+    staged = list_partitions(s3_client, bucket, STAGING_PREFIX + prefix)
+    names = sorted(set(partitions) | {partition[len(STAGING_PREFIX):] for partition in staged})
+    merged = [output for partition in names
+              for output in compact_partition(s3_client, bucket, partition, partitions.get(partition, {}),
+                                              staged.get(STAGING_PREFIX + partition, {}), now)]
+    if merged:
+        # Swap the inputs for the merged objects in the listing index (one scan per run)
+        for merged_key, rows, size, _ in merged:
+            listing_index.append(s3_client, bucket, merged_key, rows, size)
+        inputs = [key for _, _, _, group in merged for key in group]
+        listing_index.remove(s3_client, bucket, listing_index.entries_for(s3_client, bucket, inputs))
+    return {'partitions': len(names), 'merged_files': len(merged)}
+
+
+def lambda_handler(event, context):
+    """Scheduled entry point: compacts the curated bucket's partitions."""
+    import boto3
+    summary = compact(boto3.client('s3'), os.environ['CURATED_BUCKET_NAME'])
+    print("Curated compaction: " + json.dumps(summary))
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Merge small curated parquet files into target-size files.")
+    parser.add_argument('bucket')
+    parser.add_argument('--prefix', default=CURATED_PREFIX)
+    parser.add_argument('--min-age', type=int, default=MIN_AGE_SECONDS, help="Only merge objects older than this (seconds)")
+    parser.add_argument('--local-root', help="Directory holding the bucket as a subdirectory, instead of S3")
+    args = parser.parse_args()
+    MIN_AGE_SECONDS = args.min_age
+    client = client_for(args.local_root)
+    print(json.dumps(compact(client, args.bucket, args.prefix)))
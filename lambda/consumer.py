@@ -0,0 +1,392 @@
+"""
+Long-running streaming consumer: the alternative to one Lambda invocation per raw file.
+
+Sensor readings arrive as JSON records on a stream, one reading per record:
+
+    {"well": "WELL-00014", "timestamp": "2017-02-01T01:02:07", "P-PDG": 0.0, "P-TPT": 1.1e7, ...}
+
+(timestamp may also be epoch seconds; "sent_at", epoch seconds, is used for latency metrics).
+Records are micro-batched until MAX_BATCH_RECORDS are buffered or the oldest buffered record
+is MAX_LATENCY_MS old, then scored per well with the same model, feature and rolling-window
+code as the Lambda (app.score_table; each well's rolling state lives as long as the consumer).
+Scored rows are buffered per well and written as row groups of ROW_GROUP_ROWS into one open
+curated file per well, under the partitioned layout (layout.py) with class=stream. Every
+FILE_SECONDS all open files are completed together, their KPI aggregates, overviews, anomaly
+events and listing index entries are written like the Lambda's, and only then is the stream position checkpointed,
+so a restart re-reads at most the records of files that were not completed.
+
+Streams (all return batches of Record and support checkpoint()):
+  InProcessStream  a queue fed by the same process, for tests and benchmarks
+  FileTailStream   follows a JSON-lines file like `tail -f`; the byte offset is the checkpoint
+  KinesisStream    one Kinesis shard; the sequence number is the checkpoint
+
+Usage (same image and environment variables as the Lambda, different command):
+    python consumer.py kinesis:<stream name>[/<shard id>]
+    python consumer.py file:/data/readings.jsonl --checkpoint /data/readings.offset
+"""
+import collections
+import json
+import os
+import queue
+import time
+
+import app
+import metrics
+from startup import lazy_import
+
+# Micro-batching: a batch is scored when it holds this many records or its oldest record has
+# waited MAX_LATENCY_MS, whichever comes first.
+MAX_BATCH_RECORDS = int(os.environ.get('MAX_BATCH_RECORDS', '5000'))
+MAX_LATENCY_MS = float(os.environ.get('MAX_LATENCY_MS', '1000'))
+# Curated output: row groups of this many rows, files completed every FILE_SECONDS.
+ROW_GROUP_ROWS = int(os.environ.get('ROW_GROUP_ROWS', str(64 * 1024)))
+FILE_SECONDS = float(os.environ.get('FILE_SECONDS', '300'))
+STREAM_LABEL = 'stream'
+
+Record = collections.namedtuple('Record', ['data', 'arrived_at'])
+
+
+class InProcessStream:
+    """A thread-safe queue standing in for a stream; put() takes a reading dict or its JSON."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def put(self, data):
+        self.queue.put(Record(data, time.time()))
+
+    def read(self, max_records, timeout):
+        records = []
+        try:
+            records.append(self.queue.get(timeout=timeout))
+            while len(records) < max_records:
+                records.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return records
+
+    def checkpoint(self):
+        pass
+
+
+class FileTailStream:
+    """Follows a JSON-lines file, one record per complete line."""
+
+    def __init__(self, path, checkpoint_path=None, poll_seconds=0.05):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.poll_seconds = poll_seconds
+        self.offset = 0
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self.offset = int(f.read().strip() or 0)
+        self.read_offset = self.offset
+        self.file = None
+
+    def read(self, max_records, timeout):
+        deadline = time.monotonic() + timeout
+        records = []
+        while True:
+            if self.file is None and os.path.exists(self.path):
+                self.file = open(self.path, 'rb')
+                self.file.seek(self.read_offset)
+            while self.file is not None and len(records) < max_records:
+                position = self.file.tell()
+                line = self.file.readline()
+                if not line.endswith(b'\n'):
+                    self.file.seek(position)  # a partially written line is read again later
+                    break
+                self.read_offset = self.file.tell()
+                if line.strip():
+                    records.append(Record(line, time.time()))
+            if records or time.monotonic() >= deadline:
+                return records
+            time.sleep(min(self.poll_seconds, max(deadline - time.monotonic(), 0)))
+
+    def checkpoint(self):
+        self.offset = self.read_offset
+        if self.checkpoint_path:
+            with open(self.checkpoint_path + '.partial', 'w') as f:
+                f.write(str(self.offset))
+            os.replace(self.checkpoint_path + '.partial', self.checkpoint_path)
+
+
+class KinesisStream:
+    """One shard of a Kinesis data stream."""
+
+    def __init__(self, stream_name, shard_id=None, checkpoint_path=None, kinesis_client=None):
+        self.client = kinesis_client or lazy_import('boto3').client('kinesis')
+        self.stream_name = stream_name
+        self.shard_id = shard_id or self.client.list_shards(StreamName=stream_name)['Shards'][0]['ShardId']
+        self.checkpoint_path = checkpoint_path
+        self.sequence_number = None
+        self.read_sequence_number = None
+        kwargs = {'StreamName': stream_name, 'ShardId': self.shard_id, 'ShardIteratorType': 'LATEST'}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self.sequence_number = f.read().strip() or None
+        if self.sequence_number:
+            kwargs.update(ShardIteratorType='AFTER_SEQUENCE_NUMBER', StartingSequenceNumber=self.sequence_number)
+        self.iterator = self.client.get_shard_iterator(**kwargs)['ShardIterator']
+
+    def read(self, max_records, timeout):
+        # GetRecords is limited to 5 calls per second and shard
+        response = self.client.get_records(ShardIterator=self.iterator, Limit=min(max_records, 10000))
+        self.iterator = response['NextShardIterator']
+        records = [Record(record['Data'], time.time()) for record in response['Records']]
+        if response['Records']:
+            self.read_sequence_number = response['Records'][-1]['SequenceNumber']
+        else:
+            time.sleep(min(timeout, 0.2))
+        return records
+
+    def checkpoint(self):
+        if self.read_sequence_number is None:
+            return
+        self.sequence_number = self.read_sequence_number
+        if self.checkpoint_path:
+            with open(self.checkpoint_path + '.partial', 'w') as f:
+                f.write(self.sequence_number)
+            os.replace(self.checkpoint_path + '.partial', self.checkpoint_path)
+
+
+def open_stream(source, checkpoint_path=None):
+    """'kinesis:<stream>[/<shard>]' or 'file:<path>'."""
+    kind, _, target = source.partition(':')
+    if kind == 'kinesis':
+        stream_name, _, shard_id = target.partition('/')
+        return KinesisStream(stream_name, shard_id or None, checkpoint_path)
+    if kind == 'file':
+        return FileTailStream(target, checkpoint_path)
+    raise ValueError(f"Unknown stream source: {source}")
+
+
+def decode_batch(records, sensors):
+    """
+    Groups a batch of JSON records by well: {well: (columns, timestamps, sent_at)} with float64
+    sensor columns, datetime64[ns] timestamps (sorted) and send times for latency metrics.
+    """
+    np = lazy_import('numpy')
+    by_well = collections.defaultdict(list)
+    for record in records:
+        reading = record.data if isinstance(record.data, dict) else json.loads(record.data)
+        by_well[str(reading.get('well', STREAM_LABEL))].append((reading, record.arrived_at))
+    batches = {}
+    for well, readings in by_well.items():
+        raw_times = [reading.get('timestamp') for reading, _ in readings]
+        if isinstance(raw_times[0], (int, float)):
+            timestamps = (np.array(raw_times, dtype=np.float64) * 1e9).astype('datetime64[ns]')
+        else:
+            timestamps = np.array(raw_times, dtype='datetime64[ns]')
+        order = np.argsort(timestamps, kind='stable')
+        columns = {name: np.array([reading.get(name, np.nan) for reading, _ in readings], dtype=np.float64)[order]
+                   for name in sensors}
+        sent_at = np.array([reading.get('sent_at', arrived_at) for reading, arrived_at in readings], dtype=np.float64)[order]
+        batches[well] = (columns, timestamps[order], sent_at)
+    return batches
+
+
+class CuratedFile:
+    """
+    One open curated object of one well and day, filled with row groups of ROW_GROUP_ROWS.
+
+    The object is named like a raw file, <well>_<first timestamp>.parquet, and its aggregates,
+    overview and events are keyed by the raw-style key data/stream/<name> (the dashboard maps the
+    partitioned key back to it). A replay after a restart recreates the same keys.
+    """
+
+    def __init__(self, s3_client, bucket, well, first_timestamp, sensors):
+        layout = lazy_import('layout')
+        self.day = str(first_timestamp.astype('datetime64[D]'))
+        stamp = str(first_timestamp.astype('datetime64[s]'))
+        name = f"{well}_{stamp.replace('-', '').replace(':', '').replace('T', '')}.parquet"
+        self.key = layout.partition_prefix(well, self.day, STREAM_LABEL) + name
+        self.source_key = f"{layout.CURATED_PREFIX}{STREAM_LABEL}/{name}"
+        self.sink = layout.ParquetFileSink(app.S3MultipartWriter(s3_client, bucket, self.key), self.key,
+                                           lazy_import('curated_format').DEFAULT_ENCODING)
+        self.aggregator = lazy_import('rollup').FileAggregator(self.source_key, sensors)
+        self.overview = lazy_import('overviews').OverviewBuilder(sensors)
+        self.events = lazy_import('events').EventBuilder(self.source_key, sensors)
+        self.pending = []
+        self.pending_rows = 0
+
+    def add(self, table):
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        if self.pending_rows >= ROW_GROUP_ROWS:
+            self.flush_row_group()
+
+    def flush_row_group(self):
+        if not self.pending:
+            return
+        table = lazy_import('pyarrow').concat_tables(self.pending)
+        self.sink.write_table(table)  # one row group: the writer's default row group size is larger
+        self.aggregator.add(table)
+        self.overview.add(table)
+        self.events.add(table)
+        self.pending, self.pending_rows = [], 0
+
+
+class StreamConsumer:
+    """Micro-batches records from a stream, scores them and writes curated parquet."""
+
+    def __init__(self, stream, model=None, s3_client=None, bucket=None, max_batch_records=MAX_BATCH_RECORDS,
+                 max_latency_ms=MAX_LATENCY_MS, file_seconds=FILE_SECONDS, on_scored=None):
+        self.stream = stream
+        self.fixed_model = model
+        self.s3_client = s3_client or app.get_s3_client()
+        self.bucket = bucket or app.CURATED_BUCKET
+        self.max_batch_records = max_batch_records
+        self.max_latency = max_latency_ms / 1000
+        self.file_seconds = file_seconds
+        # Called with (scored table, send times of its rows, scoring end time), e.g. for metrics
+        self.on_scored = on_scored
+        self.states = {}
+        self.files = {}
+        self.files_opened_at = None
+        self.stats = collections.Counter()
+
+    def model(self):
+        return self.fixed_model if self.fixed_model is not None else app.load_model()
+
+    def state(self, model, well):
+        names = app.model_features(model)
+        state = self.states.get(well)
+        if state is None or state.names != names:
+            state = self.states[well] = lazy_import('rolling').RollingFeatures(names)
+        return state
+
+    def next_batch(self):
+        """Reads until the batch is full or its oldest record has waited max_latency."""
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch_records:
+            timeout = self.max_latency if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            records = self.stream.read(self.max_batch_records - len(batch), timeout)
+            if records and deadline is None:
+                deadline = time.monotonic() + self.max_latency - (time.time() - records[0].arrived_at)
+            batch.extend(records)
+            if not records and deadline is None:
+                break  # idle stream: give the caller a chance to complete files
+        return batch
+
+    def score_batch(self, records):
+        with metrics.trace('batch', model_version=app.model_version):
+            self.score_records(records)
+
+    def score_records(self, records):
+        pa = lazy_import('pyarrow')
+        pc = lazy_import('pyarrow.compute')
+        model = self.model()
+        names = app.model_features(model)
+        bases = lazy_import('rolling').base_features(names)
+        with metrics.span('decode'):
+            batches = decode_batch(records, bases)
+        for well, (columns, timestamps, sent_at) in batches.items():
+            state = self.state(model, well)
+            if state.position and not app.continues(state, timestamps):
+                state.reset()
+            table = pa.table(dict(columns, timestamp=pa.array(timestamps)))
+            scored = app.score_table(model, table, state)
+            self.stats['records'] += table.num_rows
+            if scored is None:
+                continue
+            self.stats['scored'] += scored.num_rows
+            self.stats['anomalies'] += int(pc.sum(scored.column('anomaly_flag')).as_py() or 0)
+            if self.on_scored is not None:
+                kept = pc.is_in(table.column('timestamp'), value_set=scored.column('timestamp')).to_numpy(zero_copy_only=False)
+                self.on_scored(scored, sent_at[kept], time.time())
+            self.write_scored(well, scored, bases)
+
+    def write_scored(self, well, scored, sensors):
+        """Appends a well's scored rows to its open file, one file per day (partition)."""
+        np = lazy_import('numpy')
+        days = scored.column('timestamp').to_numpy().astype('datetime64[D]')
+        for day in np.unique(days):
+            rows = scored if days[0] == days[-1] else scored.filter(days == day)
+            current = self.files.get(well)
+            if current is not None and current.day != str(day):
+                self.complete_file(self.files.pop(well))
+                current = None
+            if current is None:
+                first_timestamp = rows.column('timestamp').to_numpy()[0]
+                current = self.files[well] = CuratedFile(self.s3_client, self.bucket, well, first_timestamp, sensors)
+                if self.files_opened_at is None:
+                    self.files_opened_at = time.monotonic()
+            current.add(rows)
+
+    def complete_file(self, curated):
+        """Completes one curated object and writes its aggregates, overview, events and index entry."""
+        curated.flush_row_group()
+        with curated.sink as sink:
+            pass  # __exit__ completes the upload, or aborts it if nothing was written
+        if sink.rows == 0:
+            return
+        rollup, overviews, listing_index = lazy_import('rollup'), lazy_import('overviews'), lazy_import('listing_index')
+        self.s3_client.put_object(Bucket=self.bucket, Key=rollup.aggregate_key(curated.source_key),
+                                  Body=rollup.to_parquet_bytes(curated.aggregator.to_table()))
+        overview = curated.overview.to_table()
+        if overview is not None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=overviews.overview_key(curated.source_key),
+                                      Body=overviews.to_parquet_bytes(overview))
+        self.s3_client.put_object(Bucket=self.bucket, Key=lazy_import('events').event_key(curated.source_key),
+                                  Body=rollup.to_parquet_bytes(curated.events.to_table()))
+        for key, rows, size in sink.outputs():
+            listing_index.append(self.s3_client, self.bucket, key, rows, size)
+        self.stats['files'] += 1
+
+    def complete_files(self):
+        """Completes every open file, then checkpoints the stream: all read records are durable."""
+        for curated in self.files.values():
+            self.complete_file(curated)
+        self.files = {}
+        self.files_opened_at = None
+        self.stream.checkpoint()
+
+    def abort_files(self):
+        """Drops every open file; its records are read again after a restart (no checkpoint)."""
+        for curated in self.files.values():
+            curated.sink.abort()
+        self.files = {}
+        self.files_opened_at = None
+
+    def run(self, stop=None):
+        """Consumes until stop() returns True (forever by default), then completes open files."""
+        try:
+            while not (stop and stop()):
+                batch = self.next_batch()
+                if batch:
+                    self.score_batch(batch)
+                    self.stats['batches'] += 1
+                if self.files_opened_at is not None and time.monotonic() - self.files_opened_at >= self.file_seconds:
+                    self.complete_files()
+        except BaseException:
+            self.abort_files()
+            raise
+        self.complete_files()
+        return self.stats
+
+
+if __name__ == '__main__':
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(description="Score a stream of sensor readings into the curated bucket.")
+    parser.add_argument('source', help="kinesis:<stream>[/<shard>] or file:<path to JSON lines>")
+    parser.add_argument('--checkpoint', help="File that keeps the stream position between restarts")
+    parser.add_argument('--max-batch-records', type=int, default=MAX_BATCH_RECORDS)
+    parser.add_argument('--max-latency-ms', type=float, default=MAX_LATENCY_MS)
+    parser.add_argument('--file-seconds', type=float, default=FILE_SECONDS)
+    args = parser.parse_args()
+    consumer = StreamConsumer(open_stream(args.source, args.checkpoint), max_batch_records=args.max_batch_records,
+                              max_latency_ms=args.max_latency_ms, file_seconds=args.file_seconds)
+    print(f"Consuming {args.source} into s3://{consumer.bucket}/ (batches of {args.max_batch_records} records "
+          f"or {args.max_latency_ms:.0f} ms, files every {args.file_seconds:.0f} s)")
+    # SIGTERM (ECS stopping the task) or Ctrl-C: finish the current batch, complete the files
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.append(True))
+    consumer.run(stop=lambda: bool(stopping))
+    print(f"Stopped: {dict(consumer.stats)}")
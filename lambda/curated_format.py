@@ -0,0 +1,148 @@
+"""
+Encoding of the curated parquet objects (layout.py decides where they go).
+
+The scorer hands the sinks Arrow tables with float64 sensors, an int64 anomaly_flag, a float32
+anomaly_score and the timestamp index. CuratedEncoding projects and narrows every table before
+it is written, and chooses the parquet writer options:
+
+  CURATED_COLUMNS             columns to keep besides timestamp and anomaly_flag (comma
+                              separated), or 'all' (default)
+  CURATED_FLAG_TYPE           int64 (default, the original schema), uint8, or bool (bit-packed)
+  CURATED_SENSOR_TYPE         float64 (default) or float32 (half the bytes, ~7 significant digits)
+  CURATED_COMPRESSION         zstd (default), lz4, gzip, brotli, snappy or none
+  CURATED_COMPRESSION_LEVEL   codec level, e.g. 1-22 for zstd (default 3; ignored by snappy)
+  CURATED_TIMESTAMP_ENCODING  delta (DELTA_BINARY_PACKED, default), dictionary or plain
+  CURATED_BYTE_STREAM_SPLIT   1 (default): BYTE_STREAM_SPLIT encoding for the float columns, which
+                              groups the slowly changing sign/exponent bytes so the codec finds them
+  CURATED_SORTED              1 (default): every row group is sorted by timestamp and declared so
+                              (sorting_columns), next to its min/max statistics and page index,
+                              so engines skip the row groups and pages outside a time range
+  CURATED_BLOOM_FILTER        columns with a bloom filter for point lookups (default: none;
+                              skipped with a warning where pyarrow cannot write them)
+
+The flags, scores and every aggregate, overview and event are computed before encoding, so they
+keep full precision whatever is written. The column names do not change, and anomaly_flag sums
+and comparisons with 0 work for every flag type.
+
+The defaults keep the schema sensor_stream has always had. A narrower flag or sensor type changes
+it, and Athena fails on a table whose files disagree on a column type, so the switch is a
+migration: set the variables on the inference and compaction Lambdas together
+(infrastructure/modules/compute/main.tf), delete the _processed/ markers of the curated bucket,
+re-score the raw bucket with lambda/backfill.py (fresh --checkpoint) so no object keeps the old
+types, and change the columns of sensor_stream to match.
+
+Usage:
+    encoding = CuratedEncoding.from_env()
+    sink = layout.ParquetFileSink(file, key, encoding=encoding)
+"""
+import inspect
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Always written, whatever CURATED_COLUMNS says (source_file is the provenance column of compaction.py)
+REQUIRED_COLUMNS = ('timestamp', 'anomaly_flag', 'source_file')
+FLAG_TYPES = {'int64': pa.int64(), 'uint8': pa.uint8(), 'bool': pa.bool_()}
+SENSOR_TYPES = {'float64': pa.float64(), 'float32': pa.float32()}
+TIMESTAMP_ENCODINGS = ('delta', 'dictionary', 'plain')
+BLOOM_FILTER_FPP = 0.05
+# Bloom filter writing arrived in later pyarrow releases than the other options used here
+BLOOM_FILTERS_SUPPORTED = 'bloom_filter_options' in inspect.signature(pq.ParquetWriter.__init__).parameters
+
+
+def env_list(name, default=''):
+    value = os.environ.get(name, default).strip()
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class CuratedEncoding:
+    """Projection, column types, row order and parquet writer options of the curated objects."""
+
+    def __init__(self, columns=None, flag_type='int64', sensor_type='float64', compression='zstd',
+                 compression_level=3, timestamp_encoding='delta', byte_stream_split=True,
+                 sorted_row_groups=True, bloom_filter_columns=()):
+        if flag_type not in FLAG_TYPES:
+            raise ValueError(f"Unknown flag type {flag_type!r}, expected one of {sorted(FLAG_TYPES)}.")
+        if sensor_type not in SENSOR_TYPES:
+            raise ValueError(f"Unknown sensor type {sensor_type!r}, expected one of {sorted(SENSOR_TYPES)}.")
+        if timestamp_encoding not in TIMESTAMP_ENCODINGS:
+            raise ValueError(f"Unknown timestamp encoding {timestamp_encoding!r}, expected one of {TIMESTAMP_ENCODINGS}.")
+        self.columns = None if columns is None else set(columns) | set(REQUIRED_COLUMNS)
+        self.flag_type = FLAG_TYPES[flag_type]
+        self.sensor_type = SENSOR_TYPES[sensor_type]
+        self.compression = compression or 'none'
+        self.compression_level = None if self.compression in ('snappy', 'none') else compression_level
+        self.timestamp_encoding = timestamp_encoding
+        self.byte_stream_split = byte_stream_split
+        self.sorted_row_groups = sorted_row_groups
+        self.bloom_filter_columns = list(bloom_filter_columns)
+        if self.bloom_filter_columns and not BLOOM_FILTERS_SUPPORTED:
+            print(f"Bloom filters need a newer pyarrow than {pa.__version__}; writing {self.bloom_filter_columns} without them.")
+            self.bloom_filter_columns = []
+
+    @classmethod
+    def from_env(cls):
+        columns = env_list('CURATED_COLUMNS', 'all')
+        level = os.environ.get('CURATED_COMPRESSION_LEVEL', '3')
+        return cls(columns=None if columns == ['all'] else columns,
+                   flag_type=os.environ.get('CURATED_FLAG_TYPE', 'int64'),
+                   sensor_type=os.environ.get('CURATED_SENSOR_TYPE', 'float64'),
+                   compression=os.environ.get('CURATED_COMPRESSION', 'zstd'),
+                   compression_level=int(level) if level else None,
+                   timestamp_encoding=os.environ.get('CURATED_TIMESTAMP_ENCODING', 'delta'),
+                   byte_stream_split=os.environ.get('CURATED_BYTE_STREAM_SPLIT', '1') == '1',
+                   sorted_row_groups=os.environ.get('CURATED_SORTED', '1') == '1',
+                   bloom_filter_columns=env_list('CURATED_BLOOM_FILTER'))
+
+    def encode(self, table):
+        """The table as it is written: projected, narrowed and (if configured) sorted by timestamp."""
+        if self.columns is not None:
+            table = table.select([name for name in table.column_names if name in self.columns])
+        fields = []
+        for field in table.schema:
+            if field.name == 'anomaly_flag':
+                field = field.with_type(self.flag_type)
+            elif pa.types.is_floating(field.type) and field.name != 'anomaly_score':
+                field = field.with_type(self.sensor_type)
+            fields.append(field)
+        schema = pa.schema(fields, metadata=table.schema.metadata)
+        if schema != table.schema:
+            table = table.cast(schema)
+        if self.sorted_row_groups and 'timestamp' in table.column_names and table.num_rows > 1:
+            timestamps = table.column('timestamp').to_numpy().view(np.int64)
+            if (np.diff(timestamps) < 0).any():  # 3W files are already in time order
+                table = table.take(pc.sort_indices(table.column('timestamp')))
+        return table
+
+    def writer_options(self, schema, sorted_by_timestamp=None):
+        """pq.ParquetWriter keyword arguments for tables of this schema."""
+        names = schema.names
+        encodings = {}
+        if 'timestamp' in names and self.timestamp_encoding == 'delta':
+            encodings['timestamp'] = 'DELTA_BINARY_PACKED'
+        if self.byte_stream_split:
+            encodings.update({field.name: 'BYTE_STREAM_SPLIT' for field in schema if pa.types.is_floating(field.type)})
+        # An explicit encoding replaces the dictionary, so only the other columns get one
+        dictionary = [name for name in names if name not in encodings
+                      and not (name == 'timestamp' and self.timestamp_encoding == 'plain')]
+        options = {'compression': self.compression, 'use_dictionary': dictionary,
+                   'write_statistics': True, 'write_page_index': True}
+        if self.compression_level is not None:
+            options['compression_level'] = self.compression_level
+        if encodings:
+            options['column_encoding'] = encodings
+        if sorted_by_timestamp is None:
+            sorted_by_timestamp = self.sorted_row_groups
+        if sorted_by_timestamp and 'timestamp' in names:
+            options['sorting_columns'] = [pq.SortingColumn(names.index('timestamp'))]
+        bloom = [name for name in self.bloom_filter_columns if name in names]
+        if bloom:
+            options['bloom_filter_options'] = {name: {'fpp': BLOOM_FILTER_FPP} for name in bloom}
+        return options
+
+
+# The encoding of the process, from the environment
+DEFAULT_ENCODING = CuratedEncoding.from_env()
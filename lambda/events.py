@@ -0,0 +1,145 @@
+"""
+Anomaly event index: the curated anomaly flags collapsed into one record per contiguous run.
+
+For every raw file the inference Lambda also writes events/<same key>: one row per anomaly event
+of the file, i.e. a run of flagged samples where no two consecutive flagged samples are more than
+EVENT_GAP_SECONDS apart (a few normal samples inside a fault do not split it). Every event has
+its start and end timestamp, duration, the number of samples it spans and how many of them are
+flagged (density), the mean and max anomaly_score of its flagged samples when the model provides
+one, and the min/max of every sensor over its flagged samples (the peak values of the event).
+
+Runs are found per scored row group and the last run stays open, so an event that crosses a row
+group boundary is still one record. The scheduled rollup job folds the per-file objects into
+rollup/events.parquet (see rollup.fold_objects), sorted by (well, start): "which events overlap
+this time range, on this well" then reads a few kilobytes instead of the flagged rows.
+
+Usage (--local-root runs against a local directory instead of S3, see s3io.client_for):
+    python lambda/events.py <curated bucket> [--local-root /data/lake]
+"""
+import os
+
+import numpy as np
+import pyarrow as pa
+
+from layout import well_of
+from rollup import fold_objects
+
+EVENTS_PREFIX = 'events/'
+EVENTS_KEY = 'rollup/events.parquet'
+EVENTS_MANIFEST_KEY = 'rollup/events-manifest.json'
+# Flagged samples at most this far apart belong to the same event
+EVENT_GAP_SECONDS = float(os.environ.get('EVENT_GAP_SECONDS', '60'))
+
+
+def event_key(source_key):
+    return f"{EVENTS_PREFIX}{source_key}"
+
+
+def fold_run(previous, run):
+    """Extends an open run (length-1 arrays) with the first run of the next row group, in place."""
+    for name, value in run.items():
+        before = previous[name][0]
+        if name in ('start', 'first_row'):
+            value[0] = before
+        elif name.endswith('_min'):
+            value[0] = np.fmin(before, value[0])
+        elif name.endswith('_max'):
+            value[0] = np.fmax(before, value[0])
+        elif name not in ('end', 'last_row'):
+            value[0] += before
+
+
+class EventBuilder:
+    """Collects the anomaly events of one curated file, one scored row group at a time."""
+
+    def __init__(self, source_key, sensors, max_gap_seconds=EVENT_GAP_SECONDS):
+        self.source_key = source_key
+        self.sensors = list(sensors)
+        self.max_gap = int(max_gap_seconds * 1e9)  # nanoseconds
+        self.position = 0  # rows added so far, so events know how many samples they span
+        self.closed = []
+        self.open = None  # the last run, which the next row group can extend
+
+    def add(self, table):
+        """Adds a scored table; tables without a timestamp index have no time axis for events."""
+        offset = self.position
+        self.position += table.num_rows
+        if table.num_rows == 0 or 'timestamp' not in table.column_names:
+            return
+        flagged = np.flatnonzero(table.column('anomaly_flag').to_numpy() != 0)
+        if len(flagged) == 0:
+            return
+        times = table.column('timestamp').to_numpy().astype('datetime64[ns]').view(np.int64)[flagged]
+        # A run starts at every flagged sample further than max_gap from the previous one
+        starts = np.flatnonzero(np.diff(times, prepend=times[0] - self.max_gap - 1) > self.max_gap)
+        ends = np.append(starts[1:], len(flagged)) - 1
+        runs = {
+            'start': times[starts], 'end': times[ends],
+            'first_row': offset + flagged[starts], 'last_row': offset + flagged[ends],
+            'anomalies': np.diff(np.append(starts, len(flagged))),
+        }
+        if 'anomaly_score' in table.column_names:
+            scores = table.column('anomaly_score').to_numpy().astype(np.float64)[flagged]
+            runs['score_sum'] = np.add.reduceat(scores, starts)
+            runs['score_max'] = np.maximum.reduceat(scores, starts)
+        for sensor in self.sensors:
+            values = table.column(sensor).to_numpy().astype(np.float64)[flagged]
+            runs[f"{sensor}_min"] = np.fmin.reduceat(values, starts)
+            runs[f"{sensor}_max"] = np.fmax.reduceat(values, starts)
+
+        if self.open is not None:
+            if runs.keys() == self.open.keys() and runs['start'][0] - self.open['end'][0] <= self.max_gap:
+                fold_run(self.open, runs)
+            else:
+                self.closed.append(self.open)
+        self.open = {name: value[-1:] for name, value in runs.items()}
+        if len(starts) > 1:
+            self.closed.append({name: value[:-1] for name, value in runs.items()})
+
+    def to_table(self):
+        """The file's events in time order; a file without anomalies gives an empty table."""
+        parts = self.closed + ([self.open] if self.open is not None else [])
+        if parts:
+            runs = {name: np.concatenate([part[name] for part in parts if name in part]) for name in parts[-1]}
+        else:
+            runs = {name: np.empty(0, dtype=np.int64) for name in ('start', 'end', 'first_row', 'last_row', 'anomalies')}
+            runs.update({f"{sensor}_{how}": np.empty(0) for sensor in self.sensors for how in ('min', 'max')})
+        n = len(runs['start'])
+        rows = runs.pop('last_row') - runs.pop('first_row') + 1
+        columns = {
+            'well': pa.array([well_of(self.source_key)] * n, pa.string()),
+            'source_key': pa.array([self.source_key] * n, pa.string()),
+            'start': pa.array(runs['start'].astype('datetime64[ns]')),
+            'end': pa.array(runs['end'].astype('datetime64[ns]')),
+            'duration_s': pa.array((runs.pop('end') - runs.pop('start')) / 1e9),
+            'rows': pa.array(rows.astype(np.int64)),
+            'anomalies': pa.array(runs['anomalies'].astype(np.int64)),
+            'density': pa.array(runs.pop('anomalies') / np.maximum(rows, 1)),
+        }
+        if 'score_sum' in runs:
+            columns['score_mean'] = pa.array(runs.pop('score_sum') / columns['anomalies'].to_numpy())
+            columns['score_max'] = pa.array(runs.pop('score_max'))
+        columns.update({name: pa.array(value.astype(np.float64)) for name, value in runs.items()})
+        return pa.table(columns)
+
+
+def compact(s3_client, bucket):
+    """Folds new/changed event objects into rollup/events.parquet. Returns a summary dict."""
+    summary = fold_objects(s3_client, bucket, EVENTS_PREFIX, EVENTS_KEY, EVENTS_MANIFEST_KEY,
+                           ['well', 'start', 'source_key'])
+    summary['events'] = summary.pop('rows')
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from s3io import client_for
+
+    parser = argparse.ArgumentParser(description="Fold events/ into rollup/events.parquet.")
+    parser.add_argument('bucket')
+    parser.add_argument('--local-root', help="Directory holding the bucket as a subdirectory, instead of S3")
+    args = parser.parse_args()
+    client = client_for(args.local_root)
+    print(json.dumps(compact(client, args.bucket)))
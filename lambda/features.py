@@ -0,0 +1,87 @@
+"""
+Feature preparation shared by training (ml/train_model.py) and inference (app.py).
+
+prepare_features() turns the raw sensor columns into the model input in one vectorized pass:
+rows with a NaN/inf feature (or a missing label) are dropped and the rest are clipped straight
+into a preallocated, C-contiguous float32 matrix. Its working set is that matrix plus a row
+mask, the kept row indices and one float64 scratch column that is reused for every feature, so
+the number of allocations does not depend on the number of features and no intermediate
+DataFrame is built.
+"""
+import numpy as np
+
+# Focus on key pressure and temperature sensors
+FEATURES = ['P-PDG', 'P-TPT', 'T-TPT', 'P-MON-CKP', 'T-JUS-CKP']
+# Extreme sensor values are clipped so the model never sees values close to the float32 range.
+CLIP_LIMIT = 1e30
+
+
+def prepare_features(columns, labels=None):
+    """
+    Returns (X, valid) for a sequence of equally long 1-D feature columns.
+
+    X is the float32 (n_valid, n_features) matrix of the rows whose features are all finite
+    (and whose label is not NaN, if labels are given); valid is the boolean row mask.
+    """
+    columns = [np.asarray(column) for column in columns]
+    labels = None if labels is None else np.asarray(labels)
+    n = len(columns[0]) if columns else 0
+    valid = np.ones(n, dtype=bool)
+    finite = np.empty(n, dtype=bool)
+    for column in columns:
+        np.isfinite(column, out=finite)
+        valid &= finite
+    if labels is not None and labels.dtype.kind == 'f':
+        np.isnan(labels, out=finite)
+        np.logical_not(finite, out=finite)
+        valid &= finite
+    del finite
+
+    # The kept row indices are computed once; take() with mode='clip' writes straight into the
+    # scratch column, where the default mode='raise' (or boolean indexing) would allocate.
+    rows = None if valid.all() else np.flatnonzero(valid)
+    n_valid = n if rows is None else len(rows)
+    X = np.empty((n_valid, len(columns)), dtype=np.float32)
+    scratch = np.empty(n_valid, dtype=np.float64) if rows is not None else None
+    for j, column in enumerate(columns):
+        if rows is None:
+            source = column
+        elif column.dtype == np.float64:
+            source = np.take(column, rows, out=scratch, mode='clip')
+        else:
+            source = np.take(column, rows, mode='clip')
+        # Clipping is computed in the source precision and cast to float32 on the way out
+        np.clip(source, -CLIP_LIMIT, CLIP_LIMIT, out=X[:, j], casting='unsafe')
+    return X, valid
+
+
+def binary_labels(labels):
+    """The training target: 1 for any anomaly class (class > 0), 0 for normal operation."""
+    return np.greater(labels, 0).view(np.int8)
+
+
+def anomaly_flags(predictions, classes):
+    """
+    Maps model predictions to the curated anomaly_flag column (0 = normal, 1 = anomaly) as int64.
+
+    Supervised classifiers trained on binary_labels predict 1 for anomalies. Outlier detectors
+    such as IsolationForest predict 1 for inliers and -1 for outliers instead.
+    """
+    flags = np.empty(len(predictions), dtype=np.int64)
+    if set(np.asarray(classes).tolist()) == {-1, 1}:
+        np.equal(predictions, -1, out=flags, casting='unsafe')
+    else:
+        np.not_equal(predictions, 0, out=flags, casting='unsafe')
+    return flags
+
+
+def anomaly_scores(probabilities, classes):
+    """
+    The model's confidence behind anomaly_flag as float32: 1 - P(normal) for every row of a
+    predict_proba() matrix (normal is class 0, or 1 for the {-1, 1} labels of outlier detectors).
+    """
+    classes = np.asarray(classes).tolist()
+    normal = 1 if set(classes) == {-1, 1} else 0
+    if normal not in classes:
+        return np.ones(len(probabilities), dtype=np.float32)
+    return (1.0 - probabilities[:, classes.index(normal)]).astype(np.float32)
@@ -0,0 +1,214 @@
+"""
+Compiled inference engine for the RandomForestClassifier trained by ml/train_model.py.
+
+The fitted forest is flattened into a handful of NumPy arrays (split feature, threshold and
+leaf class probabilities per node). Every tree is padded to a perfect binary tree stored as a
+1-based heap, so walking one level is just "node = 2 * node + go_right" for a whole block of
+rows at once, with no per-row Python and no sklearn/pandas on the hot path.
+
+Results are bit-for-bit identical to RandomForestClassifier.predict:
+  - features are compared as float32, like sklearn does internally. Thresholds are rounded
+    down to the nearest float32, which keeps "x > threshold" exact for float32 x;
+  - per-tree leaf probabilities are accumulated in float64 in estimator order, divided by the
+    number of trees and arg-maxed exactly like ForestClassifier.predict_proba/predict.
+
+The compiled forest is saved as a plain .npz artifact (model.forest.npz) that can be loaded
+without scikit-learn installed.
+
+Usage (compile an existing model):
+    python lambda/forest.py model.joblib model.forest.npz
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Perfect-tree padding needs 2**depth slots per tree, so very deep trees are not compiled.
+MAX_COMPILED_DEPTH = 16
+BLOCK_ROWS = 16384
+
+
+def _sklearn_normalizes_leaf_values():
+    """Before scikit-learn 1.4 tree_.value held class counts that predict_proba normalized."""
+    import sklearn
+    major, minor = (int(part) for part in sklearn.__version__.split('.')[:2])
+    return (major, minor) < (1, 4)
+
+
+def _leaf_probabilities(tree, n_classes):
+    value = tree.value[:, 0, :n_classes].astype(np.float64)
+    if _sklearn_normalizes_leaf_values():
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        value = value / normalizer
+    return value
+
+
+def _round_down_to_float32(threshold):
+    threshold32 = threshold.astype(np.float32)
+    too_high = threshold32.astype(np.float64) > threshold
+    threshold32[too_high] = np.nextafter(threshold32[too_high], np.float32(-np.inf))
+    return threshold32
+
+
+class CompiledForest:
+    def __init__(self, feature, threshold, missing_right, leaf_value, classes, feature_names=None):
+        self.feature = feature                # (n_trees, 2**depth) split feature per heap slot
+        self.threshold = threshold            # (n_trees, 2**depth) float32, go right if x > threshold
+        self.missing_right = missing_right    # (n_trees, 2**depth) where NaN goes
+        self.leaf_value = leaf_value          # (n_trees, 2**depth, n_classes) float64
+        self.classes_ = classes
+        self.feature_names_in_ = feature_names
+        self.n_trees = feature.shape[0]
+        self.depth = int(np.log2(feature.shape[1]))
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Compiles a fitted single-output RandomForestClassifier."""
+        if getattr(model, 'n_outputs_', 1) != 1 or not hasattr(model, 'classes_'):
+            raise ValueError("Only single-output forest classifiers can be compiled.")
+        depth = max(max(estimator.tree_.max_depth for estimator in model.estimators_), 1)
+        if depth > MAX_COMPILED_DEPTH:
+            raise ValueError(f"Tree depth {depth} exceeds MAX_COMPILED_DEPTH={MAX_COMPILED_DEPTH}.")
+
+        n_trees = len(model.estimators_)
+        n_classes = len(model.classes_)
+        slots = 2 ** depth
+        # Slot 0 is unused, internal nodes live in [1, slots), leaves are reached after `depth` steps.
+        feature = np.zeros((n_trees, slots), dtype=np.intp)
+        threshold = np.full((n_trees, slots), np.inf, dtype=np.float32)
+        missing_right = np.zeros((n_trees, slots), dtype=bool)
+        leaf_value = np.zeros((n_trees, slots, n_classes), dtype=np.float64)
+
+        for t, estimator in enumerate(model.estimators_):
+            tree = estimator.tree_
+            values = _leaf_probabilities(tree, n_classes)
+            thresholds32 = _round_down_to_float32(tree.threshold)
+            missing_left = getattr(tree, 'missing_go_to_left', None)
+            stack = [(0, 1, 0)]
+            while stack:
+                node, slot, level = stack.pop()
+                if tree.children_left[node] == -1:
+                    # Pad short branches: threshold +inf always goes left, down to the leaf level.
+                    slot <<= depth - level
+                    leaf_value[t, slot - slots] = values[node]
+                    continue
+                feature[t, slot] = tree.feature[node]
+                threshold[t, slot] = thresholds32[node]
+                if missing_left is not None:
+                    missing_right[t, slot] = not missing_left[node]
+                stack.append((tree.children_left[node], 2 * slot, level + 1))
+                stack.append((tree.children_right[node], 2 * slot + 1, level + 1))
+
+        feature_names = getattr(model, 'feature_names_in_', None)
+        return cls(feature, threshold, missing_right, leaf_value, model.classes_, feature_names)
+
+    def _arrays(self):
+        arrays = {
+            'feature': self.feature, 'threshold': self.threshold, 'missing_right': self.missing_right,
+            'leaf_value': self.leaf_value, 'classes': self.classes_
+        }
+        if self.feature_names_in_ is not None:
+            arrays['feature_names'] = np.asarray(self.feature_names_in_, dtype=str)
+        return arrays
+
+    def save(self, path):
+        """Saves a single .npz file, the artifact that is uploaded next to model.joblib."""
+        with open(path, 'wb') as f:
+            np.savez(f, **self._arrays())
+
+    def save_dir(self, directory):
+        """Saves one uncompressed .npy file per array, which load() can memory-map."""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self._arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Loads a .npz artifact, or a save_dir() directory (optionally memory-mapped)."""
+        if os.path.isdir(path):
+            data = {
+                name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode=mmap_mode, allow_pickle=False)
+                for name in os.listdir(path) if name.endswith('.npy')
+            }
+            return cls._from_arrays(data)
+        with np.load(path, allow_pickle=False) as data:
+            return cls._from_arrays({name: data[name] for name in data.files})
+
+    @classmethod
+    def _from_arrays(cls, data):
+        # asarray keeps memory-mapped arrays mapped when the dtype already matches.
+        return cls(np.asarray(data['feature'], dtype=np.intp), data['threshold'], data['missing_right'],
+                   data['leaf_value'], np.asarray(data['classes']), data.get('feature_names'))
+
+    def _as_float32(self, X):
+        if self.feature_names_in_ is not None and hasattr(X, 'columns'):
+            X = X[list(self.feature_names_in_)]
+        return np.ascontiguousarray(X, dtype=np.float32)
+
+    def _predict_block(self, X, out):
+        n = X.shape[0]
+        # Column-major copy of the block: feature f of row i lives at f * n + i.
+        columns = np.ascontiguousarray(X.T).ravel()
+        rows = np.arange(n, dtype=np.intp)
+        has_nan = bool(np.isnan(columns).any())
+        slots = 2 ** self.depth
+
+        node = np.empty(n, dtype=np.intp)
+        index = np.empty(n, dtype=np.intp)
+        x = np.empty(n, dtype=np.float32)
+        split = np.empty(n, dtype=np.float32)
+        go_right = np.empty(n, dtype=bool)
+        step = np.empty(n, dtype=np.intp)
+        out[:] = 0.0
+        # Every index below is in range by construction, so mode='clip' is used because it is
+        # cheaper than NumPy's default bounds check. Mixed bool/int arithmetic is slow in NumPy,
+        # so the comparison is copied into an integer buffer before it is added to the node index.
+        for t in range(self.n_trees):
+            offsets = self.feature[t] * n
+            threshold = self.threshold[t]
+            node.fill(1)
+            for _ in range(self.depth):
+                np.take(offsets, node, out=index, mode='clip')
+                index += rows
+                np.take(columns, index, out=x, mode='clip')
+                np.take(threshold, node, out=split, mode='clip')
+                np.greater(x, split, out=go_right)
+                if has_nan:
+                    go_right |= np.isnan(x) & self.missing_right[t].take(node, mode='clip')
+                np.copyto(step, go_right)
+                node += node
+                node += step
+            node -= slots
+            out += self.leaf_value[t].take(node, axis=0, mode='clip')
+        out /= self.n_trees
+
+    def predict_proba(self, X, n_jobs=None):
+        """Same result as RandomForestClassifier.predict_proba, computed block by block."""
+        X = self._as_float32(X)
+        proba = np.empty((X.shape[0], len(self.classes_)), dtype=np.float64)
+        blocks = [(start, min(start + BLOCK_ROWS, X.shape[0])) for start in range(0, X.shape[0], BLOCK_ROWS)]
+        # NumPy releases the GIL inside take/compare, so blocks scale across vCPUs with threads.
+        workers = n_jobs or os.cpu_count() or 1
+        if workers == 1 or len(blocks) == 1:
+            for start, end in blocks:
+                self._predict_block(X[start:end], proba[start:end])
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda block: self._predict_block(X[block[0]:block[1]], proba[block[0]:block[1]]), blocks))
+        return proba
+
+    def predict(self, X, n_jobs=None):
+        return self.classes_.take(np.argmax(self.predict_proba(X, n_jobs=n_jobs), axis=1), axis=0)
+
+
+if __name__ == '__main__':
+    import joblib
+
+    if len(sys.argv) != 3:
+        print("Usage: python forest.py <model.joblib> <model.forest.npz>")
+        sys.exit(1)
+    compiled = CompiledForest.from_sklearn(joblib.load(sys.argv[1]))
+    compiled.save(sys.argv[2])
+    print(f"Compiled {compiled.n_trees} trees (depth {compiled.depth}) to {sys.argv[2]}")
@@ -0,0 +1,146 @@
+"""
+Curated bucket layout: where scored rows are written.
+
+  mirror       data/<class>/<file>.parquet, the raw key (one curated object per raw object)
+  partitioned  data/well=<well>/date=<YYYY-MM-DD>/class=<class>/<file>.parquet, Hive-style, so
+               Athena (partition projection) and wr.s3.read_parquet(dataset=True) can prune by
+               well, day and class. Rows of one raw file that span midnight go to two partitions.
+
+Both are exposed as table sinks (write_table / close / abort / keys / outputs) for app.score_parquet. The
+partitioned sink keeps one streaming multipart upload open per partition it has seen, which is
+one or two for a 3W file, and every object only becomes visible once it is complete. Its
+output_key hook moves keys whose old rows were already compacted aside (compaction.output_key).
+A sink given an `encoding` (curated_format.CuratedEncoding) writes every table through it.
+"""
+import os
+import re
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from s3io import S3MultipartWriter
+
+CURATED_PREFIX = 'data/'
+PARTITION_KEYS = ('well', 'date', 'class')
+
+
+def well_of(source_key):
+    """The 3W instance name without the start timestamp: WELL-00014, SIMULATED_00002, ..."""
+    stem = os.path.splitext(os.path.basename(source_key))[0]
+    return re.sub(r'_\d{14}$', '', stem)
+
+
+def class_of(source_key):
+    """The fault class directory of a raw key (data/<class>/<file>), or 'unknown'."""
+    parts = source_key.split('/')
+    return parts[-2] if len(parts) >= 2 and parts[-2] else 'unknown'
+
+
+def partition_prefix(well, date, label):
+    return f"{CURATED_PREFIX}well={well}/date={date}/class={label}/"
+
+
+def parse_partition(key):
+    """{'well': ..., 'date': ..., 'class': ...} from a partitioned key, {} for other keys."""
+    return dict(part.split('=', 1) for part in key.split('/')[:-1] if '=' in part)
+
+
+class ParquetFileSink:
+    """Table sink over one binary file object (the mirror layout, or a local file)."""
+
+    def __init__(self, file, key=None, encoding=None, **writer_options):
+        self.file = file
+        self.keys = [key] if key else []
+        self.encoding = encoding
+        self.writer_options = writer_options
+        self.writer = None
+        self.rows = 0
+
+    def write_table(self, table):
+        if self.encoding is not None:
+            table = self.encoding.encode(table)
+        if self.writer is None:
+            options = self.encoding.writer_options(table.schema) if self.encoding is not None else {}
+            options.update(self.writer_options)
+            self.writer = pq.ParquetWriter(self.file, table.schema, **options)
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+
+    def outputs(self):
+        """(key, rows, bytes) of every object written."""
+        return [(key, self.rows, self.file.tell()) for key in self.keys]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.file.close()
+
+    def abort(self):
+        if hasattr(self.file, 'abort'):
+            self.file.abort()
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None or self.rows == 0:
+            # Nothing (complete) to publish, make sure no empty object is created.
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+class PartitionedSink(ParquetFileSink):
+    """Splits scored tables by day and streams each day to its Hive partition."""
+
+    def __init__(self, s3_client, bucket, source_key, encoding=None, output_key=None, **writer_options):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.output_key = output_key
+        self.well = well_of(source_key)
+        self.label = class_of(source_key)
+        self.filename = os.path.basename(source_key)
+        self.encoding = encoding
+        self.writer_options = writer_options
+        self.parts = {}
+        self.keys = []
+        self.staged = []  # keys moved aside by output_key
+        self.rows = 0
+
+    def _part(self, date):
+        if date not in self.parts:
+            key = partition_prefix(self.well, date, self.label) + self.filename
+            if self.output_key is not None:
+                key = self.output_key(key)
+            self.parts[date] = ParquetFileSink(S3MultipartWriter(self.s3_client, self.bucket, key), key, self.encoding,
+                                               **self.writer_options)
+            self.keys.append(key)
+            if not key.startswith(CURATED_PREFIX):
+                self.staged.append(key)
+        return self.parts[date]
+
+    def write_table(self, table):
+        if 'timestamp' not in table.column_names:
+            self._part('unknown').write_table(table)
+        else:
+            days = table.column('timestamp').to_numpy().astype('datetime64[D]')
+            unique_days = np.unique(days)
+            for day in unique_days:
+                part = table if len(unique_days) == 1 else table.filter(days == day)
+                self._part(str(day)).write_table(part)
+        self.rows += table.num_rows
+
+    def outputs(self):
+        # Staged objects are not readable yet, compaction publishes (and indexes) their rows
+        return [output for part in self.parts.values() for output in part.outputs() if output[0] not in self.staged]
+
+    def close(self):
+        for part in self.parts.values():
+            part.close()
+
+    def abort(self):
+        for part in self.parts.values():
+            part.abort()
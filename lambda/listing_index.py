@@ -0,0 +1,127 @@
+"""
+Append-only index of the curated parquet objects, newest first.
+
+Every curated object the Lambda (or the compaction job) writes gets a zero-byte index entry
+
+    _index/<inverted write time>_<rows>_<bytes>/<curated key>
+
+where the inverted time is INVERTED_BASE minus the write time in milliseconds. S3 lists keys
+in ascending order, so a single ListObjectsV2 call with MaxKeys=k returns the k most recently
+written objects together with their row count and size, whatever the size of the bucket. The
+last index key of a page is the cursor for the next (older) page (StartAfter).
+
+Entries are removed when their object is replaced: a re-scored raw file drops the entries of
+its previous outputs (they are listed in the marker), compaction drops those of merged inputs.
+
+Usage (--rebuild creates entries for curated objects written before the index existed,
+--local-root runs against a local directory instead of S3, see s3io.client_for):
+    python lambda/listing_index.py <curated bucket> [--rebuild] [--local-root /data/lake]
+"""
+import datetime
+import time
+
+INDEX_PREFIX = '_index/'
+# 10^13 ms is the year 2286, so the inverted time always has 13 digits.
+INVERTED_BASE = 10 ** 13 - 1
+
+
+def index_key(curated_key, rows, size, written_ms=None):
+    if written_ms is None:
+        written_ms = int(time.time() * 1000)
+    return f"{INDEX_PREFIX}{INVERTED_BASE - written_ms:013d}_{rows}_{size}/{curated_key}"
+
+
+def parse_index_key(key):
+    """{'key', 'rows', 'size', 'last_modified', 'index_key'} for an index entry."""
+    stamp, _, curated_key = key[len(INDEX_PREFIX):].partition('/')
+    inverted, rows, size = stamp.split('_')
+    written_ms = INVERTED_BASE - int(inverted)
+    return {
+        'key': curated_key,
+        'rows': int(rows),
+        'size': int(size),
+        'last_modified': datetime.datetime.fromtimestamp(written_ms / 1000, datetime.timezone.utc),
+        'index_key': key,
+    }
+
+
+def append(s3_client, bucket, curated_key, rows, size, written_ms=None):
+    """Adds the entry for a curated object that is now in place. Returns the index key."""
+    key = index_key(curated_key, rows, size, written_ms)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=b'')
+    return key
+
+
+def remove(s3_client, bucket, index_keys):
+    for key in index_keys:
+        s3_client.delete_object(Bucket=bucket, Key=key)
+
+
+def recent(s3_client, bucket, limit=30, cursor=None):
+    """
+    The `limit` most recently written objects older than `cursor` (None: the newest ones).
+    Returns (entries, next cursor or None when there is nothing older).
+    """
+    kwargs = {'Bucket': bucket, 'Prefix': INDEX_PREFIX, 'MaxKeys': limit}
+    if cursor:
+        kwargs['StartAfter'] = cursor
+    response = s3_client.list_objects_v2(**kwargs)
+    entries = [parse_index_key(obj['Key']) for obj in response.get('Contents', [])]
+    next_cursor = entries[-1]['index_key'] if entries and response.get('IsTruncated') else None
+    return entries, next_cursor
+
+
+def iter_entries(s3_client, bucket):
+    """All entries, newest first (a full listing, for maintenance jobs only)."""
+    cursor = None
+    while True:
+        entries, cursor = recent(s3_client, bucket, limit=1000, cursor=cursor)
+        yield from entries
+        if cursor is None:
+            return
+
+
+def entries_for(s3_client, bucket, curated_keys):
+    """Index keys of the given curated objects."""
+    curated_keys = set(curated_keys)
+    return [entry['index_key'] for entry in iter_entries(s3_client, bucket) if entry['key'] in curated_keys]
+
+
+def rebuild(s3_client, bucket, prefix='data/'):
+    """Indexes every parquet object under prefix that has no entry yet. Returns the number added."""
+    import pyarrow.parquet as pq
+    from s3io import open_object
+
+    indexed = {entry['key'] for entry in iter_entries(s3_client, bucket)}
+    added = 0
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            if not obj['Key'].endswith('.parquet') or obj['Key'] in indexed:
+                continue
+            with open_object(s3_client, bucket, obj['Key']) as source:
+                rows = pq.ParquetFile(source).metadata.num_rows
+            append(s3_client, bucket, obj['Key'], rows, obj['Size'], int(obj['LastModified'].timestamp() * 1000))
+            added += 1
+        if not response.get('IsTruncated'):
+            return added
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from s3io import client_for
+
+    parser = argparse.ArgumentParser(description="Show or rebuild the curated listing index.")
+    parser.add_argument('bucket')
+    parser.add_argument('--rebuild', action='store_true', help="Index curated objects that have no entry yet")
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--local-root', help="Directory holding the bucket as a subdirectory, instead of S3")
+    args = parser.parse_args()
+    client = client_for(args.local_root)
+    if args.rebuild:
+        print(f"Indexed {rebuild(client, args.bucket)} object(s)")
+    for entry in recent(client, args.bucket, args.limit)[0]:
+        print(f"{entry['last_modified']:%Y-%m-%d %H:%M:%S}  {entry['rows']:>10,}  {entry['size']:>12,}  {entry['key']}")
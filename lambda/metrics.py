@@ -0,0 +1,212 @@
+"""
+Per-stage timing spans and counters for the inference pipeline.
+
+A trace covers one unit of work (an invocation, a raw object, a stream batch) and is the current
+trace of the thread running it, so the code below it only calls metrics.span('predict') or
+metrics.count('rows_in', n) without passing anything around. Spans record self time: the time
+of a span nested in another (a multipart upload inside a row group encode) is subtracted from the
+outer one, so the stages of a trace add up to its total instead of double counting.
+
+When a trace ends it is written as one log line:
+  emf    CloudWatch Embedded Metric Format on stdout (the default on Lambda): every stage and
+         counter becomes a metric with the dimensions kind, start (cold/warm) and engine, and
+         source key and model version stay searchable properties in CloudWatch Logs Insights
+  jsonl  the same record without the EMF envelope, on stdout or appended to METRICS_FILE;
+         `python metrics.py summarize <file>` prints p50/p99 per stage
+  off    nothing (the default outside Lambda)
+
+METRICS_SAMPLE_RATE traces only that fraction of the units; the others, like everything in
+`off` mode, get a shared no-op trace whose spans cost a function call.
+"""
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+METRICS_MODE = os.environ.get('METRICS_MODE', 'emf' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'off')
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1'))
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AnomalyPipeline')
+METRICS_FILE = os.environ.get('METRICS_FILE')
+
+# Dimensions of every metric; the handler module adds the engine. 'start' is 'batch' in jobs
+# that never call start_invocation() (backfill, stream consumer).
+dimensions = {'start': 'batch'}
+_cold = True
+_local = threading.local()
+_emit_lock = threading.Lock()
+_NULL_SPAN = nullcontext()
+
+
+class Trace:
+    """Stage self times (ms), counters and properties of one unit of work."""
+
+    def __init__(self, kind, properties):
+        self.kind = kind
+        self.properties = properties
+        self.timings = {}
+        self.counters = {}
+        self.children = []  # time spent in nested spans, one accumulator per open span
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        self.children.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self.children.pop()
+            self.timings[name] = self.timings.get(name, 0.0) + (elapsed - nested) * 1000
+            if self.children:
+                self.children[-1] += elapsed
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def shift(self, source, target, ms):
+        """Moves ms from one stage to another, for time measured inside a span by other means."""
+        ms = min(ms, self.timings.get(source, 0.0))
+        self.timings[source] = self.timings.get(source, 0.0) - ms
+        self.timings[target] = self.timings.get(target, 0.0) + ms
+
+    def set(self, **properties):
+        self.properties.update(properties)
+
+    def record(self):
+        record = dict(dimensions, kind=self.kind)
+        record.update(self.properties)
+        record.update({f"{name}_ms": round(value, 3) for name, value in self.timings.items()})
+        record.update(self.counters)
+        return record
+
+
+class NullTrace:
+    """Stands in for unsampled units and `off` mode."""
+    kind = None
+
+    def span(self, name):
+        return _NULL_SPAN
+
+    def count(self, name, value=1):
+        pass
+
+    def shift(self, source, target, ms):
+        pass
+
+    def set(self, **properties):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+def start_invocation():
+    """Tags the traces that follow with start=cold for the first call in the process, then warm."""
+    global _cold
+    dimensions['start'] = 'cold' if _cold else 'warm'
+    _cold = False
+    return dimensions['start']
+
+
+def current():
+    return getattr(_local, 'trace', NULL_TRACE)
+
+
+def span(name):
+    """Times a stage of the thread's current trace (a no-op without one)."""
+    return getattr(_local, 'trace', NULL_TRACE).span(name)
+
+
+def count(name, value=1):
+    getattr(_local, 'trace', NULL_TRACE).count(name, value)
+
+
+@contextmanager
+def trace(kind, **properties):
+    """Makes a (sampled) trace the thread's current one for the block, and emits it at the end."""
+    if METRICS_MODE == 'off' or (METRICS_SAMPLE_RATE < 1 and random.random() >= METRICS_SAMPLE_RATE):
+        yield NULL_TRACE
+        return
+    unit = Trace(kind, properties)
+    previous = getattr(_local, 'trace', None)
+    _local.trace = unit
+    start = time.perf_counter()
+    try:
+        yield unit
+    except BaseException:
+        unit.set(error=True)
+        raise
+    finally:
+        _local.trace = previous
+        unit.timings['total'] = (time.perf_counter() - start) * 1000
+        emit(unit.record())
+
+
+def emf(record):
+    """Wraps a record in the Embedded Metric Format envelope: numbers become metrics."""
+    metrics = []
+    for name, value in record.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            unit = 'Milliseconds' if name.endswith('_ms') else 'Bytes' if name.endswith('bytes') else 'Count'
+            metrics.append({'Name': name, 'Unit': unit})
+    return dict(record, _aws={
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{'Namespace': METRICS_NAMESPACE, 'Dimensions': [sorted(dimensions) + ['kind']],
+                               'Metrics': metrics}],
+    })
+
+
+def emit(record):
+    line = json.dumps(emf(record) if METRICS_MODE == 'emf' else dict(record, time=round(time.time(), 3)))
+    with _emit_lock:
+        if METRICS_MODE == 'jsonl' and METRICS_FILE:
+            with open(METRICS_FILE, 'a') as f:
+                f.write(line + '\n')
+        else:
+            print(line, flush=True)
+
+
+def summarize(lines):
+    """{(kind, start): {stage or counter: {'n', 'p50', 'p99', 'sum'}}} from jsonl or EMF log lines."""
+    import numpy as np
+
+    groups = {}
+    for line in lines:
+        line = line.strip()
+        if not line.startswith('{'):
+            continue  # other log output
+        record = json.loads(line)
+        if 'kind' not in record:
+            continue
+        values = groups.setdefault((record['kind'], record.get('start')), {})
+        for name, value in record.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and name != 'time':
+                values.setdefault(name, []).append(value)
+    return {
+        group: {name: {'n': len(series), 'p50': float(np.percentile(series, 50)),
+                       'p99': float(np.percentile(series, 99)), 'sum': float(np.sum(series))}
+                for name, series in sorted(values.items())}
+        for group, values in groups.items()
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Aggregate metric log lines (jsonl or EMF) per kind and start type.")
+    parser.add_argument('command', choices=['summarize'])
+    parser.add_argument('file', nargs='?', help="Log or METRICS_FILE to read (default: stdin)")
+    args = parser.parse_args()
+    with (open(args.file) if args.file else sys.stdin) as f:
+        summary = summarize(f)
+    for (kind, start), values in sorted(summary.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        total = values.get('total_ms', {}).get('sum', 0)
+        print(f"\n{kind} ({start}): {values.get('total_ms', {}).get('n', 0)} traces")
+        if total and 'rows_out' in values:
+            print(f"  throughput: {values['rows_out']['sum'] / total * 1000:,.0f} rows/s")
+        print(f"  {'metric':<22} {'n':>7} {'p50':>12} {'p99':>12} {'sum':>14}")
+        for name, stats in values.items():
+            print(f"  {name:<22} {stats['n']:>7} {stats['p50']:>12,.2f} {stats['p99']:>12,.2f} {stats['sum']:>14,.1f}")
@@ -0,0 +1,103 @@
+"""
+Multi-resolution overviews of the curated sensor series, for the dashboard charts.
+
+For every raw file the inference Lambda also writes overviews/<same key>: for each level of
+LEVELS (bucket widths in seconds, every level 8x coarser than the one before) one row per time
+bucket with the record and anomaly counts, and the min/max of every sensor, over all samples and
+over the anomalous samples only. A chart of any time range then needs at most a few thousand
+rows at the level whose buckets fit its width, and an anomaly never disappears from a coarse
+level. Buckets are aligned to absolute time, so partial buckets of consecutive row groups fold.
+
+Rows are sorted by (level, timestamp) and written in one row group per level, so a reader that
+filters on level and a timestamp range only decodes the matching row group slices.
+"""
+import io
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from rollup import group_reduce
+
+OVERVIEWS_PREFIX = 'overviews/'
+LEVELS = (8, 64, 512, 4096)
+
+
+def overview_key(source_key):
+    return f"{OVERVIEWS_PREFIX}{source_key}"
+
+
+def reductions(sensors):
+    how = {'records': 'sum', 'anomalies': 'sum'}
+    for sensor in sensors:
+        how.update({f"{sensor}_min": 'min', f"{sensor}_max": 'max',
+                    f"{sensor}_anomaly_min": 'min', f"{sensor}_anomaly_max": 'max'})
+    return how
+
+
+class OverviewBuilder:
+    """
+    Accumulates the overview levels of one file, one scored row group at a time.
+
+    Only the finest level is reduced from the samples; every coarser level (a multiple of the
+    finer one) is folded from the level below it, which costs a fraction of another pass.
+    """
+
+    def __init__(self, sensors, levels=LEVELS):
+        self.sensors = list(sensors)
+        self.levels = sorted(levels)
+        if any(coarse % fine for fine, coarse in zip(self.levels, self.levels[1:])):
+            raise ValueError("Every overview level must be a multiple of the finer one.")
+        self.how = reductions(self.sensors)
+        self.parts = []
+
+    def add(self, table):
+        """Adds a scored table; tables without a timestamp index have no time axis to reduce."""
+        if table.num_rows == 0 or 'timestamp' not in table.column_names:
+            return
+        seconds = table.column('timestamp').to_numpy().astype('datetime64[s]').astype(np.int64)
+        anomalous = table.column('anomaly_flag').to_numpy() != 0
+        values = {'records': np.ones(table.num_rows), 'anomalies': anomalous.astype(np.float64)}
+        for sensor in self.sensors:
+            column = table.column(sensor).to_numpy()
+            values.update({
+                f"{sensor}_min": column, f"{sensor}_max": column,
+                f"{sensor}_anomaly_min": np.where(anomalous, column, np.inf),
+                f"{sensor}_anomaly_max": np.where(anomalous, column, -np.inf),
+            })
+        self.parts.append(group_reduce([seconds // self.levels[0]], values, self.how))
+
+    def to_table(self):
+        """All levels as one table sorted by (level, timestamp), or None if nothing was added."""
+        if not self.parts:
+            return None
+        # Row groups can split a bucket, so the finest level is folded once more
+        buckets = np.concatenate([buckets for (buckets,), _ in self.parts])
+        values = {name: np.concatenate([reduced[name] for _, reduced in self.parts]) for name in self.how}
+        tables = []
+        previous = self.levels[0]
+        for level in self.levels:
+            (buckets,), values = group_reduce([buckets // (level // previous)], values, self.how)
+            previous = level
+            columns = {
+                'level': pa.array(np.full(len(buckets), level, dtype=np.int32)),
+                'timestamp': pa.array((buckets * level).astype('datetime64[s]')),
+                'records': pa.array(values['records'].astype(np.int64)),
+                'anomalies': pa.array(values['anomalies'].astype(np.int64)),
+            }
+            for name, value in values.items():
+                if name not in ('records', 'anomalies'):
+                    # No anomaly in the bucket: the anomaly min/max are missing rather than +-inf
+                    columns[name] = pa.array(np.where(np.isinf(value), np.nan, value))
+            tables.append(pa.table(columns))
+        return pa.concat_tables(tables)
+
+
+def to_parquet_bytes(table):
+    """One row group per level, with statistics, so readers can prune by level and time."""
+    buffer = io.BytesIO()
+    with pq.ParquetWriter(buffer, table.schema, compression='zstd') as writer:
+        levels = table.column('level').to_numpy()
+        for level in np.unique(levels):
+            writer.write_table(table.filter(pa.array(levels == level)))
+    return buffer.getvalue()
@@ -0,0 +1,196 @@
+"""
+Rolling-window features (mean, std, slope, delta) over the 1 Hz sensor series of one well.
+
+Derived features are named "<sensor>:<stat><window>", e.g. "P-PDG:slope300" is the least-squares
+slope of P-PDG over the last 300 samples. A model trained on such columns records them in
+feature_names_in_, which is how the Lambda knows which windows to compute.
+
+Window sums are built from prefix and suffix sums inside blocks of `window` samples that are
+aligned to the absolute sample position in the well (van Herk / Gil-Werman): the window ending
+at t is the suffix of the block holding t - window + 1 plus the prefix of the block holding t.
+Every sum is therefore computed from the same samples in the same order no matter where a
+chunk starts, which is what makes streaming (RollingFeatures.transform called file by file or
+row group by row group) bit-for-bit identical to batch mode (one call with the whole series),
+at O(1) work per sample. Only the last window - 1 raw samples are carried between calls.
+
+Windows are counted in samples. Missing (NaN) samples are skipped rather than spoiling every
+window they fall into: mean and std are taken over the finite samples of the window, slope is
+the least-squares fit over their positions, and delta runs from the first to the last finite
+sample. A window with fewer than MIN_FINITE_FRACTION of its samples finite (or fewer than two),
+or one that reaches before the first sample of the well, yields NaN, so prepare_features drops
+that row in training and inference alike.
+"""
+import numpy as np
+
+STATS = ('mean', 'std', 'slope', 'delta')
+# Share of a window's samples that must be finite for its statistics to be computed
+MIN_FINITE_FRACTION = 0.5
+
+
+def feature_name(base, stat, window):
+    return f"{base}:{stat}{window}"
+
+
+def rolling_feature_names(bases, windows, stats=STATS):
+    """The derived column names for every sensor, window and statistic."""
+    return [feature_name(base, stat, window) for window in windows for base in bases for stat in stats]
+
+
+def parse_feature_name(name):
+    """Returns (base, stat, window) for a derived name and (name, None, None) for a raw sensor."""
+    base, sep, spec = name.rpartition(':')
+    if sep:
+        for stat in STATS:
+            if spec.startswith(stat) and spec[len(stat):].isdigit():
+                return base, stat, int(spec[len(stat):])
+    return name, None, None
+
+
+def base_features(names):
+    """The raw sensor columns needed to compute `names`, in first-use order."""
+    return list(dict.fromkeys(parse_feature_name(name)[0] for name in names))
+
+
+def has_rolling_features(names):
+    return any(parse_feature_name(name)[2] for name in names)
+
+
+def _block_sums(values, window, lead):
+    """
+    Prefix and suffix sums inside aligned blocks of the finite-sample count c and of c * i,
+    c * i**2, x, x * i and x**2 (NaN samples count as x = 0, c = 0).
+    """
+    blocks = -(-(lead + len(values)) // window)
+    padded = np.full(blocks * window, np.nan)
+    padded[lead:lead + len(values)] = values
+    padded = padded.reshape(blocks, window)
+    finite = np.isfinite(padded)
+    count = finite.astype(np.float64)
+    x = np.where(finite, padded, 0.0)
+    i = np.arange(window, dtype=np.float64)
+    sums = {}
+    for name, terms in (('c', count), ('ic', count * i), ('iic', count * i * i), ('x', x), ('ix', x * i), ('xx', x * x)):
+        sums['prefix_' + name] = np.cumsum(terms, axis=1).ravel()
+        sums['suffix_' + name] = np.cumsum(terms[:, ::-1], axis=1)[:, ::-1].ravel()
+    return sums
+
+
+@np.errstate(invalid='ignore', divide='ignore')
+def _window_stats(values, window, lead, first, count, position):
+    """
+    Statistics of the windows ending at values[first:first + count].
+
+    values are already centered; lead is the offset of values[0] in its aligned block and
+    position is the absolute sample index of values[first].
+    """
+    sums = _block_sums(values, window, lead)
+    end = lead + first + np.arange(count)
+    start = np.maximum(end - window + 1, 0)
+    offset = start % window
+    aligned = offset == 0  # the window is exactly one block
+    take = lambda name, index: sums[name].take(index, mode='clip')
+
+    def window_sum(name):
+        return np.where(aligned, take('prefix_' + name, end), take('suffix_' + name, start) + take('prefix_' + name, end))
+
+    # Sums over j = 0 .. window - 1 counted from the start of the window: j = i - offset in the
+    # block holding the start, j = i + window - offset in the next one
+    shift = window - offset
+
+    def shifted_sum(name, weight):
+        """The window sum of j * term from the block sums of i * term (name) and term (weight)."""
+        head = take('suffix_' + name, start) - offset * take('suffix_' + weight, start)
+        tail = take('prefix_' + name, end) + shift * take('prefix_' + weight, end)
+        return np.where(aligned, take('prefix_' + name, end), head + tail)
+
+    n = window_sum('c')
+    sum_x = window_sum('x')
+    sum_xx = window_sum('xx')
+    sum_j = shifted_sum('ic', 'c')
+    sum_jx = shifted_sum('ix', 'x')
+    suffix_c, suffix_ic, suffix_iic = take('suffix_c', start), take('suffix_ic', start), take('suffix_iic', start)
+    prefix_c, prefix_ic, prefix_iic = take('prefix_c', end), take('prefix_ic', end), take('prefix_iic', end)
+    sum_jj = np.where(aligned, prefix_iic,
+                      (suffix_iic - 2 * offset * suffix_ic + offset * offset * suffix_c)
+                      + (prefix_iic + 2 * shift * prefix_ic + shift * shift * prefix_c))
+
+    # The first and the last finite sample of every window, for delta
+    index = np.arange(len(values))
+    finite = np.isfinite(values)
+    last_finite = np.maximum.accumulate(np.where(finite, index, 0))
+    next_finite = np.minimum.accumulate(np.where(finite, index, len(values) - 1)[::-1])[::-1]
+    window_end = end - lead
+    window_start = np.maximum(window_end - window + 1, 0)
+
+    mean = sum_x / n
+    stats = {
+        'mean': mean,
+        'std': np.sqrt(np.maximum(sum_xx / n - mean * mean, 0.0)),
+        'slope': (n * sum_jx - sum_j * sum_x) / (n * sum_jj - sum_j * sum_j),
+        'delta': values.take(last_finite.take(window_end, mode='clip'), mode='clip')
+                 - values.take(next_finite.take(window_start, mode='clip'), mode='clip'),
+    }
+    # Windows that would reach before the first sample of the well are incomplete, and too
+    # sparse windows say little
+    invalid = (position + np.arange(count) < window - 1) | (n < max(2.0, np.ceil(MIN_FINITE_FRACTION * window)))
+    for stat in stats.values():
+        stat[invalid] = np.nan
+    return stats
+
+
+class RollingFeatures:
+    """
+    Computes the columns `names` (raw sensors and derived rolling features) for one well.
+
+    Call transform() with consecutive chunks of the well's series; the state needed for the
+    next chunk (last raw samples, sample position, centering reference) is carried over.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.specs = [parse_feature_name(name) for name in self.names]
+        self.bases = base_features(self.names)
+        windows = [window for _, _, window in self.specs if window]
+        if any(window < 2 for window in windows):
+            raise ValueError("Rolling windows must be at least 2 samples long.")
+        self.carry = max(windows, default=1) - 1
+        self.reset()
+
+    def reset(self):
+        """Starts over, e.g. when the next chunk does not continue the previous one in time."""
+        self.history = {base: np.empty(0) for base in self.bases}
+        self.reference = {}
+        self.position = 0
+        self.last_timestamp = None
+
+    def transform(self, columns):
+        """Returns one float array per name for the next chunk; columns maps sensor -> values."""
+        raw = {base: np.asarray(columns[base], dtype=np.float64) for base in self.bases}
+        count = len(raw[self.bases[0]]) if self.bases else 0
+        derived = {}
+        for base in self.bases:
+            windows = {window for b, _, window in self.specs if b == base and window}
+            if not windows:
+                continue
+            values = np.concatenate([self.history[base], raw[base]])
+            if base not in self.reference:
+                # Centering on the well's first finite sample keeps the sums of squares precise
+                finite = values[np.isfinite(values)]
+                if len(finite):
+                    self.reference[base] = finite[0]
+            centered = values - self.reference.get(base, 0.0)
+            first = len(self.history[base])
+            start = self.position - first
+            for window in windows:
+                stats = _window_stats(centered, window, start % window, first, count, self.position)
+                stats['mean'] += self.reference.get(base, 0.0)
+                for stat, value in stats.items():
+                    derived[feature_name(base, stat, window)] = value
+            self.history[base] = values[len(values) - min(self.carry, len(values)):].copy()
+        self.position += count
+        return [raw[name] if window is None else derived[name] for name, (_, _, window) in zip(self.names, self.specs)]
+
+
+def compute(names, columns):
+    """Batch mode: all columns of one well's complete series in a single call."""
+    return RollingFeatures(names).transform(columns)
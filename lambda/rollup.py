@@ -0,0 +1,208 @@
+"""
+Pre-aggregated KPI records for the curated bucket, and the compaction job that rolls them up.
+
+For every curated parquet file the inference Lambda also writes aggregates/<same key>: one row
+per hour of data with the record count, the anomaly count and min/max/sum of every sensor
+(sums rather than means, so rows can be folded; mean = sum / records). The compaction job folds
+all new or changed aggregate objects into rollup/rollup.parquet, one row per source file and
+hour, which is what the dashboard KPIs read instead of scanning the curated table.
+
+Compaction is incremental: rollup/manifest.json records the ETag of every aggregate object that
+is already folded in, so a run only reads the aggregates that appeared or changed since the
+last one, and rows are replaced per source file (re-scored files never double count). The
+scheduled handler folds the anomaly event index (events.py) the same way.
+
+Usage (--local-root runs against a local directory instead of S3, see s3io.client_for):
+    python lambda/rollup.py <curated bucket> [--local-root /data/lake]
+"""
+import io
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from layout import well_of
+from s3io import client_for, is_missing
+
+AGGREGATES_PREFIX = 'aggregates/'
+ROLLUP_KEY = 'rollup/rollup.parquet'
+MANIFEST_KEY = 'rollup/manifest.json'
+
+
+def aggregate_key(source_key):
+    return f"{AGGREGATES_PREFIX}{source_key}"
+
+
+def group_reduce(keys, values, how):
+    """
+    Groups rows by the key arrays and reduces every value array with how[name] (sum/min/max).
+    Returns (unique key arrays, reduced value arrays), both in key order.
+    """
+    codes = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        unique, inverse = np.unique(key, return_inverse=True)
+        codes = codes * len(unique) + inverse
+    groups, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    reduced = {}
+    for name, value in values.items():
+        if how[name] == 'sum':
+            reduced[name] = np.bincount(inverse, weights=value, minlength=len(groups))
+        else:
+            out = np.full(len(groups), np.inf if how[name] == 'min' else -np.inf)
+            (np.minimum if how[name] == 'min' else np.maximum).at(out, inverse, value)
+            reduced[name] = out
+    return [key[first] for key in keys], reduced
+
+
+def reductions(sensors):
+    how = {'records': 'sum', 'anomalies': 'sum'}
+    for sensor in sensors:
+        how.update({f"{sensor}_min": 'min', f"{sensor}_max": 'max', f"{sensor}_sum": 'sum'})
+    return how
+
+
+class FileAggregator:
+    """Accumulates per-hour aggregates of one curated file, one scored row group at a time."""
+
+    def __init__(self, source_key, sensors):
+        self.source_key = source_key
+        self.sensors = list(sensors)
+        self.how = reductions(self.sensors)
+        self.hours = []
+        self.parts = []
+
+    def add(self, table):
+        """Adds a scored table (sensors, anomaly_flag and, if present, the timestamp index)."""
+        if table.num_rows == 0:
+            return
+        if 'timestamp' in table.column_names:
+            hours = table.column('timestamp').to_numpy().astype('datetime64[h]').astype(np.int64)
+        else:
+            hours = np.full(table.num_rows, np.iinfo(np.int64).min)  # NaT: no time information
+        values = {'records': np.ones(table.num_rows), 'anomalies': table.column('anomaly_flag').to_numpy()}
+        for sensor in self.sensors:
+            column = table.column(sensor).to_numpy()
+            values.update({f"{sensor}_min": column, f"{sensor}_max": column, f"{sensor}_sum": column})
+        (hours,), reduced = group_reduce([hours], values, self.how)
+        self.hours.append(hours)
+        self.parts.append(reduced)
+
+    def to_table(self):
+        """The file's aggregate rows. Row groups can split an hour, so partials are folded again."""
+        if not self.parts:
+            return None
+        values = {name: np.concatenate([part[name] for part in self.parts]) for name in self.how}
+        (hours,), reduced = group_reduce([np.concatenate(self.hours)], values, self.how)
+        columns = {
+            'source_key': pa.array([self.source_key] * len(hours)),
+            'well': pa.array([well_of(self.source_key)] * len(hours)),
+            'hour': pa.array(hours.astype('datetime64[h]').astype('datetime64[s]')),
+            'records': pa.array(reduced.pop('records').astype(np.int64)),
+            'anomalies': pa.array(reduced.pop('anomalies').astype(np.int64)),
+        }
+        columns.update({name: pa.array(value) for name, value in reduced.items()})
+        return pa.table(columns)
+
+
+def to_parquet_bytes(table):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='zstd')
+    return buffer.getvalue()
+
+
+def read_parquet_object(s3_client, bucket, key):
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    return pq.read_table(io.BytesIO(body))
+
+
+def list_keys(s3_client, bucket, prefix):
+    """Yields (key, etag-or-size/mtime) for every object under prefix."""
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            yield obj['Key'], obj.get('ETag') or f"{obj['Size']}-{obj['LastModified'].timestamp()}"
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def load_manifest(s3_client, bucket, key=MANIFEST_KEY):
+    try:
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except Exception as e:
+        if is_missing(e):
+            return {}
+        raise
+
+
+def fold_objects(s3_client, bucket, prefix, table_key, manifest_key, sort_keys):
+    """
+    Folds new/changed per-file objects under prefix (prefix + source key, with a source_key
+    column) into the table at table_key, sorted by sort_keys. Returns a summary dict.
+    """
+    manifest = load_manifest(s3_client, bucket, manifest_key)
+    current = dict(list_keys(s3_client, bucket, prefix))
+    changed = sorted(key for key, tag in current.items() if manifest.get(key) != tag)
+    removed = sorted(key for key in manifest if key not in current)
+    if not changed and not removed:
+        return {'folded': 0, 'removed': 0, 'rows': None}
+
+    table = None
+    if manifest:
+        table = read_parquet_object(s3_client, bucket, table_key)
+    fresh = [read_parquet_object(s3_client, bucket, key) for key in changed]
+
+    # Replace all rows of re-aggregated or deleted source files, then append the new rows
+    stale = [key[len(prefix):] for key in changed + removed]
+    tables = []
+    if table is not None:
+        tables.append(table.filter(pc.invert(pc.is_in(table.column('source_key'), value_set=pa.array(stale)))))
+    tables.extend(fresh)
+    combined = pa.concat_tables(tables, promote_options='default')
+    combined = combined.sort_by([(key, 'ascending') for key in sort_keys])
+
+    # The table is written before the manifest: a crash in between only means the same
+    # objects are folded again next time, which replaces rather than duplicates rows.
+    s3_client.put_object(Bucket=bucket, Key=table_key, Body=to_parquet_bytes(combined))
+    s3_client.put_object(Bucket=bucket, Key=manifest_key, Body=json.dumps(current).encode('utf-8'),
+                         ContentType='application/json')
+    return {'folded': len(changed), 'removed': len(removed), 'rows': combined.num_rows}
+
+
+def compact(s3_client, bucket):
+    """Folds new/changed aggregate objects into the rollup table. Returns a summary dict."""
+    summary = fold_objects(s3_client, bucket, AGGREGATES_PREFIX, ROLLUP_KEY, MANIFEST_KEY,
+                           ['well', 'hour', 'source_key'])
+    summary['rollup_rows'] = summary.pop('rows')
+    return summary
+
+
+def kpis(rollup):
+    """Dashboard totals from a rollup table: (total records, total anomalies)."""
+    return int(pc.sum(rollup.column('records')).as_py() or 0), int(pc.sum(rollup.column('anomalies')).as_py() or 0)
+
+
+def lambda_handler(event, context):
+    """Scheduled entry point: compacts the curated bucket's aggregates and anomaly events."""
+    import boto3
+    import events
+    s3_client = boto3.client('s3')
+    summary = compact(s3_client, os.environ['CURATED_BUCKET_NAME'])
+    summary['events'] = events.compact(s3_client, os.environ['CURATED_BUCKET_NAME'])
+    print("Rollup compaction: " + json.dumps(summary))
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fold aggregates/ into rollup/rollup.parquet.")
+    parser.add_argument('bucket')
+    parser.add_argument('--local-root', help="Directory holding the bucket as a subdirectory, instead of S3")
+    args = parser.parse_args()
+    client = client_for(args.local_root)
+    print(json.dumps(compact(client, args.bucket)))
@@ -0,0 +1,326 @@
+"""
+Disk-free S3 streams for the inference Lambda.
+
+S3RangeReader is a seekable, read-only file object that fetches byte ranges with GetObject,
+so pyarrow can read the parquet footer and just the column chunks it needs without copying
+the whole object to /tmp. S3MultipartWriter is the write side: it buffers one part at a time
+and ships it with UploadPart, so the output never touches disk either. LocalS3Client stands in
+for the S3 client when the same code runs against a local directory.
+"""
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import metrics
+
+# Objects up to this size are fetched with a single GET; larger ones are read by range.
+SMALL_OBJECT_BYTES = 8 * 1024 * 1024
+# S3 requires every part except the last to be at least 5 MiB.
+PART_SIZE = 8 * 1024 * 1024
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+class S3RangeReader(io.RawIOBase):
+    """Read-only, seekable view of an S3 object backed by ranged GetObject calls."""
+
+    def __init__(self, s3_client, bucket, key, size=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        if size is None:
+            size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.size = size
+        self.position = 0
+        # pyarrow may read from its IO threads, so the fetches are counted here rather than
+        # in the current metrics trace (see app.process_object)
+        self.bytes_read = 0
+        self.fetch_seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or len(buffer) == 0:
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        start = time.perf_counter()
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{end}")
+        data = response['Body'].read()
+        self.fetch_seconds += time.perf_counter() - start
+        self.bytes_read += len(data)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def open_object(s3_client, bucket, key):
+    """Returns a seekable file object for an S3 object without writing it to disk."""
+    with metrics.span('download'):
+        size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        if size <= SMALL_OBJECT_BYTES:
+            # One request is cheaper than the handful of ranged reads a small parquet file needs.
+            body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            metrics.count('bytes_in', len(body))
+            return io.BytesIO(body)
+    return io.BufferedReader(S3RangeReader(s3_client, bucket, key, size=size), buffer_size=READ_BUFFER_SIZE)
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Write-only stream that uploads to S3 in PART_SIZE chunks.
+
+    Use it as a context manager: a clean exit completes the upload, an exception aborts it so
+    no half-written object becomes visible. Outputs smaller than one part are sent with a
+    single PutObject.
+    """
+
+    def __init__(self, s3_client, bucket, key, extra_args=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.extra_args = extra_args or {}
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.bytes_written += len(data)
+        while len(self.buffer) >= PART_SIZE:
+            self._upload_part(bytes(self.buffer[:PART_SIZE]))
+            del self.buffer[:PART_SIZE]
+        return len(data)
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.extra_args)
+            self.upload_id = response['UploadId']
+        part_number = len(self.parts) + 1
+        with metrics.span('upload'):
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data
+            )
+        metrics.count('bytes_out', len(data))
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                with metrics.span('upload'):
+                    self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self.extra_args)
+                metrics.count('bytes_out', len(self.buffer))
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                with metrics.span('upload'):
+                    self.s3_client.complete_multipart_upload(
+                        Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+                    )
+            self.buffer = bytearray()
+        finally:
+            super().close()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self.buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+class LocalS3Client:
+    """
+    The subset of the boto3 S3 client used by the pipeline, backed by a local directory.
+
+    Every bucket is a subdirectory of root, object keys are relative paths, and user metadata
+    is kept in a sidecar directory (.s3meta). It lets the Lambda code path and the batch jobs
+    run against parquet files on disk, e.g. in tests or for a local backfill.
+    """
+
+    META_DIR = '.s3meta'
+
+    def __init__(self, root):
+        self.root = root
+        self._uploads = {}
+        # Worker threads share one client, so upload ids are unique and the table is locked
+        self._uploads_lock = threading.Lock()
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _meta_path(self, bucket, key):
+        return os.path.join(self.root, self.META_DIR, bucket, *key.split('/')) + '.json'
+
+    def _not_found(self, operation, key):
+        from botocore.exceptions import ClientError
+        return ClientError({'Error': {'Code': '404', 'Message': f"Not Found: {key}"}}, operation)
+
+    def _etag(self, path):
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_BUFFER_SIZE), b''):
+                digest.update(block)
+        return f'"{digest.hexdigest()}"'
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self._not_found('HeadObject', Key)
+        metadata = {}
+        if os.path.exists(self._meta_path(Bucket, Key)):
+            with open(self._meta_path(Bucket, Key)) as f:
+                metadata = json.load(f)
+        stat = os.stat(path)
+        return {
+            'ContentLength': stat.st_size, 'ETag': self._etag(path), 'Metadata': metadata,
+            'LastModified': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+        }
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self._not_found('GetObject', Key)
+        with open(path, 'rb') as f:
+            if Range is None:
+                data = f.read()
+            else:
+                start, end = Range[len('bytes='):].split('-')
+                f.seek(int(start))
+                data = f.read(int(end) - int(start) + 1)
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + '.partial'
+        with open(partial, 'wb') as f:
+            f.write(Body if isinstance(Body, (bytes, bytearray)) else Body.read())
+        # Like S3, readers see either the old or the new object, never a partial one
+        os.replace(partial, path)
+        meta_path = self._meta_path(Bucket, Key)
+        if Metadata:
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            with open(meta_path, 'w') as f:
+                json.dump(Metadata, f)
+        elif os.path.exists(meta_path):
+            os.remove(meta_path)
+        return {'ETag': self._etag(path)}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        source = self.get_object(Bucket=CopySource['Bucket'], Key=CopySource['Key'])['Body'].read()
+        metadata = self.head_object(Bucket=CopySource['Bucket'], Key=CopySource['Key'])['Metadata']
+        return {'CopyObjectResult': self.put_object(Bucket=Bucket, Key=Key, Body=source, Metadata=metadata)}
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self._not_found('HeadObject', Key)
+        shutil.copyfile(path, Filename)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        for path in (self._path(Bucket, Key), self._meta_path(Bucket, Key)):
+            if os.path.exists(path):
+                os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        keys = []
+        # Only the directory part of the prefix can hold matching keys
+        for directory, _, names in os.walk(os.path.join(bucket_root, *os.path.dirname(Prefix).split('/'))):
+            for name in names:
+                if name.endswith('.partial'):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), bucket_root).replace(os.sep, '/')
+                if key.startswith(Prefix) and key > (ContinuationToken or StartAfter):
+                    keys.append(key)
+        keys.sort()
+        page = keys[:MaxKeys]
+        response = {'KeyCount': len(page), 'IsTruncated': len(keys) > MaxKeys}
+        if page:
+            response['Contents'] = []
+            for key in page:
+                stat = os.stat(self._path(Bucket, key))
+                response['Contents'].append({
+                    'Key': key, 'Size': stat.st_size,
+                    'LastModified': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+                })
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._uploads_lock:
+            self._uploads[upload_id] = {'parts': {}, 'metadata': Metadata}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        with self._uploads_lock:
+            self._uploads[UploadId]['parts'][PartNumber] = bytes(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self._uploads_lock:
+            upload = self._uploads.pop(UploadId)
+        body = b''.join(upload['parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        return self.put_object(Bucket=Bucket, Key=Key, Body=body, Metadata=upload['metadata'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._uploads_lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+
+def client_for(local_root=None):
+    """
+    The S3 client of the batch jobs' command lines: a LocalS3Client over local_root (a directory
+    holding every bucket as a subdirectory) when --local-root is given, boto3's otherwise.
+    """
+    if local_root:
+        return LocalS3Client(local_root)
+    import boto3
+    return boto3.client('s3')
+
+
+def is_missing(error):
+    """Whether a ClientError (from boto3 or LocalS3Client) says the object does not exist."""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
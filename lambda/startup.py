@@ -0,0 +1,77 @@
+"""
+Startup profiling and lazy imports for the inference container.
+
+Heavy libraries (boto3, pyarrow, numpy, pandas, joblib/sklearn) are imported through
+lazy_import() at the point where they are first needed, and the time each first import took is
+recorded. Together with the model load timings this gives an init-time breakdown that is printed
+once, on the first (cold) invocation of the execution environment.
+"""
+import importlib
+import sys
+import time
+
+# The handler module imports this first, so this is (roughly) the start of the init phase.
+INIT_START = time.perf_counter()
+
+import_timings = {}
+phase_timings = {}
+_reported = False
+
+
+def lazy_import(name):
+    """Imports a module on first use and records how long that first import took."""
+    module = sys.modules.get(name)
+    # A module another worker thread is still importing is already in sys.modules, half
+    # initialized; import_module() waits for that import to finish.
+    if module is not None and not getattr(getattr(module, '__spec__', None), '_initializing', False):
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    # Only the time actually spent here is attributed, so a module already pulled in as a
+    # dependency of an earlier import shows up as (almost) free.
+    import_timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    return module
+
+
+class _ImportBlocker:
+    """Meta path finder that makes `import <name>` fail with ImportError."""
+
+    def __init__(self, names):
+        self.names = tuple(names)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname.split('.')[0] in self.names:
+            raise ImportError(f"{fullname} is disabled in this startup mode")
+        return None
+
+
+def block_imports(*names):
+    """
+    Keeps optional heavy packages out of the process. pyarrow, for example, probes for pandas
+    whenever an array is built from NumPy and would otherwise import all of it; it treats an
+    ImportError as "pandas not installed" and carries on.
+    """
+    sys.meta_path.insert(0, _ImportBlocker(names))
+
+
+def record_phase(name, started_at):
+    """Records a named init phase (e.g. module import, model load) that began at started_at."""
+    phase_timings[name] = round((time.perf_counter() - started_at) * 1000, 1)
+
+
+def report(extra=None):
+    """Returns the startup breakdown once per process, then None, so warm calls cost nothing."""
+    global _reported
+    if _reported:
+        return None
+    _reported = True
+    breakdown = {
+        'cold_start': True,
+        'since_init_ms': round((time.perf_counter() - INIT_START) * 1000, 1),
+        'phases_ms': dict(phase_timings),
+        'imports_ms': dict(sorted(import_timings.items(), key=lambda item: -item[1])),
+        'modules_loaded': len(sys.modules),
+    }
+    if extra:
+        breakdown.update(extra)
+    return breakdown
@@ -0,0 +1,120 @@
+"""
+Local, memory-mapped cache of the preprocessed 3W training set.
+
+Layout under the cache directory:
+
+    files/<file key>.X.npy        cleaned float32 feature block of one source parquet file
+    files/<file key>.y.npy        its int16 class labels
+    datasets/<dataset key>/       X.npy, y.npy and manifest.json for one exact set of files
+
+A file key hashes the source path, size and mtime (plus the feature list and cache format), so
+only new or modified parquet files are re-read and re-cleaned. The dataset key hashes the sorted
+file keys; when it matches, training starts by memory-mapping X.npy/y.npy, which is close to
+instant no matter how large the dataset is.
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+CACHE_FORMAT = 1
+
+
+def parallel_map_ordered(fn, items, workers):
+    """Yields fn(item) in input order with at most 2 * workers items in flight."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def file_key(path, features):
+    stat = os.stat(path)
+    fingerprint = json.dumps([CACHE_FORMAT, os.path.abspath(path), stat.st_size, stat.st_mtime_ns, list(features)])
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+
+def _save_atomic(path, array):
+    partial = path + '.partial.npy'
+    np.save(partial, array)
+    os.replace(partial, path)
+
+
+def load(files, read_file, features, cache_dir, workers=None):
+    """
+    Returns (X, labels, rows_per_file) for `files`, memory-mapped from the cache.
+
+    read_file(path) must return a cleaned (float32 features, labels) pair or None. It is only
+    called for files that are not cached yet (or changed since they were cached).
+    """
+    workers = workers or os.cpu_count() or 1
+    files_dir = os.path.join(cache_dir, 'files')
+    datasets_dir = os.path.join(cache_dir, 'datasets')
+    os.makedirs(files_dir, exist_ok=True)
+    os.makedirs(datasets_dir, exist_ok=True)
+
+    keys = [file_key(path, features) for path in files]
+    dataset_key = hashlib.sha1(json.dumps(sorted(keys)).encode()).hexdigest()
+    dataset_dir = os.path.join(datasets_dir, dataset_key)
+
+    if not os.path.exists(os.path.join(dataset_dir, 'manifest.json')):
+        # 1. Ingest only the files that are new or changed since the last run
+        missing = [(path, key) for path, key in zip(files, keys)
+                   if not os.path.exists(os.path.join(files_dir, f"{key}.y.npy"))]
+        if missing:
+            print(f"Dataset cache: ingesting {len(missing):,} new/changed of {len(files):,} files...")
+
+        def ingest(entry):
+            path, key = entry
+            result = read_file(path)
+            if result is None:
+                # Unusable files are cached as empty so they are not re-read every run
+                result = (np.empty((0, len(features)), dtype=np.float32), np.empty(0, dtype=np.int16))
+            X, labels = result
+            _save_atomic(os.path.join(files_dir, f"{key}.X.npy"), np.asarray(X, dtype=np.float32))
+            _save_atomic(os.path.join(files_dir, f"{key}.y.npy"), np.asarray(labels, dtype=np.int16))
+
+        for _ in parallel_map_ordered(ingest, missing, workers):
+            pass
+
+        # 2. Concatenate the per-file blocks into one memory-mapped matrix, out of core
+        rows = [np.load(os.path.join(files_dir, f"{key}.y.npy"), mmap_mode='r').shape[0] for key in keys]
+        partial_dir = dataset_dir + '.partial'
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+        X = np.lib.format.open_memmap(os.path.join(partial_dir, 'X.npy'), mode='w+', dtype=np.float32, shape=(sum(rows), len(features)))
+        labels = np.lib.format.open_memmap(os.path.join(partial_dir, 'y.npy'), mode='w+', dtype=np.int16, shape=(sum(rows),))
+        offset = 0
+        for key, n in zip(keys, rows):
+            X[offset:offset + n] = np.load(os.path.join(files_dir, f"{key}.X.npy"), mmap_mode='r')
+            labels[offset:offset + n] = np.load(os.path.join(files_dir, f"{key}.y.npy"), mmap_mode='r')
+            offset += n
+        X.flush()
+        labels.flush()
+        del X, labels
+        with open(os.path.join(partial_dir, 'manifest.json'), 'w') as f:
+            json.dump({'files': list(files), 'keys': keys, 'rows': rows, 'features': list(features)}, f)
+        os.replace(partial_dir, dataset_dir)
+
+        # 3. Drop datasets and file blocks that no longer belong to the current file set
+        for entry in os.listdir(datasets_dir):
+            if entry != dataset_key:
+                shutil.rmtree(os.path.join(datasets_dir, entry), ignore_errors=True)
+        live = set(keys)
+        for entry in os.listdir(files_dir):
+            if entry.split('.')[0] not in live:
+                os.remove(os.path.join(files_dir, entry))
+
+    with open(os.path.join(dataset_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    X = np.load(os.path.join(dataset_dir, 'X.npy'), mmap_mode='r')
+    labels = np.load(os.path.join(dataset_dir, 'y.npy'), mmap_mode='r')
+    return X, labels, manifest['rows']
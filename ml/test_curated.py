@@ -0,0 +1,214 @@
+"""
+Tests of the batch jobs that maintain the curated bucket (lambda/rollup.py, lambda/events.py
+and lambda/compaction.py), run against a LocalS3Client over a temporary directory.
+
+Run from the repository root:
+    python -m pytest -q ml
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import compaction  # noqa: E402
+import curated_format  # noqa: E402
+import events  # noqa: E402
+import layout  # noqa: E402
+import listing_index  # noqa: E402
+import rollup  # noqa: E402
+from s3io import LocalS3Client  # noqa: E402
+
+BUCKET = 'curated'
+SENSORS = ['P-PDG', 'T-TPT']
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return LocalS3Client(str(tmp_path))
+
+
+def scored_table(rows, seed, start='2020-01-01'):
+    rng = np.random.default_rng(seed)
+    columns = {sensor: rng.normal(size=rows) for sensor in SENSORS}
+    columns['anomaly_flag'] = (rng.random(rows) < 0.2).astype(np.int64)
+    columns['timestamp'] = pd.date_range(start, periods=rows, freq='s').to_numpy()
+    return pa.table(columns)
+
+
+def write_aggregate(s3, source_key, table):
+    aggregator = rollup.FileAggregator(source_key, SENSORS)
+    aggregator.add(table)
+    s3.put_object(Bucket=BUCKET, Key=rollup.aggregate_key(source_key), Body=rollup.to_parquet_bytes(aggregator.to_table()))
+
+
+def rollup_rows(s3):
+    return rollup.read_parquet_object(s3, BUCKET, rollup.ROLLUP_KEY).to_pandas()
+
+
+def test_rollup_folds_new_aggregates_incrementally(s3):
+    first, second = 'data/1/WELL-00001_20200101000000.parquet', 'data/2/WELL-00002_20200101000000.parquet'
+    write_aggregate(s3, first, scored_table(7200, 1))
+    assert rollup.compact(s3, BUCKET) == {'folded': 1, 'removed': 0, 'rollup_rows': 2}
+
+    write_aggregate(s3, second, scored_table(3600, 2))
+    assert rollup.compact(s3, BUCKET) == {'folded': 1, 'removed': 0, 'rollup_rows': 3}
+    assert rollup.compact(s3, BUCKET)['folded'] == 0
+
+    rows = rollup_rows(s3)
+    assert rows.groupby('source_key')['records'].sum().to_dict() == {first: 7200, second: 3600}
+
+
+def test_rescored_file_replaces_its_rows(s3):
+    key = 'data/1/WELL-00001_20200101000000.parquet'
+    other = 'data/2/WELL-00002_20200101000000.parquet'
+    write_aggregate(s3, key, scored_table(7200, 1))
+    write_aggregate(s3, other, scored_table(3600, 2))
+    rollup.compact(s3, BUCKET)
+
+    # Scored again (a new model): one hour now, with other anomaly counts
+    rescored = scored_table(3600, 3, start='2020-01-01 05:00')
+    write_aggregate(s3, key, rescored)
+    assert rollup.compact(s3, BUCKET) == {'folded': 1, 'removed': 0, 'rollup_rows': 2}
+
+    rows = rollup_rows(s3)
+    mine = rows[rows['source_key'] == key]
+    assert len(mine) == 1 and mine['hour'].iloc[0] == pd.Timestamp('2020-01-01 05:00')
+    assert mine['records'].sum() == 3600
+    assert mine['anomalies'].sum() == int(np.sum(rescored.column('anomaly_flag').to_numpy()))
+    assert rollup.kpis(pa.Table.from_pandas(rows)) == (7200, int(rows['anomalies'].sum()))
+
+
+def test_deleted_aggregate_drops_its_rows(s3):
+    key = 'data/1/WELL-00001_20200101000000.parquet'
+    write_aggregate(s3, key, scored_table(3600, 1))
+    write_aggregate(s3, 'data/2/WELL-00002_20200101000000.parquet', scored_table(3600, 2))
+    rollup.compact(s3, BUCKET)
+
+    s3.delete_object(Bucket=BUCKET, Key=rollup.aggregate_key(key))
+    assert rollup.compact(s3, BUCKET) == {'folded': 0, 'removed': 1, 'rollup_rows': 1}
+    assert key not in set(rollup_rows(s3)['source_key'])
+
+
+def test_events_do_not_depend_on_row_group_boundaries():
+    table = scored_table(5000, 4)
+    flags = np.zeros(5000, dtype=np.int64)
+    flags[[10, 40, 200, 1999, 2000, 2030, 4999]] = 1  # 40 -> 200 is past the gap, 1999 -> 2030 is not
+    table = table.set_column(table.column_names.index('anomaly_flag'), 'anomaly_flag', pa.array(flags))
+
+    whole = events.EventBuilder('data/0/WELL-00001_20200101000000.parquet', SENSORS, max_gap_seconds=60)
+    whole.add(table)
+    split = events.EventBuilder('data/0/WELL-00001_20200101000000.parquet', SENSORS, max_gap_seconds=60)
+    for offset in range(0, 5000, 1000):
+        split.add(table.slice(offset, 1000))
+    assert split.to_table().equals(whole.to_table())
+    assert whole.to_table().column('anomalies').to_pylist() == [2, 1, 3, 1]
+    assert whole.to_table().column('rows').to_pylist() == [31, 1, 32, 1]
+
+
+def test_default_encoding_keeps_the_sensor_stream_schema():
+    table = scored_table(100, 5)
+    encoded = curated_format.CuratedEncoding().encode(table)
+    assert encoded.schema.field('anomaly_flag').type == pa.int64()
+    assert all(encoded.schema.field(sensor).type == pa.float64() for sensor in SENSORS)
+    assert curated_format.CuratedEncoding(flag_type='uint8').encode(table).schema.field('anomaly_flag').type == pa.uint8()
+
+
+def write_partitioned(s3, source_key, table):
+    output_key = lambda key: compaction.output_key(s3, BUCKET, key)
+    with layout.PartitionedSink(s3, BUCKET, source_key, output_key=output_key) as sink:
+        sink.write_table(table)
+    return sink.keys
+
+
+def curated_rows(s3):
+    """What a plain reader of data/ sees: source file -> rows."""
+    keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix=layout.CURATED_PREFIX).get('Contents', [])]
+    rows = {}
+    for key in keys:
+        if key.endswith('.parquet'):
+            table = rollup.read_parquet_object(s3, BUCKET, key)
+            sources = table.column('source_file').to_pylist() if 'source_file' in table.column_names else [key] * table.num_rows
+            for source in sources:
+                rows[source] = rows.get(source, 0) + 1
+    return rows
+
+
+@pytest.fixture
+def small_files(s3, monkeypatch):
+    monkeypatch.setattr(compaction, 'MIN_AGE_SECONDS', 0)
+    keys = []
+    for i in range(3):
+        keys += write_partitioned(s3, f'data/0/WELL-00001_2020010{i + 1}000000.parquet',
+                                  scored_table(500, i, start=f'2020-01-01 {i:02d}:00'))
+    return keys
+
+
+def test_compaction_merges_small_files(s3, small_files):
+    before = curated_rows(s3)
+    assert compaction.compact(s3, BUCKET) == {'partitions': 1, 'merged_files': 1}
+    assert curated_rows(s3) == before
+    assert [os.path.basename(key).startswith(compaction.MERGED_PREFIX) for key in compaction.live_files(s3, BUCKET)] == [True]
+    assert [entry['key'] for entry in listing_index.iter_entries(s3, BUCKET)] == compaction.live_files(s3, BUCKET)
+    assert s3.list_objects_v2(Bucket=BUCKET, Prefix=compaction.STAGING_PREFIX)['KeyCount'] == 0
+
+
+def test_run_that_died_after_staging_is_finished(s3, small_files, monkeypatch):
+    before = curated_rows(s3)
+
+    def crash(*args):
+        raise RuntimeError('killed')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(compaction, 'publish', crash)
+        with pytest.raises(RuntimeError):
+            compaction.compact(s3, BUCKET)
+    # The merged object is only staged: readers of data/ still see the inputs alone
+    assert curated_rows(s3) == before and sorted(compaction.live_files(s3, BUCKET)) == sorted(small_files)
+
+    assert compaction.compact(s3, BUCKET)['merged_files'] == 1
+    assert curated_rows(s3) == before and len(compaction.live_files(s3, BUCKET)) == 1
+    partition = small_files[0].rpartition('/')[0] + '/'
+    journal = compaction.load_journal(s3, BUCKET, partition)
+    assert [entry['state'] for entry in journal.values()] == ['done']
+    assert s3.list_objects_v2(Bucket=BUCKET, Prefix=compaction.STAGING_PREFIX)['KeyCount'] == 0
+
+
+def test_run_that_died_before_staging_is_dropped(s3, small_files, monkeypatch):
+    before = curated_rows(s3)
+
+    def crash(*args):
+        raise RuntimeError('killed')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(compaction, 'write_merged', crash)
+        with pytest.raises(RuntimeError):
+            compaction.compact(s3, BUCKET)
+    assert sorted(compaction.live_files(s3, BUCKET)) == sorted(small_files)
+
+    # The pending entry is dropped and the inputs are merged again
+    assert compaction.compact(s3, BUCKET)['merged_files'] == 1
+    assert curated_rows(s3) == before and len(compaction.live_files(s3, BUCKET)) == 1
+    partition = small_files[0].rpartition('/')[0] + '/'
+    assert len(compaction.load_journal(s3, BUCKET, partition)) == 1
+
+
+def test_file_scored_again_after_compaction_replaces_its_rows(s3, small_files):
+    compaction.compact(s3, BUCKET)
+    merged = compaction.live_files(s3, BUCKET)
+    source = small_files[1]
+
+    # The new rows wait outside data/, so readers never see them next to the old ones
+    rescored = write_partitioned(s3, 'data/0/' + os.path.basename(source), scored_table(200, 9, start='2020-01-01 01:00'))
+    assert rescored == [compaction.STAGING_PREFIX + source]
+    assert compaction.live_files(s3, BUCKET) == merged and curated_rows(s3)[source] == 500
+
+    assert compaction.compact(s3, BUCKET)['merged_files'] == 1
+    rows = curated_rows(s3)
+    assert rows == {small_files[0]: 500, source: 200, small_files[2]: 500}
+    assert len(compaction.live_files(s3, BUCKET)) == 1 and compaction.live_files(s3, BUCKET) != merged
+    assert s3.list_objects_v2(Bucket=BUCKET, Prefix=compaction.STAGING_PREFIX)['KeyCount'] == 0
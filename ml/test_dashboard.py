@@ -0,0 +1,127 @@
+"""
+Tests of the dashboard modules that do not need streamlit (dashboard/*.py), against the
+Lambda modules that write what they read.
+
+Run from the repository root:
+    python -m pytest -q ml
+"""
+import inspect
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'lambda'))
+sys.path.insert(0, os.path.join(ROOT, 'dashboard'))
+
+import curated_index  # noqa: E402
+import downsample  # noqa: E402
+import event_index  # noqa: E402
+import listing_index  # noqa: E402
+from s3io import LocalS3Client  # noqa: E402
+
+BUCKET = 'curated'
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return LocalS3Client(str(tmp_path))
+
+
+@pytest.mark.parametrize('vendored, original', [
+    (curated_index.parse_index_key, listing_index.parse_index_key),
+    (curated_index.recent, listing_index.recent),
+    (curated_index.LocalListing._path, LocalS3Client._path),
+    (curated_index.LocalListing.list_objects_v2, LocalS3Client.list_objects_v2),
+])
+def test_vendored_code_is_identical_to_the_lambda_original(vendored, original):
+    assert inspect.getsource(vendored) == inspect.getsource(original)
+
+
+def test_vendored_constants_match():
+    assert (curated_index.INDEX_PREFIX, curated_index.INVERTED_BASE) == (listing_index.INDEX_PREFIX, listing_index.INVERTED_BASE)
+
+
+def test_index_pages_newest_first(s3, tmp_path):
+    for i in range(5):
+        key = f'data/0/WELL-00001_2020010{i + 1}000000.parquet'
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b'parquet')
+        listing_index.append(s3, BUCKET, key, rows=100 + i, size=7, written_ms=1_600_000_000_000 + i)
+
+    listing = curated_index.LocalListing(str(tmp_path))
+    first, cursor = curated_index.recent(listing, BUCKET, limit=3)
+    older, end = curated_index.recent(listing, BUCKET, limit=3, cursor=cursor)
+    assert [entry['rows'] for entry in first + older] == [104, 103, 102, 101, 100]
+    assert end is None
+    by_listing = curated_index.recent_by_listing(listing, BUCKET, limit=10)
+    assert sorted(entry['key'] for entry in by_listing) == sorted(entry['key'] for entry in first + older)
+
+
+def test_downsample_keeps_every_anomaly():
+    rng = np.random.default_rng(0)
+    n = 200_000
+    x = np.arange('2020-01-01T00:00:00', n, dtype='datetime64[s]')
+    y = np.cumsum(rng.normal(size=n))
+    anomalies = (rng.random(n) < 0.002).astype(np.uint8)
+
+    keep = downsample.downsample(x, y, anomalies)
+    assert set(np.flatnonzero(anomalies)) <= set(keep)
+    assert len(keep) <= downsample.MAX_POINTS + anomalies.sum()
+    assert keep[0] == 0 and keep[-1] == n - 1 and np.all(np.diff(keep) > 0)
+
+
+def test_lttb_keeps_spikes_and_short_series():
+    y = np.zeros(10_000)
+    y[1234], y[8765] = 50.0, -50.0
+    keep = downsample.lttb(np.arange(len(y)), y, 100)
+    assert len(keep) == 100 and {1234, 8765} <= set(keep)
+    assert list(downsample.lttb(np.arange(5), np.ones(5), 100)) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('curated_key, source_key', [
+    ('data/3/WELL-00001_20200101000000.parquet', 'data/3/WELL-00001_20200101000000.parquet'),
+    ('data/well=WELL-00001/date=2020-01-01/class=3/WELL-00001_20200101000000.parquet',
+     'data/3/WELL-00001_20200101000000.parquet'),
+    ('data/well=WELL-00001/date=2020-01-01/class=3/part-0123.parquet', None),
+])
+def test_curated_keys_map_back_to_their_raw_source(curated_key, source_key):
+    assert downsample.source_key(curated_key) == source_key
+    assert downsample.overview_key(curated_key) == (source_key and downsample.OVERVIEWS_PREFIX + source_key)
+
+
+@pytest.fixture
+def events():
+    rng = np.random.default_rng(0)
+    n = 2_000
+    start = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 30 * 86400, n), unit='s')
+    # Mostly short events and a few long ones, so the longest event widens every search
+    duration = pd.to_timedelta(np.where(rng.random(n) < 0.01, rng.integers(0, 5 * 86400, n), rng.integers(0, 3600, n)), unit='s')
+    wells = rng.choice(['WELL-00001', 'WELL-00002', 'SIMULATED_00003'], n)
+    return pd.DataFrame({'well': wells, 'start': start, 'end': start + duration, 'rows': np.arange(n)})
+
+
+def test_overlapping_matches_a_full_scan(events):
+    index = event_index.EventIndex(events)
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        a = pd.Timestamp('2019-12-30') + pd.Timedelta(seconds=int(rng.integers(0, 35 * 86400)))
+        b = a + pd.Timedelta(seconds=int(rng.integers(0, 2 * 86400)))
+        well = rng.choice([None, 'WELL-00001', 'SIMULATED_00003'])
+        expected = events[(events['start'] <= b) & (events['end'] >= a) & ((events['well'] == well) if well else True)]
+        assert sorted(index.overlapping(a, b, well)['rows']) == sorted(expected['rows'])
+
+
+def test_overlapping_open_ended_and_unknown_well(events):
+    index = event_index.EventIndex(events)
+    middle = pd.Timestamp('2020-01-15')
+    assert len(index.overlapping()) == len(events)
+    assert sorted(index.overlapping(start=middle)['rows']) == sorted(events.loc[events['end'] >= middle, 'rows'])
+    assert sorted(index.overlapping(end=middle)['rows']) == sorted(events.loc[events['start'] <= middle, 'rows'])
+    assert index.overlapping(well='WELL-99999').empty
+    assert event_index.EventIndex(events.iloc[:0]).overlapping(middle, middle).empty
+    # Touching an event at either end counts as overlapping it
+    first = index.events.iloc[0]
+    assert first['rows'] in set(index.overlapping(first['end'], first['end'] + pd.Timedelta('1h'))['rows'])
@@ -0,0 +1,262 @@
+"""
+Tests of the inference path: the Lambda handler (lambda/app.py) against a LocalS3Client standing
+in for S3, the compiled forest engine (lambda/forest.py) against scikit-learn, and the rolling window
+features (lambda/rolling.py) in stream and batch mode against pandas.
+
+Run from the repository root:
+    python -m pytest -q ml
+"""
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('RAW_BUCKET_NAME', 'raw')
+os.environ.setdefault('CURATED_BUCKET_NAME', 'curated')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import app  # noqa: E402
+from s3io import LocalS3Client  # noqa: E402
+
+FEATURES = ['P-PDG', 'P-TPT', 'T-TPT', 'P-MON-CKP', 'T-JUS-CKP']
+
+
+class RecordingS3(LocalS3Client):
+    """A LocalS3Client that remembers every object written."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.puts = []
+
+    def put_object(self, Bucket, Key, **kwargs):
+        self.puts.append((Bucket, Key))
+        return super().put_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    def exists(self, bucket, key):
+        return os.path.isfile(self._path(bucket, key))
+
+    def read(self, bucket, key):
+        return self.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def etag(self, bucket, key):
+        return self.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+
+
+def sensor_frame(rows, seed):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame(rng.normal(size=(rows, len(FEATURES))), columns=FEATURES)
+    frame['class'] = (rng.random(rows) < 0.3).astype(int)
+    frame.index = pd.date_range('2020-01-01', periods=rows, freq='s', name='timestamp')
+    return frame
+
+
+def parquet_bytes(frame):
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+
+    client = RecordingS3(str(tmp_path / 's3'))
+    frame = sensor_frame(500, 0)
+    model = RandomForestClassifier(n_estimators=5, max_depth=3, random_state=0).fit(frame[FEATURES], frame['class'])
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    client.put_object(Bucket='raw', Key=app.MODEL_KEY, Body=buffer.getvalue())
+    monkeypatch.setattr(app, '_s3_client', client)
+    monkeypatch.setattr(app, 'MODEL_CACHE_DIR', str(tmp_path / 'model-cache'))
+    monkeypatch.setattr(app, 'global_model', None)
+    return client
+
+
+def sqs_event(s3, keys, message_ids=None):
+    records = []
+    for i, key in enumerate(keys):
+        notification = {'Records': [{'s3': {'bucket': {'name': 'raw'},
+                                            'object': {'key': key, 'eTag': s3.etag('raw', key)}}}]}
+        record = {'body': json.dumps(notification)}
+        if message_ids is None or message_ids[i] is not None:
+            record['messageId'] = message_ids[i] if message_ids else f"m{i}"
+        records.append(record)
+    return {'Records': records}
+
+
+def test_failed_objects_are_reported_without_failing_the_batch(s3):
+    keys = ['data/1/WELL-00001_20170201010207.parquet', 'data/4/bad.parquet', 'data/2/SIMULATED_00001.parquet']
+    s3.put_object(Bucket='raw', Key=keys[0], Body=parquet_bytes(sensor_frame(200, 1)))
+    s3.put_object(Bucket='raw', Key=keys[1], Body=b'not parquet')
+    s3.put_object(Bucket='raw', Key=keys[2], Body=parquet_bytes(sensor_frame(200, 2)))
+
+    response = app.lambda_handler(sqs_event(s3, keys), None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    assert s3.exists('curated', keys[0]) and s3.exists('curated', keys[2])
+    assert not s3.exists('curated', keys[1])
+    assert not s3.exists('curated', app.marker_key('raw', keys[1]))
+
+
+def test_failure_without_message_id_fails_the_whole_batch(s3):
+    s3.put_object(Bucket='raw', Key='data/4/bad.parquet', Body=b'not parquet')
+    with pytest.raises(Exception):
+        app.lambda_handler(sqs_event(s3, ['data/4/bad.parquet'], message_ids=[None]), None)
+
+
+def test_redelivered_message_is_not_scored_again(s3):
+    key = 'data/1/WELL-00001_20170201010207.parquet'
+    s3.put_object(Bucket='raw', Key=key, Body=parquet_bytes(sensor_frame(200, 1)))
+    event = sqs_event(s3, [key])
+
+    assert app.lambda_handler(event, None) == {'batchItemFailures': []}
+    writes = s3.puts.count(('curated', key))
+    assert writes == 1
+    marker = json.loads(s3.read('curated', app.marker_key('raw', key)))
+    assert key in marker['outputs']
+
+    # The same notification again (SQS at-least-once delivery): nothing is rewritten
+    assert app.lambda_handler(event, None) == {'batchItemFailures': []}
+    assert s3.puts.count(('curated', key)) == writes
+
+    # A new version of the object is scored again
+    s3.put_object(Bucket='raw', Key=key, Body=parquet_bytes(sensor_frame(300, 3)))
+    assert app.lambda_handler(sqs_event(s3, [key]), None) == {'batchItemFailures': []}
+    assert s3.puts.count(('curated', key)) == writes + 1
+
+
+@pytest.mark.parametrize('n_classes', [2, 4])
+def test_compiled_forest_matches_sklearn(n_classes):
+    from sklearn.ensemble import RandomForestClassifier
+    from forest import CompiledForest
+
+    rng = np.random.default_rng(n_classes)
+    X = pd.DataFrame(rng.normal(size=(3000, len(FEATURES))) * 1e5, columns=FEATURES)
+    y = rng.integers(0, n_classes, size=len(X))
+    model = RandomForestClassifier(n_estimators=15, max_depth=8, random_state=0).fit(X, y)
+    compiled = CompiledForest.from_sklearn(model)
+
+    # Unseen rows, more than one block so the threaded path runs too
+    X_new = pd.DataFrame(rng.normal(size=(40000, len(FEATURES))) * 1e5, columns=FEATURES)
+    np.testing.assert_array_equal(compiled.predict_proba(X_new), model.predict_proba(X_new))
+    np.testing.assert_array_equal(compiled.predict(X_new, n_jobs=1), model.predict(X_new))
+
+
+def test_compiled_forest_routes_missing_values_like_sklearn():
+    from sklearn.ensemble import RandomForestClassifier
+    from forest import CompiledForest
+
+    rng = np.random.default_rng(7)
+    X = rng.normal(size=(2000, len(FEATURES)))
+    X[rng.random(X.shape) < 0.1] = np.nan
+    y = (np.nan_to_num(X[:, 0]) > 0).astype(int)
+    model = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0).fit(X, y)
+    np.testing.assert_array_equal(CompiledForest.from_sklearn(model).predict_proba(X), model.predict_proba(X))
+
+
+def test_compiled_forest_survives_a_save_and_load(tmp_path):
+    from sklearn.ensemble import RandomForestClassifier
+    from forest import CompiledForest
+
+    frame = sensor_frame(1000, 5)
+    model = RandomForestClassifier(n_estimators=5, max_depth=5, random_state=0).fit(frame[FEATURES], frame['class'])
+    path = str(tmp_path / 'model.forest.npz')
+    CompiledForest.from_sklearn(model).save(path)
+    loaded = CompiledForest.load(path)
+
+    assert list(loaded.feature_names_in_) == FEATURES
+    # Columns are taken by name, so a frame in another order gives the same result
+    shuffled = frame[FEATURES[::-1]]
+    np.testing.assert_array_equal(loaded.predict(shuffled), model.predict(frame[FEATURES]))
+
+
+def noisy_series(rows, seed, nan_rate=0.05):
+    rng = np.random.default_rng(seed)
+    values = np.cumsum(rng.normal(size=rows)) + 1e5
+    values[rng.random(rows) < nan_rate] = np.nan
+    return values
+
+
+def test_rolling_stream_matches_batch_bit_for_bit():
+    import rolling
+
+    names = ['a'] + rolling.rolling_feature_names(['a', 'b'], [30, 120])
+    columns = {'a': noisy_series(5000, 1), 'b': noisy_series(5000, 2, nan_rate=0.3)}
+    batch = rolling.compute(names, columns)
+
+    state = rolling.RollingFeatures(names)
+    bounds = [0, 1, 7, 119, 120, 121, 1000, 2345, 5000]
+    chunks = [state.transform({name: values[a:b] for name, values in columns.items()}) for a, b in zip(bounds, bounds[1:])]
+    for i, name in enumerate(names):
+        np.testing.assert_array_equal(np.concatenate([chunk[i] for chunk in chunks]), batch[i], err_msg=name)
+
+
+@pytest.mark.parametrize('window', [30, 120])
+def test_rolling_features_skip_missing_samples_like_pandas(window):
+    import rolling
+
+    values = noisy_series(3000, window)
+    names = [rolling.feature_name('a', stat, window) for stat in rolling.STATS]
+    mean, std, slope, delta = rolling.compute(names, {'a': values})
+
+    series = pd.Series(values)
+    min_periods = max(2, int(np.ceil(rolling.MIN_FINITE_FRACTION * window)))
+    expected_mean = series.rolling(window, min_periods=min_periods).mean().to_numpy().copy()
+    expected_std = series.rolling(window, min_periods=min_periods).std(ddof=0).to_numpy().copy()
+    # The first window - 1 samples of the well have no complete window
+    expected_mean[:window - 1] = expected_std[:window - 1] = np.nan
+    np.testing.assert_allclose(mean, expected_mean, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(std, expected_std, rtol=1e-6, atol=1e-9)
+
+    # One NaN sample no longer wipes out the windows around it
+    assert np.isfinite(mean[window - 1:]).mean() > 0.99
+    for end in (window - 1, 1000, 2999):
+        window_values = values[end - window + 1:end + 1]
+        finite = np.isfinite(window_values)
+        expected_slope = np.polyfit(np.arange(window)[finite], window_values[finite], 1)[0]
+        assert slope[end] == pytest.approx(expected_slope, rel=1e-6, abs=1e-9)
+        assert delta[end] == window_values[finite][-1] - window_values[finite][0]
+
+
+def test_sparse_rolling_windows_are_missing():
+    import rolling
+
+    values = np.arange(100, dtype=np.float64)
+    values[40:80] = np.nan
+    mean, = rolling.compute(['a:mean10'], {'a': values})
+    assert np.isnan(mean[:9]).all() and np.isfinite(mean[9:44]).all()
+    assert np.isnan(mean[45:80]).all() and np.isfinite(mean[84:]).all()
+
+
+def test_consecutive_files_of_a_well_are_scored_in_order(s3, monkeypatch):
+    import joblib
+    import pyarrow.parquet as pq
+    import rolling
+    from sklearn.ensemble import RandomForestClassifier
+
+    names = FEATURES + rolling.rolling_feature_names(FEATURES, [30])
+    train = sensor_frame(600, 0)
+    X = pd.DataFrame(dict(zip(names, rolling.compute(names, {name: train[name].to_numpy() for name in FEATURES})))).dropna()
+    model = RandomForestClassifier(n_estimators=3, max_depth=3, random_state=0).fit(X, train['class'].iloc[-len(X):])
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    s3.put_object(Bucket='raw', Key=app.MODEL_KEY, Body=buffer.getvalue())
+    monkeypatch.setattr(app, '_rolling_states', {})
+    monkeypatch.setattr(app, 'MAX_WORKERS', 4)
+
+    series = sensor_frame(400, 9)
+    keys = ['data/0/WELL-00007_20200101000000.parquet', 'data/0/WELL-00007_20200101000320.parquet']
+    s3.put_object(Bucket='raw', Key=keys[0], Body=parquet_bytes(series.iloc[:200]))
+    s3.put_object(Bucket='raw', Key=keys[1], Body=parquet_bytes(series.iloc[200:]))
+
+    # The later file first: the batch is still scored in time order, so the second file
+    # continues the windows of the first instead of starting over
+    assert app.lambda_handler(sqs_event(s3, keys[::-1]), None) == {'batchItemFailures': []}
+    rows = [pq.ParquetFile(io.BytesIO(s3.read('curated', key))).metadata.num_rows for key in keys]
+    assert rows == [200 - 29, 200]
@@ -4,44 +4,117 @@ import kagglehub
 from sklearn.ensemble import RandomForestClassifier
 import joblib
 import os
+import sys
+import time
+import argparse
 import glob
+import zlib
+import pyarrow.parquet as pq
 
-# Focus on key pressure and temperature sensors
-FEATURES = ["P-PDG", "P-TPT", "T-TPT", "P-MON-CKP", "T-JUS-CKP"]
+# The compiled inference engine and the shared feature preparation live next to the Lambda handler
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+from forest import CompiledForest
+from features import FEATURES, prepare_features, binary_labels
+import rolling
+import dataset_cache
 
-def load_data(sample_frac: float = 1.0):
+# Cleaned, memory-mapped copy of the dataset (see dataset_cache.py). Set to "" to disable.
+DATASET_CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dataset_cache"))
+
+def sample_mask(file: str, n: int, sample_frac: float, seed: int = 42):
+    """Bernoulli sample over the n cleaned rows of a file, seeded by the file name so runs are reproducible."""
+    rng = np.random.default_rng([seed, zlib.crc32(os.path.basename(file).encode())])
+    return rng.random(n) < sample_frac
+
+def read_training_file(file: str, sample_frac: float = 1.0, seed: int = 42, features: list = FEATURES):
     """
-    Downloads the 3W dataset using kagglehub, extracts relevant features, and loads ALL valid simulated records for training.
+    Reads one 3W parquet file into a cleaned float32 feature block and its class labels.
+
+    Only the sensors behind `features` + ["class"] are decoded. Rolling-window features (see
+    rolling.py) are computed over the file's whole series, then everything is cleaned by
+    features.prepare_features, the same code the Lambda runs before scoring, so nothing bigger
+    than this single file is ever materialized. Returns None for unusable files.
+    """
+    try:
+        table = pq.read_table(file, columns=rolling.base_features(features) + ["class"])
+    except Exception:
+        # Files without a "class" column (or unreadable ones) cannot supervise the model
+        return None
+
+    labels = table.column("class").to_numpy()
+
+    # FIX: Remove infinity and clip extreme values so the ML model doesnt crash
+    columns = rolling.compute(features, {name: table.column(name).to_numpy() for name in rolling.base_features(features)})
+    X, valid = prepare_features(columns, labels)
+    del table
+    labels = labels[valid].astype(np.int16)
+    if sample_frac < 1.0:
+        # Sampling happens after cleaning so it picks the same rows as the dataset cache path
+        keep = sample_mask(file, len(labels), sample_frac, seed)
+        X, labels = X[keep], labels[keep]
+    return X, labels
+
+def load_arrays(sample_frac: float = 1.0, data_dir: str = None, workers: int = None, cache_dir: str = DATASET_CACHE_DIR,
+                features: list = FEATURES):
+    """
+    Downloads the 3W dataset using kagglehub and returns the cleaned (X, labels) arrays.
+
+    With a cache_dir (the default) the cleaned matrix comes from the local dataset cache and is
+    memory-mapped, so only new or changed parquet files are parsed. Without one, files are read
+    in parallel (pyarrow and NumPy release the GIL, so threads are enough) and each cleaned block
+    is copied straight into one preallocated float32 matrix.
     """
-    print("Downloading/Locating 3W dataset using kagglehub...")
-    data_dir = kagglehub.dataset_download("afrniomelo/3w-dataset")
+    if data_dir is None:
+        print("Downloading/Locating 3W dataset using kagglehub...")
+        data_dir = kagglehub.dataset_download("afrniomelo/3w-dataset")
     print(f"Loading files from {data_dir}...")
     
     # Find all simulated parquet files in subdirectories
-    files = glob.glob(os.path.join(data_dir, "**", "*.parquet"), recursive=True)
-    
-    dfs = []
-    # Load all 50M+ rows across all files
-    for file in files:
-        try:
-            df = pd.read_parquet(file)
-            # We must keep the "class" column so we can use it to supervise the model
-            if "class" in df.columns:
-                df = df.dropna(subset=FEATURES + ["class"])
-                # FIX: Remove infinity and clip extreme values so the ML model doesnt crash
-                df = df.replace([np.inf, -np.inf], np.nan).dropna(subset=FEATURES)
-                df[FEATURES] = df[FEATURES].clip(lower=-1e30, upper=1e30)
-                dfs.append(df)
-        except Exception as e:
-            pass
+    files = sorted(glob.glob(os.path.join(data_dir, "**", "*.parquet"), recursive=True))
+    workers = workers or os.cpu_count() or 1
+
+    if cache_dir:
+        X, labels, rows = dataset_cache.load(files, lambda file: read_training_file(file, features=features), features, cache_dir, workers)
+        if sample_frac < 1.0:
+            keep = np.concatenate([sample_mask(file, n, sample_frac) for file, n in zip(files, rows)] or [np.zeros(0, dtype=bool)])
+            X, labels = X[keep], labels[keep]
+        filled = len(labels)
+    else:
+        # The parquet footers give an upper bound for the row count without reading any data
+        total_rows = sum(pq.ParquetFile(file).metadata.num_rows for file in files)
+        capacity = total_rows if sample_frac >= 1.0 else int(total_rows * sample_frac * 1.05) + 1024
+        X = np.empty((capacity, len(features)), dtype=np.float32)
+        labels = np.empty(capacity, dtype=np.int16)
+        filled = 0
+
+        # Load all 50M+ rows across all files. Results are consumed in file order (deterministic
+        # row order) with at most 2 * workers files in flight to bound memory.
+        for result in dataset_cache.parallel_map_ordered(lambda file: read_training_file(file, sample_frac, features=features), files, workers):
+            if result is None:
+                continue
+            block, block_labels = result
+            if filled + len(block) > capacity:
+                capacity = max(capacity * 2, filled + len(block))
+                X = np.resize(X, (capacity, len(features)))
+                labels = np.resize(labels, capacity)
+            X[filled:filled + len(block)] = block
+            labels[filled:filled + len(block)] = block_labels
+            filled += len(block)
             
-    if not dfs:
+    if filled == 0:
         raise ValueError("No data loaded. Check data path.")
-        
-    combined_df = pd.concat(dfs)
-    
-    # The user explicitly requested ALL data, no row cap
-    sampled_df = combined_df.sample(frac=sample_frac, random_state=42)
+    return X[:filled], labels[:filled]
+
+def load_data(sample_frac: float = 1.0, data_dir: str = None, workers: int = None, cache_dir: str = DATASET_CACHE_DIR,
+              features: list = FEATURES):
+    """
+    Downloads the 3W dataset using kagglehub, extracts relevant features, and loads ALL valid simulated records for training.
+    """
+    X, labels = load_arrays(sample_frac, data_dir, workers, cache_dir, features)
+
+    # Views, not copies: the DataFrame is backed by the preallocated (or memory-mapped) matrix
+    sampled_df = pd.DataFrame(X, columns=features, copy=False)
+    sampled_df["class"] = labels
         
     print(f"Total valid samples loaded: {len(sampled_df):,}")
     
@@ -60,8 +133,8 @@ def train_model(df: pd.DataFrame, model_path: str):
         raise ValueError("Cannot train Random Forest: missing ground truth ""class"" column.")
         
     # Create the binary target variable
-    y = [1 if c > 0 else 0 for c in df["class"]]
-    X = df[FEATURES]
+    y = binary_labels(df["class"].to_numpy())
+    X = df.drop(columns="class")
     
     # 70:30 Split
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.30, random_state=42, stratify=y)
@@ -84,21 +157,137 @@ def train_model(df: pd.DataFrame, model_path: str):
     y_pred = model.predict(X_test)
     print(classification_report(y_test, y_pred, target_names=["Normal (0)", "Anomaly (1)"]))
     
-    # Save the model
-    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    save_model(model, model_path)
+    return model
+
+def save_model(model: RandomForestClassifier, model_path: str):
+    """Saves the joblib model and the flat-array version for the Lambda's compiled inference engine."""
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
     joblib.dump(model, model_path)
     print(f"\nModel saved successfully to {model_path}")
 
+    compiled_path = os.path.splitext(model_path)[0] + ".forest.npz"
+    CompiledForest.from_sklearn(model).save(compiled_path)
+    print(f"Compiled model saved successfully to {compiled_path}")
+
+# Rows are shuffled into chunks in blocks of this size, so each chunk samples every part of the
+# (file-ordered) dataset while still reading the memory-mapped matrix sequentially.
+CHUNK_BLOCK_ROWS = 4096
+
+def chunk_plan(n_rows: int, chunk_rows: int, seed: int = 42):
+    """Assigns shuffled row blocks to chunks of about chunk_rows rows."""
+    n_blocks = -(-n_rows // CHUNK_BLOCK_ROWS)
+    blocks_per_chunk = max(1, chunk_rows // CHUNK_BLOCK_ROWS)
+    order = np.random.default_rng(seed).permutation(n_blocks)
+    return [np.sort(order[i:i + blocks_per_chunk]) for i in range(0, n_blocks, blocks_per_chunk)]
+
+def read_chunk(X: np.ndarray, labels: np.ndarray, blocks: np.ndarray):
+    """Copies one chunk's blocks out of the (memory-mapped) arrays with the binary target."""
+    slices = [slice(b * CHUNK_BLOCK_ROWS, (b + 1) * CHUNK_BLOCK_ROWS) for b in blocks]
+    X_chunk = np.concatenate([X[s] for s in slices])
+    y_chunk = binary_labels(np.concatenate([labels[s] for s in slices]))
+    return X_chunk, y_chunk
+
+def chunk_split(y: np.ndarray, test_size: float = 0.30, seed: int = 42):
+    """Stratified split of one chunk: test_size of every class goes to the test set."""
+    rng = np.random.default_rng(seed)
+    test = np.zeros(len(y), dtype=bool)
+    for cls in np.unique(y):
+        rows = np.flatnonzero(y == cls)
+        test[rng.choice(rows, int(round(len(rows) * test_size)), replace=False)] = True
+    return test
+
+def train_model_chunked(X: np.ndarray, labels: np.ndarray, model_path: str, chunk_rows: int = 2_000_000, n_estimators: int = 50,
+                        features: list = FEATURES):
+    """
+    Out-of-core version of train_model for datasets that do not fit in RAM.
+
+    X/labels are normally the memory-mapped arrays from the dataset cache. Each chunk is split
+    70:30 (stratified) and a small forest is fitted on its training rows; the trees of all
+    chunks are then merged into one RandomForestClassifier, so the saved model (and its compiled
+    version) is used by the Lambda exactly like the in-memory one. Peak memory is one chunk plus
+    the forest, however many wells are added.
+    """
+    plan = chunk_plan(len(labels), chunk_rows)
+    # n_estimators trees in total, spread over the chunks (at least one tree per chunk)
+    trees = [max(1, n_estimators // len(plan) + (i < n_estimators % len(plan))) for i in range(len(plan))]
+    print(f"Training out of core: {len(plan)} chunks of ~{chunk_rows:,} rows, {max(trees)} trees each...")
+
+    model = None
+    train_rows = 0
+    fit_seconds = 0.0
+    for i, blocks in enumerate(plan):
+        X_chunk, y_chunk = read_chunk(X, labels, blocks)
+        train = ~chunk_split(y_chunk, seed=42 + i)
+        if len(np.unique(y_chunk[train])) < 2:
+            print(f"  chunk {i + 1}/{len(plan)}: only one class, skipped")
+            continue
+        chunk_model = RandomForestClassifier(
+            n_estimators=trees[i],
+            max_depth=10,
+            random_state=42 + i,
+            n_jobs=-1,
+            class_weight="balanced"
+        )
+        start = time.perf_counter()
+        chunk_model.fit(pd.DataFrame(X_chunk[train], columns=features), y_chunk[train])
+        fit_seconds += time.perf_counter() - start
+        train_rows += int(train.sum())
+
+        # Merging is just concatenating estimators: every chunk forest has classes_ == [0, 1]
+        if model is None:
+            model = chunk_model
+        else:
+            model.estimators_ += chunk_model.estimators_
+            model.n_estimators = len(model.estimators_)
+    if model is None:
+        raise ValueError("No chunk contained both classes.")
+    print(f"Training complete: {model.n_estimators} trees on {train_rows:,} rows "
+          f"({train_rows / max(fit_seconds, 1e-9):,.0f} rows/s).")
+
+    # Evaluate the merged forest on every chunk's held-out 30%, one chunk at a time
+    print("\nEvaluating Model Accuracy on 30% Test Set:")
+    y_test, y_pred = [], []
+    for i, blocks in enumerate(plan):
+        X_chunk, y_chunk = read_chunk(X, labels, blocks)
+        test = chunk_split(y_chunk, seed=42 + i)
+        y_test.append(y_chunk[test])
+        y_pred.append(model.predict(pd.DataFrame(X_chunk[test], columns=features)).astype(np.int8))
+    y_test, y_pred = np.concatenate(y_test), np.concatenate(y_pred)
+    print(classification_report(y_test, y_pred, target_names=["Normal (0)", "Anomaly (1)"]))
+
+    save_model(model, model_path)
+    return model
+
 
 MODEL_PATH = "model.joblib"
 
-# 1. Download/Load data via kagglehub
-training_data = load_data()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the 3W anomaly Random Forest.")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--sample-frac", type=float, default=1.0)
+    parser.add_argument("--chunk-rows", type=int, default=0,
+                        help="Train out of core on chunks of this many rows instead of in memory")
+    parser.add_argument("--windows", default="",
+                        help="Comma-separated rolling windows in samples (seconds), e.g. 60,300")
+    args = parser.parse_args()
+
+    # Raw sensors plus mean/std/slope/delta over every window; the Lambda reads them back from the model
+    windows = [int(window) for window in args.windows.split(",") if window]
+    features = FEATURES + rolling.rolling_feature_names(FEATURES, windows)
 
-# 2. Train and save model
-train_model(training_data, MODEL_PATH)
+    if args.chunk_rows:
+        # 1. Memory-map the cleaned dataset, 2. train chunk by chunk and save the merged model
+        X, labels = load_arrays(args.sample_frac, features=features)
+        train_model_chunked(X, labels, args.model_path, chunk_rows=args.chunk_rows, features=features)
+    else:
+        # 1. Download/Load data via kagglehub
+        training_data = load_data(args.sample_frac, features=features)
 
-print("\n--- Next Steps ---")
-print("1. To deploy, the \"model.joblib\" file should be uploaded to the S3 raw-data bucket.")
-print("2. The inference Lambda/ECS container will download it to make predictions.")
+        # 2. Train and save model
+        train_model(training_data, args.model_path)
 
+    print("\n--- Next Steps ---")
+    print("1. To deploy, the \"model.joblib\" file should be uploaded to the S3 raw-data bucket.")
+    print("   Upload \"model.forest.npz\" too when the Lambda runs with INFERENCE_ENGINE=compiled.")
+    print("2. The inference Lambda/ECS container will download it to make predictions.")